@@ -3,7 +3,7 @@ from .models import Server, EventType, EmergencyEvent, DroneData
 
 @admin.register(Server)
 class ServerAdmin(admin.ModelAdmin):
-    list_display = ('name', 'ip_address', 'port', 'is_active', 'created_at')
+    list_display = ('name', 'ip_address', 'port', 'tcp_port', 'is_active', 'created_at')
     search_fields = ('name', 'ip_address')
     list_filter = ('is_active',)
 
@@ -8,6 +8,16 @@ class ApiConfig(AppConfig):
     name = 'api'
 
     def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_delete, post_save
+        from api.geofence import invalidate_on_change
+        from api.models import EmergencyEvent
+        from api.storage import configure_sqlite
+        connection_created.connect(configure_sqlite)
+        post_save.connect(invalidate_on_change, sender=EmergencyEvent)
+        post_delete.connect(invalidate_on_change, sender=EmergencyEvent)
+
         # Запускаем серверы только один раз при запуске через runserver
         if os.environ.get('RUN_MAIN', None) != 'true':
             return
@@ -22,9 +32,15 @@ class ApiConfig(AppConfig):
             from api.tcp_server import start_tcp_server
             from api.udp_server import start_udp_server
             
+            from api.probes import start_probe_scheduler
+            
             print("Автоматический запуск TCP и UDP серверов...")
             tcp_server = start_tcp_server()
             udp_server = start_udp_server()
+            start_probe_scheduler()
+            if settings.FEDERATION_ENABLED:
+                from api.federation import start_federation
+                start_federation(tcp_server)
             print("Серверы запущены!")
         except Exception as e:
             print(f"Ошибка при запуске серверов: {e}")
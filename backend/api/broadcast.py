@@ -0,0 +1,267 @@
+"""
+Отправка сообщений в группы channel layer из синхронных потоков серверов.
+
+Сообщения отправляет один фоновый поток из трёх очередей по приоритету:
+
+    - оповещения о ЧС — по порядку и всегда в первую очередь;
+    - изменения состояния (переходы дронов, доступность серверов, словарь
+      телеметрии) — по порядку, без потерь;
+    - телеметрия — хранится по ключу, например по дрону: пока сообщение ждёт
+      отправки, новое с тем же ключом заменяет его, а при переполнении
+      очереди новые ключи отбрасываются.
+
+Подряд идущие сообщения одной группы уходят одним сообщением broadcast_batch
+(до BROADCAST_BATCH_SIZE), а перед каждой отправкой заново проверяются
+очереди с более высоким приоритетом. Поэтому поток телеметрии и переходов
+не задерживает оповещения ни в очереди отправки, ни в очередях каналов
+потребителей.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .log import get_logger
+from .metrics import (
+    BROADCAST_PENDING, BROADCAST_QUEUE_SECONDS, BROADCAST_RETRIES, BROADCAST_TELEMETRY,
+    CHANNEL_SENDS, CHANNEL_SEND_SECONDS,
+)
+from .tracing import stamp
+
+EMERGENCY_GROUP = "emergency_broadcasts"
+EVENT_GROUP_PREFIX = "event_"
+TELEMETRY_GROUP = "drone_telemetry"
+
+ALERT_LANE = 'alert'
+STATE_LANE = 'state'
+TELEMETRY_LANE = 'telemetry'
+LANES = (ALERT_LANE, STATE_LANE, TELEMETRY_LANE)
+
+log = get_logger('broadcast')
+
+
+def event_group(event_id):
+    """Группа подписчиков телеметрии дронов над событием"""
+    return f"{EVENT_GROUP_PREFIX}{event_id}"
+
+
+def event_payload(event):
+    """Представление события ЧС для клиентов WebSocket"""
+    return {
+        "id": event.id,
+        "title": event.title,
+        "description": event.description,
+        "event_type": event.event_type.name,
+        "location": event.location,
+        "severity": event.get_severity_display(),
+        "created_at": event.created_at.isoformat(),
+    }
+
+
+class Broadcaster:
+    """
+    Очереди отправки и поток, который их разбирает.
+
+    Поток запускается при первой отправке. Если потребители WebSocket
+    работают в этом же процессе, group_send выполняется в их цикле событий
+    (см. attach): InMemoryChannelLayer не будит потребителя, если запись в
+    его очередь сделана из чужого цикла, и сообщение ждёт до следующего
+    пробуждения цикла. Иначе используется собственный цикл в отдельном потоке.
+
+    Одновременно идёт одна отправка, поэтому оповещение может ждать
+    завершения уже начатой отправки другой очереди, но не очереди за ней.
+    Неотправленные оповещения и изменения состояния возвращаются в начало
+    своей очереди (до BROADCAST_RETRY_LIMIT повторов), телеметрия не
+    повторяется.
+    """
+
+    def __init__(self, telemetry_limit=None, batch_size=None, send_timeout=None, retry_limit=None):
+        self.telemetry_limit = telemetry_limit or settings.BROADCAST_TELEMETRY_LIMIT
+        self.batch_size = batch_size or settings.BROADCAST_BATCH_SIZE
+        self.send_timeout = send_timeout or settings.BROADCAST_SEND_TIMEOUT
+        self.retry_limit = retry_limit if retry_limit is not None else settings.BROADCAST_RETRY_LIMIT
+        # Очереди по убыванию приоритета: (группа, сообщение, время постановки, попытка)
+        self.lanes = {ALERT_LANE: deque(), STATE_LANE: deque()}
+        self.telemetry = OrderedDict()  # группа -> {ключ: (сообщение, время постановки)}
+        self.telemetry_pending = 0
+        self.retry_at = {}  # очередь -> время, до которого повтор не отправляется
+        self.loop = None
+        self.own_loop = None
+        self._wakeup = threading.Condition()
+        self.thread = None
+
+    def attach(self, loop):
+        """Отправлять в цикле событий ASGI-сервера (вызывается потребителями)"""
+        self.loop = loop
+
+    def publish(self, group, message, lane=STATE_LANE):
+        with self._wakeup:
+            self.lanes[lane].append((group, message, time.monotonic(), 0))
+            self.ensure_started()
+            self._wakeup.notify()
+        BROADCAST_PENDING.labels(lane).inc()
+
+    def publish_telemetry(self, group, key, message):
+        """Результат: 'queued', 'coalesced' (заменило ждущее) или 'dropped'"""
+        with self._wakeup:
+            messages = self.telemetry.get(group)
+            if messages is not None and key in messages:
+                # Время постановки сохраняется: задержка считается от первого сообщения
+                messages[key] = (message, messages[key][1])
+                result = 'coalesced'
+            elif self.telemetry_pending >= self.telemetry_limit:
+                result = 'dropped'
+            else:
+                if messages is None:
+                    messages = self.telemetry[group] = {}
+                messages[key] = (message, time.monotonic())
+                self.telemetry_pending += 1
+                result = 'queued'
+                self.ensure_started()
+                self._wakeup.notify()
+        BROADCAST_TELEMETRY.labels(result).inc()
+        if result == 'queued':
+            BROADCAST_PENDING.labels(TELEMETRY_LANE).inc()
+        return result
+
+    def telemetry_queued(self, group, key):
+        """Ждёт ли отправки телеметрия группы с этим ключом"""
+        with self._wakeup:
+            return key in self.telemetry.get(group, ())
+
+    def ensure_started(self):
+        if self.thread is None:
+            self.own_loop = asyncio.new_event_loop()
+            threading.Thread(target=self.own_loop.run_forever, name='broadcast-loop', daemon=True).start()
+            self.thread = threading.Thread(target=self.run, name='broadcast', daemon=True)
+            self.thread.start()
+
+    def lane_ready(self, lane, now):
+        """Можно ли сейчас отправлять из очереди (под блокировкой)"""
+        if self.retry_at.get(lane, 0) > now:
+            return False
+        return bool(self.telemetry if lane == TELEMETRY_LANE else self.lanes[lane])
+
+    def wait_timeout(self, now):
+        """Сколько ждать до ближайшего повтора; None — до уведомления"""
+        deadlines = [at for at in self.retry_at.values() if at > now]
+        return max(min(deadlines) - now, 0.001) if deadlines else None
+
+    def next_message(self):
+        """Следующая отправка: (очередь, группа, [(группа, сообщение, время постановки, попытка)])"""
+        with self._wakeup:
+            while True:
+                now = time.monotonic()
+                lane = next((lane for lane in LANES if self.lane_ready(lane, now)), None)
+                if lane is not None:
+                    break
+                self._wakeup.wait(self.wait_timeout(now))
+            if lane != TELEMETRY_LANE:
+                pending = self.lanes[lane]
+                group = pending[0][0]
+                batch = []
+                while pending and pending[0][0] == group and len(batch) < self.batch_size:
+                    batch.append(pending.popleft())
+                return lane, group, batch
+            group, messages = next(iter(self.telemetry.items()))
+            keys = list(messages)[:self.batch_size]
+            batch = [(group, *messages.pop(key), 0) for key in keys]
+            if messages:
+                # Остаток группы отправится после других групп
+                self.telemetry.move_to_end(group)
+            else:
+                del self.telemetry[group]
+            self.telemetry_pending -= len(batch)
+        return lane, group, batch
+
+    def run(self):
+        while True:
+            lane, group, batch = self.next_message()
+            now = time.monotonic()
+            BROADCAST_PENDING.labels(lane).dec(len(batch))
+            for _, _, queued_at, attempt in batch:
+                if not attempt:
+                    BROADCAST_QUEUE_SECONDS.labels(lane).observe(now - queued_at)
+            if len(batch) == 1:
+                message = batch[0][1]
+            else:
+                message = {'type': 'broadcast_batch', 'messages': [item[1] for item in batch]}
+
+            self.deliver(lane, group, batch, message)
+
+    def submit(self, group, message):
+        """Запустить group_send в цикле потребителей или в собственном цикле"""
+        loop = self.loop
+        if loop is None or not loop.is_running():
+            loop = self.own_loop
+        return asyncio.run_coroutine_threadsafe(get_channel_layer().group_send(group, message), loop)
+
+    def deliver(self, lane, group, batch, message):
+        """Отправить и дождаться результата; при ошибке — повтор (кроме телеметрии)"""
+        start = time.perf_counter()
+        future = self.submit(group, message)
+        try:
+            future.result(self.send_timeout)
+        except Exception as e:
+            future.cancel()
+            self.sent(lane, group, batch, start, e)
+        else:
+            self.sent(lane, group, batch, start)
+
+    def sent(self, lane, group, batch, start, error=None):
+        # Группы событий учитываются под одной меткой, чтобы не плодить ряды метрик
+        label = "event" if group.startswith(EVENT_GROUP_PREFIX) else group
+        CHANNEL_SEND_SECONDS.labels(label).observe(time.perf_counter() - start)
+        if error is None:
+            CHANNEL_SENDS.labels(label, 'ok').inc()
+            return
+        CHANNEL_SENDS.labels(label, 'error').inc()
+        log.error("Ошибка отправки в channel layer", extra={"fields": {"group": group, "error": str(error) or type(error).__name__}})
+        if lane != TELEMETRY_LANE:
+            self.retry(lane, batch)
+
+    def retry(self, lane, batch):
+        """Вернуть неотправленные сообщения в начало очереди, кроме исчерпавших повторы"""
+        retried = [(group, message, queued_at, attempt + 1)
+                   for group, message, queued_at, attempt in batch if attempt < self.retry_limit]
+        dropped = len(batch) - len(retried)
+        if dropped:
+            BROADCAST_RETRIES.labels(lane, 'dropped').inc(dropped)
+            log.error("Сообщения не отправлены после повторов", extra={"fields": {"lane": lane, "messages": dropped}})
+        if not retried:
+            return
+        with self._wakeup:
+            self.lanes[lane].extendleft(reversed(retried))
+            # Пауза перед повтором, чтобы не крутиться, пока channel layer недоступен
+            self.retry_at[lane] = time.monotonic() + min(0.05 * 2 ** retried[0][3], 1.0)
+            self._wakeup.notify()
+        BROADCAST_PENDING.labels(lane).inc(len(retried))
+        BROADCAST_RETRIES.labels(lane, 'retried').inc(len(retried))
+
+
+BROADCASTER = Broadcaster()
+
+
+def group_send(group, message, trace=None, lane=STATE_LANE):
+    """
+    Поставить сообщение в очередь отправки (оповещения — lane=ALERT_LANE).
+
+    Если передан trace, он отмечается временем отправки и уходит вместе
+    с сообщением, чтобы потребитель мог измерить оставшиеся этапы.
+    """
+    if trace is not None:
+        stamp(trace, 'sent')
+        message = dict(message, trace=trace)
+    BROADCASTER.publish(group, message, lane)
+
+
+def group_send_telemetry(group, key, message, trace=None):
+    """Поставить телеметрию в очередь; сообщение с тем же ключом заменяется"""
+    if trace is not None:
+        stamp(trace, 'sent')
+        message = dict(message, trace=trace)
+    return BROADCASTER.publish_telemetry(group, key, message)
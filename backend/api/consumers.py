@@ -1,15 +1,36 @@
+import asyncio
 import json
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from .models import EmergencyEvent
+from .metrics import WS_CONNECTIONS, WS_ACTIVE_CONNECTIONS, WS_MESSAGES_SENT
+from .tracing import elapsed, record
+from .broadcast import BROADCASTER, TELEMETRY_GROUP, event_group, event_payload
+from .liveness import current_drone_states
+from .telemetry import current_dictionary
 
-class EmergencyConsumer(AsyncWebsocketConsumer):
+class BroadcastConsumer(AsyncWebsocketConsumer):
+    """Потребитель групп, в которые отправляет api.broadcast"""
+
+    async def broadcast_batch(self, event):
+        # Несколько сообщений группы, отправленных одной пачкой
+        for message in event['messages']:
+            await self.dispatch(message)
+
+
+class EmergencyConsumer(BroadcastConsumer):
     async def connect(self):
+        BROADCASTER.attach(asyncio.get_running_loop())
         await self.channel_layer.group_add(
             "emergency_broadcasts",
             self.channel_name
         )
         await self.accept()
+        self.event_groups = set()
+        WS_CONNECTIONS.labels('emergency').inc()
+        WS_ACTIVE_CONNECTIONS.labels('emergency').inc()
         
         # Отправить текущие активные ЧС при подключении
         events = await self.get_active_events()
@@ -17,36 +38,142 @@ class EmergencyConsumer(AsyncWebsocketConsumer):
             'type': 'initial_events',
             'events': events
         }))
+        # Дроны без связи или с низким зарядом: далее приходят только переходы
+        await self.send(text_data=json.dumps({
+            'type': 'drone_states',
+            'drones': await sync_to_async(current_drone_states)()
+        }))
 
     async def disconnect(self, close_code):
+        WS_ACTIVE_CONNECTIONS.labels('emergency').dec()
+        for group in getattr(self, 'event_groups', ()):
+            await self.channel_layer.group_discard(group, self.channel_name)
         await self.channel_layer.group_discard(
             "emergency_broadcasts",
             self.channel_name
         )
 
     async def receive(self, text_data):
-        # Клиент может отправить сообщение, но мы его игнорируем
-        pass
+        # Клиент может подписаться на телеметрию дронов над событием:
+        # {"action": "subscribe" | "unsubscribe", "event_id": 1}
+        try:
+            message = json.loads(text_data)
+            action = message.get('action')
+            event_id = int(message.get('event_id'))
+        except (TypeError, ValueError, AttributeError):
+            return
+        group = event_group(event_id)
+        if action == 'subscribe' and group not in self.event_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+            self.event_groups.add(group)
+        elif action == 'unsubscribe' and group in self.event_groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+            self.event_groups.discard(group)
+        else:
+            return
+        await self.send(text_data=json.dumps({'type': f'{action}d', 'event_id': event_id}))
+
+    async def drone_data(self, event):
+        # Телеметрия дрона над событием, на которое подписан клиент
+        await self.send_traced({
+            'type': 'drone_data',
+            'data': event['data']
+        }, event.get('trace'))
 
     async def emergency_broadcast(self, event):
         # Отправка сообщения о ЧС клиенту
-        await self.send(text_data=json.dumps({
+        await self.send_traced({
             'type': 'emergency_event',
             'event': event['event']
-        }))
+        }, event.get('trace'))
+
+    async def drone_state(self, event):
+        # Переход состояния дрона (связь, заряд, статус)
+        await self.send_traced({
+            'type': 'drone_transition',
+            'transition': event['transition']
+        })
+
+    async def server_status(self, event):
+        # Изменение доступности зарегистрированного сервера
+        await self.send_traced({
+            'type': 'server_status',
+            'server': event['server']
+        })
+
+    async def send_traced(self, payload, trace=None):
+        """Отправить сообщение клиенту, замерив этапы доставки по trace"""
+        if trace is None:
+            await self.send(text_data=json.dumps(payload))
+        else:
+            record('channel_layer', elapsed(trace, 'sent'))
+            payload['trace_id'] = trace['id']
+            start = time.perf_counter()
+            await self.send(text_data=json.dumps(payload))
+            record('consumer_send', time.perf_counter() - start)
+            record('end_to_end', elapsed(trace, 'recv'))
+        WS_MESSAGES_SENT.labels(payload['type']).inc()
     
     @database_sync_to_async
     def get_active_events(self):
         events = EmergencyEvent.objects.filter(is_active=True)
-        event_data = []
-        for event in events:
-            event_data.append({
-                'id': event.id,
-                'title': event.title,
-                'description': event.description,
-                'event_type': event.event_type.name,
-                'location': event.location,
-                'severity': event.get_severity_display(),
-                'created_at': event.created_at.isoformat(),
-            })
-        return event_data 
\ No newline at end of file
+        return [event_payload(event) for event in events.select_related('event_type')]
+
+
+class TelemetryConsumer(BroadcastConsumer):
+    """
+    Бинарные кадры положения дронов для карты (формат в api/telemetry.py).
+
+    Словарь идентификаторов отправляется текстовым сообщением drone_dictionary
+    при подключении, далее — только его дополнения.
+    """
+
+    async def connect(self):
+        self.epoch = None
+        self.dictionary_size = 0
+        BROADCASTER.attach(asyncio.get_running_loop())
+        await self.channel_layer.group_add(TELEMETRY_GROUP, self.channel_name)
+        await self.accept()
+        WS_CONNECTIONS.labels('telemetry').inc()
+        WS_ACTIVE_CONNECTIONS.labels('telemetry').inc()
+        await self.send_dictionary()
+
+    async def disconnect(self, close_code):
+        WS_ACTIVE_CONNECTIONS.labels('telemetry').dec()
+        await self.channel_layer.group_discard(TELEMETRY_GROUP, self.channel_name)
+
+    async def send_dictionary(self):
+        """Отправить полный словарь из кэша"""
+        dictionary = await sync_to_async(current_dictionary)()
+        if dictionary is None:
+            return
+        self.epoch = dictionary['epoch']
+        self.dictionary_size = len(dictionary['drone_ids'])
+        await self.send_dictionary_part(0, dictionary['drone_ids'])
+
+    async def send_dictionary_part(self, offset, drone_ids):
+        await self.send(text_data=json.dumps({
+            'type': 'drone_dictionary',
+            'epoch': self.epoch,
+            'offset': offset,
+            'drone_ids': drone_ids,
+        }))
+        WS_MESSAGES_SENT.labels('drone_dictionary').inc()
+
+    async def telemetry_dictionary(self, event):
+        if event['epoch'] != self.epoch or event['offset'] > self.dictionary_size:
+            # Сервер приёма перезапущен или дополнение пропущено
+            await self.send_dictionary()
+            return
+        new = event['drone_ids'][self.dictionary_size - event['offset']:]
+        if new:
+            await self.send_dictionary_part(self.dictionary_size, new)
+            self.dictionary_size += len(new)
+
+    async def telemetry_frame(self, event):
+        if event['epoch'] != self.epoch or event['dictionary_size'] > self.dictionary_size:
+            await self.send_dictionary()
+            if event['epoch'] != self.epoch or event['dictionary_size'] > self.dictionary_size:
+                return  # словарь ещё не в кэше — клиент не сможет разобрать кадр
+        await self.send(bytes_data=event['frame'])
+        WS_MESSAGES_SENT.labels('telemetry_frame').inc()
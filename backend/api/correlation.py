@@ -0,0 +1,127 @@
+"""
+Корреляция оповещений МЧС: повторные сообщения о том же происшествии
+объединяются с уже созданным событием.
+
+Ключ — тип события и нормализованное место; индекс — словарь по ключу
+с истечением записей через кучу сроков. Пока первое оповещение по ключу
+сохраняется, параллельные дубликаты ждут его, а не создают второе событие.
+"""
+
+import heapq
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import REGISTRY
+
+ALERTS_SUPPRESSED = REGISTRY.counter(
+    'alert_correlation_suppressed_total', 'Оповещения, объединённые с существующим событием'
+)
+ALERTS_ESCALATED = REGISTRY.counter(
+    'alert_correlation_escalated_total', 'Повышения серьёзности события повторным оповещением'
+)
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize(text):
+    """Нижний регистр, ё→е, без пунктуации и лишних пробелов"""
+    text = str(text or '').lower().replace('ё', 'е')
+    return ' '.join(_NON_WORD.sub(' ', text).split())
+
+
+class Correlation:
+    """Запись индекса: событие, его серьёзность и число подавленных дубликатов"""
+
+    def __init__(self, expires_at):
+        self.event_id = None
+        self.severity = None
+        self.duplicates = 0
+        self.expires_at = expires_at
+        self.ready = threading.Event()
+
+
+class AlertCorrelator:
+    def __init__(self, window=None):
+        self.window = window if window is not None else settings.ALERT_CORRELATION_WINDOW
+        self._index = {}
+        self._expiry = []  # (expires_at, key)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(event_type, location):
+        return normalize(event_type), normalize(location)
+
+    def _purge(self, now):
+        pending = []
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, key = heapq.heappop(self._expiry)
+            entry = self._index.get(key)
+            # Ключ мог быть занят заново — удаляем только истёкшую запись
+            if entry is None or entry.expires_at != expires_at:
+                continue
+            if entry.ready.is_set():
+                del self._index[key]
+            else:
+                # Событие ещё сохраняется: срок проверяется при следующей очистке
+                pending.append((expires_at, key))
+        for item in pending:
+            heapq.heappush(self._expiry, item)
+
+    def claim(self, key, timeout=5.0):
+        """
+        Занять ключ для нового события или найти существующее.
+
+        Возвращает (True, запись), если вызывающий должен создать событие
+        и затем вызвать commit() или release(); иначе (False, запись) с
+        уже созданным событием: если оно ещё открыто, дубликат учитывается
+        через merged(), иначе запись освобождается через release().
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._purge(now)
+                entry = self._index.get(key)
+                if entry is None:
+                    entry = Correlation(now + self.window)
+                    self._index[key] = entry
+                    heapq.heappush(self._expiry, (entry.expires_at, key))
+                    return True, entry
+                if entry.ready.is_set():
+                    return False, entry
+            # Первое оповещение по ключу ещё сохраняется — ждём его
+            if not entry.ready.wait(max(deadline - time.monotonic(), 0)):
+                return True, None
+
+    def commit(self, entry, event_id, severity):
+        entry.event_id = event_id
+        entry.severity = severity
+        entry.ready.set()
+
+    def release(self, key, entry):
+        """Освободить ключ, если событие не удалось создать или оно закрыто"""
+        with self._lock:
+            if self._index.get(key) is entry:
+                del self._index[key]
+        entry.ready.set()
+
+    def merged(self, entry):
+        """Учесть дубликат, объединённый с открытым событием записи"""
+        with self._lock:
+            entry.duplicates += 1
+        ALERTS_SUPPRESSED.inc()
+
+    def escalate(self, entry, severity):
+        """Запомнить новую серьёзность; True, если она выше прежней"""
+        with self._lock:
+            if severity <= entry.severity:
+                return False
+            entry.severity = severity
+        ALERTS_ESCALATED.inc()
+        return True
+
+
+CORRELATOR = AlertCorrelator()
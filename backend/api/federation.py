@@ -0,0 +1,441 @@
+"""
+Репликация оповещений между узлами системы.
+
+Список узлов — зарегистрированные серверы (модель Server) с заполненным
+tcp_port — портом TCP-сервера приёма другого узла. Для каждого узла держится
+одно постоянное соединение: оповещения копятся в очереди, уходят пачками
+(federated_alerts) и отправляются конвейером — до FEDERATION_PIPELINE_DEPTH
+полных пачек без ожидания подтверждения. Неподтверждённые пачки после обрыва
+отправляются повторно, поэтому доставка — не менее одного раза; дубликаты
+и петли отсекаются по паре (узел-источник, id события на нём).
+
+Реплицируются только события, созданные на этом узле; полученные от
+других узлов события дальше не пересылаются.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .broadcast import ALERT_LANE, EMERGENCY_GROUP, event_payload, group_send
+from .framing import encode_frame
+from .geofence import GEOFENCES, parse_geofence_fields
+from .log import get_logger
+from .metrics import REGISTRY
+from .models import EmergencyEvent, Server
+from .storage import event_type_by_name, reset_connection_if_unusable
+from .tracing import record
+
+log = get_logger('federation')
+
+# Предел BigIntegerField для origin_event_id
+MAX_EVENT_ID = 2 ** 63 - 1
+
+FEDERATION_FRAMES = REGISTRY.counter(
+    'federation_frames_total', 'Пачки репликации, отправленные узлам', ('result',)
+)
+FEDERATION_ALERTS = REGISTRY.counter(
+    'federation_alerts_total', 'Реплицируемые оповещения', ('result',)
+)
+FEDERATION_PENDING = REGISTRY.gauge(
+    'federation_pending_alerts', 'Оповещения в очередях репликации и без подтверждения'
+)
+FEDERATION_LAG_SECONDS = REGISTRY.histogram(
+    'federation_replication_lag_seconds',
+    'Задержка от приёма оповещения на исходном узле до создания реплики'
+)
+
+
+def federated_alert(event, trace=None):
+    """Оповещение для репликации: событие и время его приёма на исходном узле"""
+    return {
+        "id": event.id,
+        "title": event.title,
+        "description": event.description,
+        "event_type": event.event_type.name,
+        "location": event.location,
+        "severity": event.severity,
+        "latitude": event.latitude,
+        "longitude": event.longitude,
+        "radius_m": event.radius_m,
+        "geofence": event.geofence,
+        "received_wall": trace["recv_wall"] if trace else time.time(),
+    }
+
+
+def apply_federated_alerts(message, node_id, reply):
+    """
+    Применить пачку федеративных оповещений и подтвердить её через reply.
+
+    Новые события создаются и рассылаются локальным клиентам, повтор
+    известного события лишь повышает серьёзность, если она выросла.
+    Подтверждение уходит до рассылки, чтобы не задерживать следующие пачки.
+    """
+    origin = message.get("origin")
+    alerts = []
+    rejected = 0
+    for alert in message.get("alerts") or ():
+        # Оповещение с некорректным id отбрасывается, а не срывает всю пачку:
+        # отказ (nack) заставил бы узел-источник повторять её бесконечно
+        alert_id = alert.get("id") if isinstance(alert, dict) else None
+        if isinstance(alert_id, bool) or not isinstance(alert_id, int) or not 0 < alert_id <= MAX_EVENT_ID:
+            rejected += 1
+            continue
+        alerts.append(alert)
+    ack = {"type": "federated_ack", "seq": message.get("seq"), "applied": 0, "duplicates": 0, "rejected": rejected}
+    if rejected:
+        FEDERATION_ALERTS.labels('rejected').inc(rejected)
+        log.warning("Некорректные оповещения в пачке репликации", extra={"fields": {
+            "origin": origin, "seq": message.get("seq"), "rejected": rejected
+        }})
+    if not origin or origin == node_id:
+        # Собственные события не принимаем обратно
+        ack["duplicates"] = len(alerts)
+        reply(ack)
+        return
+
+    known = dict(EmergencyEvent.objects.filter(
+        origin_node=origin, origin_event_id__in=[alert.get("id") for alert in alerts]
+    ).values_list('origin_event_id', 'id'))
+    event_types = {}
+    changed = []
+    geofence_changed = False
+
+    pending = {}  # origin_event_id -> (оповещение, новое событие)
+    for alert in alerts:
+        severity = alert.get("severity")
+        if isinstance(severity, bool) or severity not in (1, 2, 3, 4):
+            severity = 2
+        if alert.get("id") in pending:
+            # Повтор нового события в той же пачке (например, повышение
+            # серьёзности за время добора пачки) — в создаваемое событие
+            event = pending[alert["id"]][1]
+            escalated = severity > event.severity
+            event.severity = max(event.severity, severity)
+            FEDERATION_ALERTS.labels('escalated' if escalated else 'duplicate').inc()
+            ack["duplicates"] += 1
+            continue
+        if alert.get("id") in known:
+            updated = EmergencyEvent.objects.filter(
+                pk=known[alert["id"]], severity__lt=severity
+            ).update(severity=severity)
+            FEDERATION_ALERTS.labels('escalated' if updated else 'duplicate').inc()
+            ack["duplicates"] += 1
+            if updated:
+                changed.append(known[alert["id"]])
+            continue
+        name = alert.get("event_type") or "Неизвестный тип"
+        if name not in event_types:
+            event_types[name] = event_type_by_name(name)
+        try:
+            geofence = parse_geofence_fields(alert)
+        except ValueError:
+            geofence = {}
+        pending[alert["id"]] = (alert, EmergencyEvent(
+            title=alert.get("title", "Без названия"),
+            description=alert.get("description", ""),
+            event_type=event_types[name],
+            location=alert.get("location", ""),
+            severity=severity,
+            is_active=True,
+            origin_node=origin,
+            origin_event_id=alert["id"],
+            **geofence
+        ))
+
+    # Новые события пачки — одной транзакцией, начинающейся с записи: в SQLite
+    # транзакция, начатая чтением, не может дождаться блокировки записи
+    try:
+        with transaction.atomic():
+            created = EmergencyEvent.objects.bulk_create([event for _, event in pending.values()])
+    except IntegrityError:
+        # Часть пачки уже применена параллельным соединением — по одному событию
+        created = []
+        for _, event in pending.values():
+            try:
+                with transaction.atomic():
+                    event.save()
+                created.append(event)
+            except IntegrityError:
+                FEDERATION_ALERTS.labels('duplicate').inc()
+                ack["duplicates"] += 1
+
+    now = time.time()
+    received = {id(event): alert for alert, event in pending.values()}
+    for event in created:
+        alert = received[id(event)]
+        changed.append(event.id)
+        geofence_changed = geofence_changed or event.latitude is not None or bool(event.geofence)
+        ack["applied"] += 1
+        FEDERATION_ALERTS.labels('applied').inc()
+        if alert.get("received_wall"):
+            lag = max(now - alert["received_wall"], 0.0)
+            FEDERATION_LAG_SECONDS.observe(lag)
+            record('replication', lag)
+
+    reply(ack)
+    if geofence_changed:
+        GEOFENCES.invalidate()
+    for event in EmergencyEvent.objects.select_related('event_type').filter(pk__in=changed):
+        group_send(EMERGENCY_GROUP, {"type": "emergency_broadcast", "event": event_payload(event)}, lane=ALERT_LANE)
+
+
+class SelfPeer(Exception):
+    """Адрес из реестра указывает на этот же узел"""
+
+
+class PeerLink:
+    """Постоянное соединение с одним узлом: очередь, конвейер и повторы"""
+
+    def __init__(self, federation, server_id, host, port):
+        self.federation = federation
+        self.server_id = server_id
+        self.host = host
+        self.port = port
+        self.queue = deque()
+        self.inflight = OrderedDict()  # seq -> (момент отправки, оповещения)
+        self.seq = 0
+        self.wakeup = asyncio.Event()
+        self.failures = 0
+        self.paused_until = 0
+        self.task = None
+
+    def enqueue(self, alert):
+        if len(self.queue) >= self.federation.queue_size:
+            self.queue.popleft()
+            FEDERATION_ALERTS.labels('dropped').inc()
+            FEDERATION_PENDING.dec()
+        self.queue.append(alert)
+        FEDERATION_PENDING.inc()
+        self.wakeup.set()
+
+    def requeue_inflight(self):
+        """Вернуть неподтверждённые пачки в начало очереди в исходном порядке"""
+        for _, alerts in reversed(self.inflight.values()):
+            self.queue.extendleft(reversed(alerts))
+            FEDERATION_FRAMES.labels('retried').inc()
+        self.inflight.clear()
+
+    def discard(self):
+        FEDERATION_PENDING.dec(len(self.queue) + sum(len(a) for _, a in self.inflight.values()))
+        self.queue.clear()
+        self.inflight.clear()
+
+    async def run(self):
+        federation = self.federation
+        while True:
+            try:
+                await self.session()
+            except SelfPeer:
+                log.info("Узел в реестре совпадает с текущим, репликация не нужна", extra={"fields": {"server_id": self.server_id}})
+                self.discard()
+                return
+            except (OSError, EOFError, ValueError, asyncio.TimeoutError) as e:
+                self.failures += 1
+                log.warning("Соединение с узлом потеряно", extra={"fields": {
+                    "server_id": self.server_id, "peer": f"{self.host}:{self.port}", "error": str(e) or type(e).__name__
+                }})
+            finally:
+                self.requeue_inflight()
+            delay = min(federation.retry_interval * 2 ** (self.failures - 1), federation.max_backoff)
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+
+    async def session(self):
+        federation = self.federation
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, limit=federation.read_limit),
+            federation.timeout
+        )
+        acks = None
+        try:
+            greeting = json.loads(await asyncio.wait_for(reader.readline(), federation.timeout) or b'null')
+            if not isinstance(greeting, dict):
+                raise EOFError("узел не прислал приветствие")
+            if greeting.get("node_id") == federation.node_id:
+                raise SelfPeer()
+            self.failures = 0
+            acks = asyncio.ensure_future(self.read_acks(reader))
+            while True:
+                if acks.done():
+                    acks.result()
+                # Пока пачка ждёт подтверждения, следующие уходят только полными:
+                # под нагрузкой оповещения копятся в крупные пачки, а не в мелкие кадры
+                if self.queue and len(self.inflight) < federation.pipeline_depth and (
+                        not self.inflight or len(self.queue) >= federation.batch_size):
+                    pause = self.paused_until - time.monotonic()
+                    if pause > 0:
+                        await asyncio.sleep(pause)
+                    elif len(self.queue) < federation.batch_size:
+                        # Небольшая задержка собирает оповещения одной волны в пачку
+                        await asyncio.sleep(federation.linger)
+                    writer.write(self.next_frame())
+                    await writer.drain()
+                    continue
+                self.wakeup.clear()
+                waiter = asyncio.ensure_future(self.wakeup.wait())
+                await asyncio.wait({waiter, acks}, return_when=asyncio.FIRST_COMPLETED)
+                waiter.cancel()
+        finally:
+            if acks is not None:
+                acks.cancel()
+            writer.close()
+
+    def next_frame(self):
+        count = min(len(self.queue), self.federation.batch_size)
+        alerts = [self.queue.popleft() for _ in range(count)]
+        self.seq += 1
+        self.inflight[self.seq] = (time.monotonic(), alerts)
+        FEDERATION_FRAMES.labels('sent').inc()
+        return encode_frame({
+            "type": "federated_alerts",
+            "origin": self.federation.node_id,
+            "seq": self.seq,
+            "alerts": alerts,
+        })
+
+    async def read_acks(self, reader):
+        ack_timeout = self.federation.ack_timeout
+        while True:
+            try:
+                line = await asyncio.wait_for(reader.readline(), ack_timeout)
+            except asyncio.TimeoutError:
+                if self.inflight and time.monotonic() - next(iter(self.inflight.values()))[0] > ack_timeout:
+                    raise
+                continue
+            if not line:
+                raise EOFError("узел закрыл соединение")
+            message = json.loads(line)
+            if message.get("type") not in ("federated_ack", "federated_nack"):
+                continue
+            sent = self.inflight.pop(message.get("seq"), None)
+            if sent is None:
+                continue
+            if message["type"] == "federated_ack":
+                FEDERATION_FRAMES.labels('acked').inc()
+                FEDERATION_PENDING.dec(len(sent[1]))
+            else:
+                # Узел не смог применить пачку: вернуть её в начало очереди
+                FEDERATION_FRAMES.labels('rejected').inc()
+                self.queue.extendleft(reversed(sent[1]))
+                self.paused_until = time.monotonic() + self.federation.retry_interval
+                log.warning("Узел отклонил пачку", extra={"fields": {"server_id": self.server_id, "error": message.get("error")}})
+            self.wakeup.set()
+
+
+class Federation:
+    """Цикл asyncio в отдельном потоке, обслуживающий соединения со всеми узлами"""
+
+    def __init__(self, node_id, address=None):
+        self.node_id = node_id
+        self.address = address
+        self.batch_size = settings.FEDERATION_BATCH_SIZE
+        self.linger = settings.FEDERATION_LINGER
+        self.pipeline_depth = settings.FEDERATION_PIPELINE_DEPTH
+        self.queue_size = settings.FEDERATION_QUEUE_SIZE
+        self.timeout = settings.FEDERATION_CONNECT_TIMEOUT
+        self.ack_timeout = settings.FEDERATION_ACK_TIMEOUT
+        self.retry_interval = settings.FEDERATION_RETRY_INTERVAL
+        self.max_backoff = settings.FEDERATION_MAX_BACKOFF
+        self.reload_interval = settings.FEDERATION_RELOAD_INTERVAL
+        self.read_limit = 1024 * 1024
+        self.peers = {}  # server_id -> PeerLink
+        # Реестр читается в одном потоке: соединение с БД переиспользуется
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='federation')
+        self.loop = None
+        self.thread = None
+        self.stopping = None
+
+    def publish(self, alert):
+        """Поставить оповещение в очереди всех узлов (из любого потока)"""
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.enqueue, alert)
+
+    def enqueue(self, alert):
+        FEDERATION_ALERTS.labels('queued').inc()
+        for peer in self.peers.values():
+            if not peer.task.done():
+                peer.enqueue(alert)
+
+    def start(self):
+        ready = threading.Event()
+        thread = threading.Thread(target=self.run, args=(ready,), daemon=True)
+        thread.start()
+        ready.wait()
+        self.thread = thread
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.thread:
+            self.thread.join()
+        self.executor.shutdown(wait=True)
+
+    def run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        self.stopping = asyncio.Event()
+        # Первая загрузка реестра до сигнала готовности: оповещения не теряются при старте
+        try:
+            self.loop.run_until_complete(self.reload())
+        except Exception as e:
+            log.error("Ошибка загрузки списка узлов", extra={"fields": {"error": str(e)}})
+        ready.set()
+        try:
+            self.loop.run_until_complete(self.main())
+        finally:
+            self.loop.close()
+
+    async def main(self):
+        log.info("Репликация запущена", extra={"fields": {"node_id": self.node_id, "peers": len(self.peers)}})
+        while not self.stopping.is_set():
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.reload_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.reload()
+            except Exception as e:
+                log.error("Ошибка загрузки списка узлов", extra={"fields": {"error": str(e)}})
+        for peer in self.peers.values():
+            peer.task.cancel()
+        await asyncio.gather(*(peer.task for peer in self.peers.values()), return_exceptions=True)
+
+    def load_servers(self):
+        try:
+            return list(Server.objects.exclude(tcp_port=None).values_list('id', 'ip_address', 'tcp_port'))
+        except Exception:
+            reset_connection_if_unusable()
+            raise
+
+    async def reload(self):
+        """Синхронизировать соединения с реестром серверов"""
+        rows = await self.loop.run_in_executor(self.executor, self.load_servers)
+        current = {
+            server_id: (host, port) for server_id, host, port in rows
+            if (host, port) != self.address
+        }
+        for server_id in list(self.peers):
+            peer = self.peers[server_id]
+            if current.get(server_id) != (peer.host, peer.port):
+                peer.task.cancel()
+                peer.discard()
+                del self.peers[server_id]
+        for server_id, (host, port) in current.items():
+            if server_id not in self.peers:
+                peer = PeerLink(self, server_id, host, port)
+                peer.task = self.loop.create_task(peer.run())
+                self.peers[server_id] = peer
+
+
+def start_federation(tcp_server):
+    """Запустить репликацию оповещений, принятых TCP-сервером"""
+    federation = Federation(tcp_server.node_id, (tcp_server.host, tcp_server.port))
+    federation.start()
+    tcp_server.federation = federation
+    return federation
@@ -0,0 +1,70 @@
+"""
+Разбор потока JSON-сообщений TCP.
+
+Клиенты МЧС отправляют по одному объекту на send(), узлы федерации —
+несколько сообщений подряд, разделённых переводом строки. Сообщения
+накапливаются в буфере и выделяются через raw_decode, поэтому сообщение
+может прийти по частям или вместе с другими. Ответы сервера завершаются
+переводом строки.
+"""
+
+import codecs
+import json
+import re
+
+MAX_BUFFER_SIZE = 8 * 1024 * 1024
+
+# Хвост, который может оказаться началом ещё не полученного токена
+_PARTIAL_TOKEN = re.compile(r'[-+.\deE]*|t(r(ue?)?)?|f(a(l(se?)?)?)?|n(u(ll?)?)?')
+
+INVALID = object()
+
+
+def encode_frame(message):
+    return (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+class JsonStream:
+    """Буфер входящих байтов, из которого выделяются целые JSON-объекты"""
+
+    def __init__(self, max_size=MAX_BUFFER_SIZE):
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.text = ''
+        self.max_size = max_size
+
+    def feed(self, data):
+        """
+        Добавить данные и вернуть список выделенных сообщений.
+
+        Нераспознаваемый фрагмент (до конца строки или буфера) возвращается
+        как INVALID. ValueError, если незавершённое сообщение превысило max_size.
+        """
+        self.text += self.utf8.decode(data)
+        messages = []
+        position = 0
+        while True:
+            while position < len(self.text) and self.text[position].isspace():
+                position += 1
+            if position == len(self.text):
+                break
+            try:
+                message, position = self.decoder.raw_decode(self.text, position)
+                messages.append(message)
+            except json.JSONDecodeError as e:
+                if self.incomplete(e):
+                    break
+                # Пропускаем испорченный фрагмент до следующей строки
+                newline = self.text.find('\n', e.pos)
+                position = len(self.text) if newline < 0 else newline + 1
+                messages.append(INVALID)
+        self.text = self.text[position:]
+        if len(self.text) > self.max_size:
+            raise ValueError("слишком длинное сообщение")
+        return messages
+
+    def incomplete(self, error):
+        """Ошибка вызвана тем, что сообщение получено не полностью"""
+        if error.msg.startswith('Unterminated string'):
+            return True
+        return _PARTIAL_TOKEN.fullmatch(self.text[error.pos:].rstrip()) is not None
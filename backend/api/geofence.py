@@ -0,0 +1,245 @@
+"""
+Геозоны активных событий ЧС и их сопоставление с телеметрией дронов.
+
+Зона события — круг (latitude, longitude, radius_m) или многоугольник
+geofence из точек [широта, долгота]. Активные зоны раскладываются по
+сетке ячеек GEOFENCE_CELL_DEGREES; проверка пакета — поиск ячейки в
+словаре и точная проверка нескольких кандидатов. Индекс неизменяем и
+перестраивается фоновым потоком из БД, поэтому поток приёма читает его
+без блокировок. Сохранение и удаление события (в том числе через REST API)
+перестраивают индекс сразу после фиксации транзакции; изменения в другом
+процессе (ingest.py) подхватываются через GEOFENCE_REFRESH_INTERVAL.
+"""
+
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .log import get_logger
+from .metrics import REGISTRY
+from .models import EmergencyEvent
+from .storage import reset_connection_if_unusable
+
+METERS_PER_DEGREE = 111320.0
+MAX_POLYGON_POINTS = 500
+
+log = get_logger('geofence')
+
+GEOFENCE_MATCHES = REGISTRY.counter(
+    'geofence_matches_total', 'Пакеты телеметрии, привязанные к событию по геозоне'
+)
+GEOFENCE_REFRESH_SECONDS = REGISTRY.histogram(
+    'geofence_refresh_seconds', 'Время перестроения индекса геозон'
+)
+
+
+def normalize_polygon(value):
+    """Проверить многоугольник и привести его к списку [[широта, долгота], ...]"""
+    if not isinstance(value, list) or not 3 <= len(value) <= MAX_POLYGON_POINTS:
+        raise ValueError(f"геозона должна быть списком из 3–{MAX_POLYGON_POINTS} точек [широта, долгота]")
+    points = []
+    for point in value:
+        if (not isinstance(point, (list, tuple)) or len(point) != 2
+                or any(isinstance(v, bool) or not isinstance(v, (int, float)) for v in point)):
+            raise ValueError("точка геозоны должна быть парой чисел [широта, долгота]")
+        lat, lon = float(point[0]), float(point[1])
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError("координаты точки геозоны вне допустимого диапазона")
+        points.append([lat, lon])
+    return points
+
+
+def parse_geofence_fields(data):
+    """
+    Поля геозоны из оповещения: latitude, longitude, radius_m, geofence.
+
+    Возвращает словарь только с переданными полями; ValueError при ошибке.
+    """
+    fields = {}
+    for key in ('latitude', 'longitude', 'radius_m'):
+        value = data.get(key)
+        if value is None:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"поле '{key}' должно быть числом")
+        fields[key] = float(value)
+    if data.get('geofence') is not None:
+        fields['geofence'] = normalize_polygon(data['geofence'])
+    validate_circle(fields.get('latitude'), fields.get('longitude'), fields.get('radius_m'))
+    return fields
+
+
+def validate_circle(latitude, longitude, radius_m):
+    if (latitude is None) != (longitude is None):
+        raise ValueError("координаты события задаются парой latitude и longitude")
+    if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError("координаты события вне допустимого диапазона")
+    if radius_m is not None:
+        if latitude is None:
+            raise ValueError("для радиуса геозоны нужны координаты события")
+        if radius_m <= 0:
+            raise ValueError("радиус геозоны должен быть положительным")
+
+
+def point_in_polygon(lat, lon, points):
+    """Проверка лучом (многоугольник небольшой, плоское приближение)"""
+    inside = False
+    j = len(points) - 1
+    for i in range(len(points)):
+        lat_i, lon_i = points[i]
+        lat_j, lon_j = points[j]
+        if (lat_i > lat) != (lat_j > lat):
+            cross = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < cross:
+                inside = not inside
+        j = i
+    return inside
+
+
+class Fence:
+    __slots__ = ('event_id', 'priority', 'bbox', 'center', 'radius_sq', 'cos_lat', 'points')
+
+    def __init__(self, event_id, severity, latitude=None, longitude=None, radius_m=None, geofence=None):
+        self.event_id = event_id
+        # При пересечении зон выбирается более серьёзное, затем более новое событие
+        self.priority = (severity, event_id)
+        self.points = geofence
+        self.center = None
+        if geofence:
+            lats = [p[0] for p in geofence]
+            lons = [p[1] for p in geofence]
+            self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        else:
+            self.center = (latitude, longitude)
+            self.cos_lat = max(math.cos(math.radians(latitude)), 1e-6)
+            self.radius_sq = radius_m ** 2
+            dlat = radius_m / METERS_PER_DEGREE
+            dlon = dlat / self.cos_lat
+            self.bbox = (latitude - dlat, longitude - dlon, latitude + dlat, longitude + dlon)
+
+    def contains(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        if self.points:
+            return point_in_polygon(lat, lon, self.points)
+        dy = (lat - self.center[0]) * METERS_PER_DEGREE
+        dx = (lon - self.center[1]) * METERS_PER_DEGREE * self.cos_lat
+        return dx * dx + dy * dy <= self.radius_sq
+
+
+class GeofenceIndex:
+    """Неизменяемая сетка геозон: ячейка → список зон"""
+
+    def __init__(self, fences, cell_size, max_cells):
+        self.cell_size = cell_size
+        self.cells = {}
+        # Зоны, покрывающие слишком много ячеек, проверяются для каждого пакета
+        self.wide = []
+        for fence in fences:
+            min_lat, min_lon, max_lat, max_lon = fence.bbox
+            rows = range(self.cell(min_lat), self.cell(max_lat) + 1)
+            columns = range(self.cell(min_lon), self.cell(max_lon) + 1)
+            if len(rows) * len(columns) > max_cells:
+                self.wide.append(fence)
+                continue
+            for row in rows:
+                for column in columns:
+                    self.cells.setdefault((row, column), []).append(fence)
+        self.size = len(fences)
+
+    def cell(self, degrees):
+        return math.floor(degrees / self.cell_size)
+
+    def match(self, lat, lon):
+        """Идентификатор события, в зону которого попадает точка, или None"""
+        best = None
+        candidates = self.cells.get((self.cell(lat), self.cell(lon)), ())
+        for fence in (*candidates, *self.wide):
+            if (best is None or fence.priority > best.priority) and fence.contains(lat, lon):
+                best = fence
+        return best.event_id if best else None
+
+
+class Geofences:
+    """Текущий индекс геозон и фоновый поток его обновления из БД"""
+
+    def __init__(self, refresh_interval=None, cell_size=None, max_cells=None):
+        self.refresh_interval = refresh_interval or settings.GEOFENCE_REFRESH_INTERVAL
+        self.cell_size = cell_size or settings.GEOFENCE_CELL_DEGREES
+        self.max_cells = max_cells or settings.GEOFENCE_MAX_CELLS
+        self.index = GeofenceIndex([], self.cell_size, self.max_cells)
+        self._changed = threading.Event()
+        self._lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def match(self, lat, lon):
+        if not self.index.size:
+            return None
+        event_id = self.index.match(lat, lon)
+        if event_id is not None:
+            GEOFENCE_MATCHES.inc()
+        return event_id
+
+    def invalidate(self):
+        """Перестроить индекс, не дожидаясь очередного интервала"""
+        self._changed.set()
+
+    def refresh(self):
+        start = time.perf_counter()
+        events = EmergencyEvent.objects.filter(is_active=True).filter(
+            Q(latitude__isnull=False, longitude__isnull=False, radius_m__isnull=False)
+            | Q(geofence__isnull=False)
+        ).values('id', 'severity', 'latitude', 'longitude', 'radius_m', 'geofence')
+        fences = []
+        for event in events:
+            try:
+                fences.append(Fence(
+                    event['id'], event['severity'], event['latitude'],
+                    event['longitude'], event['radius_m'], event['geofence']
+                ))
+            except (TypeError, ValueError, IndexError):
+                log.warning("Некорректная геозона события", extra={"fields": {"event_id": event['id']}})
+        # Замена ссылки атомарна: поток приёма видит старый или новый индекс целиком
+        self.index = GeofenceIndex(fences, self.cell_size, self.max_cells)
+        GEOFENCE_REFRESH_SECONDS.observe(time.perf_counter() - start)
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            self.running = True
+            thread = threading.Thread(target=self.run, daemon=True)
+            thread.start()
+            self.thread = thread
+
+    def stop(self):
+        with self._lock:
+            self.running = False
+            self._changed.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while self.running:
+            self._changed.clear()
+            try:
+                self.refresh()
+            except Exception as e:
+                log.error("Ошибка обновления геозон", extra={"fields": {"error": str(e)}})
+                reset_connection_if_unusable()
+            self._changed.wait(self.refresh_interval)
+
+
+GEOFENCES = Geofences()
+
+
+def invalidate_on_change(sender, **kwargs):
+    """Сигналы post_save/post_delete события: зона могла измениться"""
+    transaction.on_commit(GEOFENCES.invalidate)
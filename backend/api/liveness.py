@@ -0,0 +1,250 @@
+"""
+Отслеживание состояния дронов на стороне сервера.
+
+Таблица состояний обновляется из потока приёма UDP и хранит последнее
+состояние каждого дрона. Переходы online → stale → lost → forgotten
+определяются по куче сроков: действительна только запись с текущим сроком
+дрона, а при её срабатывании срок переносится, если дрон за это время
+выходил на связь. Поэтому обычный пакет не добавляет записей в кучу.
+Забытый дрон удаляется из таблицы.
+Клиентам WebSocket отправляются только переходы (состояние связи, порог
+заряда, смена status), а не каждый пакет. Дроны, требующие внимания (нет
+связи или заряд ниже порога), хранятся в кэше Django: клиент получает их
+при подключении (см. current_drone_states).
+"""
+
+import heapq
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .broadcast import EMERGENCY_GROUP, group_send
+from .log import get_logger
+from .metrics import REGISTRY
+
+ONLINE = 'online'
+STALE = 'stale'
+LOST = 'lost'
+FORGOTTEN = 'forgotten'
+CACHE_KEY = 'drone_states'
+
+log = get_logger('liveness')
+
+DRONE_TRANSITIONS = REGISTRY.counter(
+    'drone_transitions_total', 'Переходы состояния дронов', ('kind', 'to')
+)
+
+
+def current_drone_states():
+    """Снимки дронов без связи или с низким зарядом из кэша"""
+    return cache.get(CACHE_KEY) or []
+
+
+class DroneState:
+    __slots__ = (
+        'drone_id', 'liveness', 'battery_band', 'battery_level', 'status',
+        'latitude', 'longitude', 'last_seen', 'last_seen_wall', 'deadline',
+    )
+
+    def __init__(self, drone_id):
+        self.drone_id = drone_id
+        self.liveness = None
+        self.battery_band = None
+        self.battery_level = None
+        self.status = None
+        self.latitude = None
+        self.longitude = None
+        self.last_seen = 0.0
+        self.last_seen_wall = None
+        self.deadline = None
+
+    def snapshot(self):
+        return {
+            'drone_id': self.drone_id,
+            'liveness': self.liveness,
+            'battery': self.battery_band,
+            'battery_level': self.battery_level,
+            'status': self.status,
+            'latitude': self.latitude,
+            'longitude': self.longitude,
+            'last_seen': self.last_seen_wall.isoformat() if self.last_seen_wall else None,
+        }
+
+
+class LivenessTracker:
+    """
+    Таблица состояний дронов и поток таймеров.
+
+    observe() вызывается потоком приёма и не обращается к channel layer:
+    переходы складываются в очередь, которую отправляет поток таймеров.
+    """
+
+    def __init__(self, stale_after=None, lost_after=None, battery_thresholds=None,
+                 battery_hysteresis=None, forget_after=None, group=EMERGENCY_GROUP):
+        self.stale_after = stale_after or settings.DRONE_STALE_AFTER
+        self.lost_after = lost_after or settings.DRONE_LOST_AFTER
+        self.forget_after = forget_after or settings.DRONE_FORGET_AFTER
+        # Пороги по убыванию: [('low', 20), ('critical', 10)]
+        self.battery_thresholds = sorted(
+            (battery_thresholds or settings.DRONE_BATTERY_THRESHOLDS).items(),
+            key=lambda item: item[1], reverse=True
+        )
+        self.battery_hysteresis = (
+            battery_hysteresis if battery_hysteresis is not None
+            else settings.DRONE_BATTERY_HYSTERESIS
+        )
+        self.group = group
+        self.states = {}
+        self.attention = {}  # drone_id -> снимок дрона без связи или с низким зарядом
+        self._deadlines = []  # (срок, drone_id)
+        self._outbox = deque()
+        self._wakeup = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def battery_band(self, level, current):
+        """Уровень заряда с гистерезисом: подъём на каждый уровень выше только с запасом"""
+        band = 'ok'
+        for name, threshold in self.battery_thresholds:
+            if level < threshold:
+                band = name
+        if current is None or band == current:
+            return band
+        bands = ['ok'] + [name for name, _ in self.battery_thresholds]
+        index = bands.index(current)
+        if bands.index(band) > index:
+            return band
+        # Уровень покидается вверх, только если заряд выше его порога с запасом:
+        # из critical в ok — через порог low, а не только critical
+        thresholds = dict(self.battery_thresholds)
+        while index > bands.index(band) and level >= thresholds[bands[index]] + self.battery_hysteresis:
+            index -= 1
+        return bands[index]
+
+    def observe(self, row):
+        """Учесть пакет дрона; вызывается для каждого принятого пакета"""
+        now = time.monotonic()
+        with self._wakeup:
+            state = self.states.get(row['drone_id'])
+            if state is None:
+                state = self.states[row['drone_id']] = DroneState(row['drone_id'])
+
+            first_seen = state.liveness is None
+            changes = []
+            if state.liveness != ONLINE:
+                changes.append(('liveness', state.liveness, ONLINE))
+                state.liveness = ONLINE
+                # Срок lost заменяется сроком stale
+                state.deadline = None
+            band = self.battery_band(row['battery_level'], state.battery_band)
+            if band != state.battery_band:
+                changes.append(('battery', state.battery_band, band))
+                state.battery_band = band
+            if row['status'] != state.status:
+                changes.append(('status', state.status, row['status']))
+                state.status = row['status']
+
+            state.battery_level = row['battery_level']
+            state.latitude = row['latitude']
+            state.longitude = row['longitude']
+            state.last_seen = now
+            state.last_seen_wall = row['timestamp']
+
+            if first_seen:
+                # Появление дрона — один переход, заряд и статус в снимке состояния
+                changes = changes[:1]
+            if state.deadline is None:
+                self.schedule(state, now + self.stale_after)
+            if changes:
+                self.queue(state, changes)
+                self._wakeup.notify()
+
+    def queue(self, state, changes):
+        snapshot = state.snapshot()
+        if state.liveness == ONLINE and state.battery_band == 'ok':
+            self.attention.pop(state.drone_id, None)
+        else:
+            self.attention[state.drone_id] = snapshot
+        for kind, previous, current in changes:
+            self._outbox.append({
+                'drone_id': state.drone_id,
+                'kind': kind,
+                'from': previous,
+                'to': current,
+                'state': snapshot,
+                'at': datetime.now(timezone.utc).isoformat(),
+            })
+
+    def schedule(self, state, deadline):
+        state.deadline = deadline
+        heapq.heappush(self._deadlines, (deadline, state.drone_id))
+
+    def expire(self, now):
+        """Обработать сработавшие сроки (под блокировкой)"""
+        while self._deadlines and self._deadlines[0][0] <= now:
+            deadline, drone_id = heapq.heappop(self._deadlines)
+            state = self.states.get(drone_id)
+            if state is None or deadline != state.deadline:
+                continue  # устаревшая запись
+            silence = now - state.last_seen
+            if silence < self.stale_after:
+                # Дрон выходил на связь — переносим срок
+                self.schedule(state, state.last_seen + self.stale_after)
+            elif silence < self.lost_after:
+                if state.liveness == ONLINE:
+                    state.liveness = STALE
+                    self.queue(state, [('liveness', ONLINE, STALE)])
+                self.schedule(state, state.last_seen + self.lost_after)
+            elif silence < self.forget_after:
+                previous = state.liveness
+                state.liveness = LOST
+                self.queue(state, [('liveness', previous, LOST)])
+                self.schedule(state, state.last_seen + self.forget_after)
+            else:
+                # Дрон давно потерян: удаляем его из таблицы и снимка для новых клиентов
+                previous = state.liveness
+                state.liveness = FORGOTTEN
+                self.queue(state, [('liveness', previous, FORGOTTEN)])
+                del self.states[drone_id]
+                self.attention.pop(drone_id, None)
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        self.thread = thread
+
+    def stop(self):
+        with self._wakeup:
+            self.running = False
+            self._wakeup.notify()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while self.running:
+            with self._wakeup:
+                self.expire(time.monotonic())
+                if not self._outbox:
+                    timeout = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+                    self._wakeup.wait(timeout)
+                    continue
+                transitions = list(self._outbox)
+                self._outbox.clear()
+                attention = list(self.attention.values())
+            # Кэш обновляется до рассылки: клиент, подключившийся между ними,
+            # получит переход повторно, но не пропустит его
+            cache.set(CACHE_KEY, attention, None)
+            for transition in transitions:
+                self.send(transition)
+
+    def send(self, transition):
+        DRONE_TRANSITIONS.labels(transition['kind'], transition['to']).inc()
+        try:
+            group_send(self.group, {'type': 'drone_state', 'transition': transition})
+        except Exception as e:
+            log.error("Ошибка отправки перехода состояния дрона", extra={"fields": {"drone_id": transition['drone_id'], "error": str(e)}})
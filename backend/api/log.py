@@ -0,0 +1,172 @@
+"""
+Неблокирующее структурированное логирование для горячих путей серверов.
+
+Записи логгеров ingest.* проходят выборку в вызывающем потоке и кладутся
+в ограниченную очередь без ожидания; форматирование и вывод выполняет
+фоновый поток QueueListener. При переполнении очереди записи отбрасываются
+и учитываются в метрике, а не тормозят приём.
+
+Структурированные поля передаются через extra={'fields': {...}}.
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from django.conf import settings
+
+from .metrics import REGISTRY
+
+LOG_RECORDS = REGISTRY.counter(
+    'log_records_total', 'Записи журнала серверов приёма', ('result',)
+)
+
+_listener = None
+_handler = None
+_lock = threading.Lock()
+
+
+def get_logger(category):
+    """Логгер категории внутри иерархии ingest (например, 'udp.packet')"""
+    return logging.getLogger(f'ingest.{category}')
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись: время, уровень, категория, сообщение и поля"""
+
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'category': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Человекочитаемый вывод: сообщение и поля key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Выборка и ограничение частоты по категориям.
+
+    Правило категории: {'every': N, 'key': 'drone_id'} пропускает одну запись
+    из N для каждого значения поля key; {'per_second': R} пропускает не более
+    R записей в секунду. Записи уровня WARNING и выше не отбрасываются.
+    Счётчики не защищены блокировкой: при гонке потоков выборка лишь
+    немного неточна. Счётчики выборки сбрасываются каждые reset_interval
+    секунд и при max_keys значениях ключа, чтобы поток пакетов с
+    произвольными drone_id не расходовал память без предела.
+    """
+
+    def __init__(self, rules, reset_interval=60, max_keys=10000):
+        super().__init__()
+        self.rules = rules
+        self.reset_interval = reset_interval
+        self.max_keys = max_keys
+        self.counters = {}
+        self.reset_at = time.monotonic() + reset_interval
+        self.windows = {}
+
+    def filter(self, record):
+        rule = self.rules.get(record.name)
+        if rule is None or record.levelno >= logging.WARNING:
+            return True
+
+        every = rule.get('every')
+        if every:
+            fields = getattr(record, 'fields', None) or {}
+            key = (record.name, fields.get(rule.get('key')))
+            counters = self.counters
+            if len(counters) >= self.max_keys or time.monotonic() >= self.reset_at:
+                # После сброса первая запись каждого ключа снова пропускается
+                counters = self.counters = {}
+                self.reset_at = time.monotonic() + self.reset_interval
+            count = counters.get(key, 0) + 1
+            counters[key] = count
+            if (count - 1) % every:
+                LOG_RECORDS.labels('sampled_out').inc()
+                return False
+            if fields:
+                fields['sampled_every'] = every
+
+        per_second = rule.get('per_second')
+        if per_second:
+            second = int(time.monotonic())
+            window_second, count = self.windows.get(record.name, (second, 0))
+            if window_second != second:
+                window_second, count = second, 0
+            self.windows[record.name] = (window_second, count + 1)
+            if count >= per_second:
+                LOG_RECORDS.labels('rate_limited').inc()
+                return False
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без ожидания и без форматирования в вызывающем потоке"""
+
+    def prepare(self, record):
+        # Форматирование откладывается до фонового потока
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            LOG_RECORDS.labels('queued').inc()
+        except queue.Full:
+            LOG_RECORDS.labels('dropped').inc()
+
+
+def setup_ingest_logging():
+    """Подключить очередь и фоновый поток вывода к логгерам ingest.* (однократно)"""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            return
+        config = settings.INGEST_LOGGING
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JsonFormatter() if config['format'] == 'json' else TextFormatter())
+
+        handler = NonBlockingQueueHandler(queue.Queue(maxsize=config['queue_size']))
+        handler.addFilter(SamplingFilter(config['sampling']))
+
+        root = logging.getLogger('ingest')
+        root.setLevel(config['level'])
+        root.addHandler(handler)
+        root.propagate = False
+
+        _handler = handler
+        _listener = logging.handlers.QueueListener(handler.queue, output)
+        _listener.start()
+
+
+def stop_ingest_logging():
+    """Дописать оставшиеся записи и остановить фоновый поток"""
+    global _listener, _handler
+    with _lock:
+        if _listener is not None:
+            logging.getLogger('ingest').removeHandler(_handler)
+            _listener.stop()
+            _listener = None
+            _handler = None
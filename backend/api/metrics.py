@@ -0,0 +1,285 @@
+"""
+Реестр метрик конвейера приёма и рассылки с выводом в текстовом формате Prometheus.
+
+Каждый поток пишет только в свой собственный шард (threading.local), поэтому
+горячий путь обходится без блокировок. Шарды суммируются при чтении метрик,
+а шарды завершившихся потоков сворачиваются в общий итог при чтении и при
+появлении нового потока.
+"""
+
+import copy
+import threading
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _ShardedValue:
+    """Значение, разложенное по потокам: запись без блокировок, сумма при чтении"""
+
+    def __init__(self, size):
+        self._size = size
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (поток, шард)
+        self._retired = [0.0] * size
+
+    def shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = [0.0] * self._size
+            with self._lock:
+                # Без чтения метрик шарды завершившихся потоков (сессий TCP)
+                # иначе копились бы без предела
+                self._retire_dead()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+            return shard
+
+    def _retire_dead(self):
+        """Свернуть шарды завершившихся потоков в общий итог (под блокировкой)"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                # Поток завершился и больше не пишет в шард — сворачиваем его
+                for i, value in enumerate(shard):
+                    self._retired[i] += value
+        self._shards = alive
+
+    def snapshot(self):
+        with self._lock:
+            self._retire_dead()
+            total = list(self._retired)
+            for _, shard in self._shards:
+                for i, value in enumerate(shard):
+                    total[i] += value
+        return total
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._value = self._new_value()
+
+    def labels(self, *values):
+        """Дочерняя метрика для конкретного набора значений меток"""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}")
+            with self._lock:
+                child = self._children.get(key)
+                if child is None:
+                    child = copy.copy(self)
+                    child.labelnames = ()
+                    child._children = {}
+                    child._lock = threading.Lock()
+                    child._value = child._new_value()
+                    self._children[key] = child
+        return child
+
+    def _series(self):
+        if not self.labelnames:
+            yield (), self
+        else:
+            for key, child in list(self._children.items()):
+                yield key, child
+
+    def render(self):
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} {self.kind}',
+        ]
+        for key, child in self._series():
+            lines.extend(child._render_values(self.labelnames, key))
+        return lines
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_value(self):
+        return _ShardedValue(1)
+
+    def inc(self, amount=1):
+        self._value.shard()[0] += amount
+
+    def get(self):
+        return self._value.snapshot()[0]
+
+    def _render_values(self, names, values):
+        yield f'{self.name}{_format_labels(names, values)} {_format_number(self.get())}'
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1):
+        self._value.shard()[0] -= amount
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_value(self):
+        # Счётчики по корзинам (+Inf последней), затем сумма и количество
+        return _ShardedValue(len(self.buckets) + 3)
+
+    def observe(self, value):
+        shard = self._value.shard()
+        shard[bisect_left(self.buckets, value)] += 1
+        shard[-2] += value
+        shard[-1] += 1
+
+    def time(self):
+        """Контекстный менеджер, измеряющий длительность блока в секундах"""
+        return _Timer(self)
+
+    def _render_values(self, names, values):
+        snapshot = self._value.snapshot()
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), snapshot):
+            cumulative += count
+            labels = _format_labels(names, values, (('le', _format_number(bound)),))
+            yield f'{self.name}_bucket{labels} {_format_number(cumulative)}'
+        labels = _format_labels(names, values)
+        yield f'{self.name}_sum{labels} {_format_number(snapshot[-2])}'
+        yield f'{self.name}_count{labels} {_format_number(snapshot[-1])}'
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif type(metric) is not metric_class:
+                raise ValueError(f"Метрика {name} уже зарегистрирована с другим типом")
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def render(self):
+        """Все метрики в текстовом формате экспозиции Prometheus 0.0.4"""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# UDP: телеметрия дронов
+UDP_PACKETS = REGISTRY.counter(
+    'udp_packets_total', 'UDP-пакеты телеметрии по этапам обработки', ('stage',)
+)
+UDP_PROCESS_SECONDS = REGISTRY.histogram(
+    'udp_process_seconds', 'Время обработки одного UDP-пакета'
+)
+
+# TCP: сессии и оповещения МЧС
+TCP_SESSIONS = REGISTRY.counter('tcp_sessions_total', 'Открытые TCP-сессии')
+TCP_ACTIVE_SESSIONS = REGISTRY.gauge('tcp_active_sessions', 'Текущие TCP-сессии')
+TCP_MESSAGES = REGISTRY.counter(
+    'tcp_messages_total', 'Сообщения TCP-клиентов по типу', ('type',)
+)
+TCP_ALERTS = REGISTRY.counter(
+    'tcp_alerts_total', 'Оповещения МЧС по результату обработки', ('result',)
+)
+TCP_ALERT_SECONDS = REGISTRY.histogram(
+    'tcp_alert_seconds', 'Время обработки оповещения МЧС'
+)
+
+# Channel layer и WebSocket
+CHANNEL_SENDS = REGISTRY.counter(
+    'channel_layer_sends_total', 'Отправки в группы channel layer', ('group', 'result')
+)
+CHANNEL_SEND_SECONDS = REGISTRY.histogram(
+    'channel_layer_send_seconds', 'Длительность group_send', ('group',)
+)
+BROADCAST_PENDING = REGISTRY.gauge(
+    'broadcast_pending_messages', 'Сообщения, ожидающие отправки в channel layer', ('lane',)
+)
+BROADCAST_QUEUE_SECONDS = REGISTRY.histogram(
+    'broadcast_queue_seconds', 'Ожидание сообщения в очереди отправки', ('lane',)
+)
+BROADCAST_RETRIES = REGISTRY.counter(
+    'broadcast_retries_total', 'Повторы и потери неотправленных сообщений', ('lane', 'result')
+)
+BROADCAST_TELEMETRY = REGISTRY.counter(
+    'broadcast_telemetry_total', 'Телеметрия в очереди отправки по результату', ('result',)
+)
+WS_CONNECTIONS = REGISTRY.counter(
+    'websocket_connections_total', 'Подключения WebSocket', ('consumer',)
+)
+WS_ACTIVE_CONNECTIONS = REGISTRY.gauge(
+    'websocket_active_connections', 'Текущие подключения WebSocket', ('consumer',)
+)
+WS_MESSAGES_SENT = REGISTRY.counter(
+    'websocket_messages_sent_total', 'Сообщения, отправленные клиентам WebSocket', ('type',)
+)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-19 16:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dronedata',
+            name='trace_id',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+        migrations.AddField(
+            model_name='emergencyevent',
+            name='trace_id',
+            field=models.CharField(blank=True, default='', max_length=32),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_trace_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emergencyevent',
+            name='geofence',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergencyevent',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergencyevent',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergencyevent',
+            name='radius_m',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
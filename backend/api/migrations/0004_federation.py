@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-19 17:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_geofence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emergencyevent',
+            name='origin_event_id',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emergencyevent',
+            name='origin_node',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddConstraint(
+            model_name='emergencyevent',
+            constraint=models.UniqueConstraint(condition=models.Q(('origin_node', ''), _negated=True), fields=('origin_node', 'origin_event_id'), name='unique_federated_event'),
+        ),
+    ]
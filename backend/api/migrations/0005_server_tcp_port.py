@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 18:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_federation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='server',
+            name='tcp_port',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
@@ -3,7 +3,10 @@ from django.utils import timezone
 
 class Server(models.Model):
     ip_address = models.CharField(max_length=50)
+    # HTTP-порт узла: API, веб-интерфейс и проверка доступности
     port = models.IntegerField()
+    # Порт TCP-сервера приёма для федерации (пусто — узел не реплицируется)
+    tcp_port = models.IntegerField(blank=True, null=True)
     name = models.CharField(max_length=100)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -32,6 +35,24 @@ class EmergencyEvent(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    trace_id = models.CharField(max_length=32, blank=True, default='')
+    # Геозона события: круг radius_m вокруг точки или многоугольник [[широта, долгота], ...]
+    latitude = models.FloatField(blank=True, null=True)
+    longitude = models.FloatField(blank=True, null=True)
+    radius_m = models.FloatField(blank=True, null=True)
+    geofence = models.JSONField(blank=True, null=True)
+    # Узел федерации, на котором событие создано, и его идентификатор там
+    origin_node = models.CharField(max_length=100, blank=True, default='')
+    origin_event_id = models.BigIntegerField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['origin_node', 'origin_event_id'],
+                condition=~models.Q(origin_node=''),
+                name='unique_federated_event'
+            ),
+        ]
     
     def __str__(self):
         return self.title
@@ -46,6 +67,7 @@ class DroneData(models.Model):
     status = models.CharField(max_length=50)
     timestamp = models.DateTimeField(default=timezone.now)
     related_event = models.ForeignKey(EmergencyEvent, on_delete=models.CASCADE, blank=True, null=True)
+    trace_id = models.CharField(max_length=32, blank=True, default='')
     
     def __str__(self):
         return f"Дрон {self.drone_id} в {self.timestamp}"
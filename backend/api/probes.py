@@ -0,0 +1,238 @@
+"""
+Проверка доступности зарегистрированных серверов (модель Server).
+
+Все серверы проверяются одним циклом asyncio в отдельном потоке: запрос
+HEALTH_PATH на HTTP-порт сервера (поле port) с таймаутом, интервал со
+случайным разбросом и экспоненциальная задержка после неудач. Серверы
+приёма проверкой не затрагиваются: она не открывает TCP-сессий. Результаты хранятся в памяти и в
+кэше Django (для REST API), изменения доступности рассылаются по WebSocket.
+Обращения к БД и channel layer выполняет один вспомогательный поток, а
+is_active записывается только при изменении.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .broadcast import EMERGENCY_GROUP, group_send
+from .log import get_logger
+from .metrics import REGISTRY
+from .models import Server
+from .storage import reset_connection_if_unusable
+
+CACHE_KEY = 'server_probe:{}'
+HEALTH_PATH = '/api/health/'
+
+log = get_logger('probes')
+
+SERVER_PROBES = REGISTRY.counter(
+    'server_probes_total', 'Проверки доступности серверов', ('result',)
+)
+SERVER_PROBE_SECONDS = REGISTRY.histogram(
+    'server_probe_seconds', 'Время ответа сервера на запрос проверки'
+)
+
+
+def probe_statuses(server_ids):
+    """Последние результаты проверки из кэша: {id: результат}"""
+    keys = {CACHE_KEY.format(server_id): server_id for server_id in server_ids}
+    return {keys[key]: value for key, value in cache.get_many(keys).items()}
+
+
+def probe_status(server_id):
+    return cache.get(CACHE_KEY.format(server_id))
+
+
+class ProbeScheduler:
+    def __init__(self, interval=None, timeout=None, max_backoff=None, jitter=None,
+                 concurrency=None, reload_interval=None):
+        self.interval = interval or settings.SERVER_PROBE_INTERVAL
+        self.timeout = timeout or settings.SERVER_PROBE_TIMEOUT
+        self.max_backoff = max_backoff or settings.SERVER_PROBE_MAX_BACKOFF
+        self.jitter = jitter if jitter is not None else settings.SERVER_PROBE_JITTER
+        self.concurrency = concurrency or settings.SERVER_PROBE_CONCURRENCY
+        self.reload_interval = reload_interval or settings.SERVER_PROBE_RELOAD_INTERVAL
+        self.results = {}
+        self.servers = {}  # id -> (ip_address, port)
+        self.stored_active = {}  # id -> is_active в БД
+        self.tasks = {}
+        self.loop = None
+        self.thread = None
+        self.stopping = None
+        # Один поток для ORM и group_send: соединение с БД переиспользуется
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='probes')
+
+    def start(self):
+        ready = threading.Event()
+        thread = threading.Thread(target=self.run, args=(ready,), daemon=True)
+        thread.start()
+        ready.wait()
+        self.thread = thread
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+        if self.thread:
+            self.thread.join()
+        self.executor.shutdown(wait=True)
+
+    def run(self, ready):
+        self.loop = asyncio.new_event_loop()
+        self.stopping = asyncio.Event()
+        ready.set()
+        try:
+            self.loop.run_until_complete(self.main())
+        finally:
+            self.loop.close()
+
+    async def main(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        log.info("Проверка серверов запущена", extra={"fields": {"interval": self.interval}})
+        while not self.stopping.is_set():
+            try:
+                await self.reload()
+            except Exception as e:
+                log.error("Ошибка загрузки списка серверов", extra={"fields": {"error": str(e)}})
+            try:
+                await asyncio.wait_for(self.stopping.wait(), self.reload_interval)
+            except asyncio.TimeoutError:
+                pass
+        tasks = set(self.tasks.values())
+        while tasks:
+            # wait_for поглощает отмену, если ответ пришёл одновременно с ней,
+            # поэтому задачи отменяются, пока все не завершатся
+            for task in tasks:
+                task.cancel()
+            _, tasks = await asyncio.wait(tasks, timeout=0.1)
+
+    async def in_executor(self, func, *args):
+        return await self.loop.run_in_executor(self.executor, func, *args)
+
+    def load_servers(self):
+        try:
+            return list(Server.objects.values_list('id', 'ip_address', 'port', 'is_active'))
+        except Exception:
+            reset_connection_if_unusable()
+            raise
+
+    async def reload(self):
+        """Синхронизировать задачи проверки со списком серверов в БД"""
+        rows = await self.in_executor(self.load_servers)
+        current = {}
+        for server_id, ip_address, port, is_active in rows:
+            current[server_id] = (ip_address, port)
+            self.stored_active[server_id] = is_active
+
+        for server_id in list(self.tasks):
+            if self.servers.get(server_id) != current.get(server_id):
+                # Сервер удалён или сменил адрес
+                self.tasks.pop(server_id).cancel()
+                self.results.pop(server_id, None)
+        for server_id, address in current.items():
+            if server_id not in self.tasks:
+                self.tasks[server_id] = self.loop.create_task(self.probe_loop(server_id, *address))
+        self.servers = current
+        self.stored_active = {server_id: self.stored_active[server_id] for server_id in current}
+
+    async def probe_loop(self, server_id, host, port):
+        # Первая проверка тоже с разбросом, чтобы сотни серверов не проверялись одновременно
+        await asyncio.sleep(random.uniform(0, self.interval))
+        failures = 0
+        while True:
+            available, latency, error = await self.probe(host, port)
+            failures = 0 if available else failures + 1
+            delay = self.interval if available else min(self.interval * 2 ** failures, self.max_backoff)
+            delay *= random.uniform(1 - self.jitter, 1 + self.jitter)
+            await self.update(server_id, available, latency, error, failures, delay)
+            await asyncio.sleep(delay)
+
+    async def probe(self, host, port):
+        """Запрос HEALTH_PATH: (доступен, задержка в мс, ошибка)"""
+        async with self.semaphore:
+            start = time.perf_counter()
+            try:
+                code = await asyncio.wait_for(self.health_request(host, port), self.timeout)
+            except asyncio.TimeoutError:
+                SERVER_PROBES.labels('timeout').inc()
+                return False, None, 'timeout'
+            except (OSError, ValueError) as e:
+                SERVER_PROBES.labels('refused').inc()
+                return False, None, str(e) or type(e).__name__
+            elapsed = time.perf_counter() - start
+        latency = round(elapsed * 1000, 3)
+        # Любой ответ, кроме 5xx, значит, что сервер обрабатывает запросы
+        # (например, 400 при Host не из ALLOWED_HOSTS)
+        if code >= 500:
+            SERVER_PROBES.labels('error').inc()
+            return False, latency, f'HTTP {code}'
+        SERVER_PROBES.labels('ok').inc()
+        SERVER_PROBE_SECONDS.observe(elapsed)
+        return True, latency, None
+
+    async def health_request(self, host, port):
+        """Код ответа HTTP на GET HEALTH_PATH (читается только строка статуса)"""
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            writer.write(
+                f'GET {HEALTH_PATH} HTTP/1.0\r\nHost: {host}:{port}\r\nConnection: close\r\n\r\n'.encode('ascii')
+            )
+            await writer.drain()
+            status_line = await reader.readline()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+        parts = status_line.split()
+        if len(parts) < 2 or not parts[0].startswith(b'HTTP/') or not parts[1].isdigit():
+            raise ValueError('некорректный ответ HTTP')
+        return int(parts[1])
+
+    async def update(self, server_id, available, latency, error, failures, delay):
+        result = {
+            'server_id': server_id,
+            'available': available,
+            'latency_ms': latency,
+            'error': error,
+            'consecutive_failures': failures,
+            'checked_at': datetime.now(timezone.utc).isoformat(),
+            'next_check_in': round(delay, 3),
+        }
+        previous = self.results.get(server_id)
+        self.results[server_id] = result
+        changed = previous is None or previous['available'] != available
+        store = self.stored_active.get(server_id) != available
+        if store:
+            self.stored_active[server_id] = available
+        await self.in_executor(self.publish, result, changed, store)
+
+    def publish(self, result, changed, store):
+        """Записать результат в кэш, при изменении — в БД и клиентам WebSocket"""
+        server_id = result['server_id']
+        cache.set(CACHE_KEY.format(server_id), result, self.max_backoff * 2)
+        try:
+            if store:
+                Server.objects.filter(pk=server_id).exclude(
+                    is_active=result['available']
+                ).update(is_active=result['available'])
+            if changed:
+                group_send(EMERGENCY_GROUP, {'type': 'server_status', 'server': result})
+                log.info("Доступность сервера изменилась", extra={"fields": {
+                    "server_id": server_id, "available": result['available'], "error": result['error']
+                }})
+        except Exception as e:
+            reset_connection_if_unusable()
+            log.error("Ошибка публикации результата проверки", extra={"fields": {"server_id": server_id, "error": str(e)}})
+
+
+def start_probe_scheduler():
+    scheduler = ProbeScheduler()
+    scheduler.start()
+    return scheduler
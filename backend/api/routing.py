@@ -3,4 +3,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/emergency/$', consumers.EmergencyConsumer.as_asgi()),
+    re_path(r'ws/telemetry/$', consumers.TelemetryConsumer.as_asgi()),
 ] 
\ No newline at end of file
@@ -1,11 +1,19 @@
 from rest_framework import serializers
 from .models import Server, EventType, EmergencyEvent, DroneData
+from .geofence import normalize_polygon, validate_circle
+from .probes import probe_status
 
 class ServerSerializer(serializers.ModelSerializer):
+    # Последний результат проверки доступности (None, пока сервер не проверялся)
+    status = serializers.SerializerMethodField()
+
     class Meta:
         model = Server
         fields = '__all__'
 
+    def get_status(self, server):
+        return probe_status(server.id)
+
 class EventTypeSerializer(serializers.ModelSerializer):
     class Meta:
         model = EventType
@@ -18,6 +26,26 @@ class EmergencyEventSerializer(serializers.ModelSerializer):
         model = EmergencyEvent
         fields = '__all__'
 
+    def validate_geofence(self, value):
+        if value is None:
+            return value
+        try:
+            return normalize_polygon(value)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+
+    def validate(self, attrs):
+        # При частичном обновлении недостающие поля берутся из события
+        values = {
+            key: attrs.get(key, getattr(self.instance, key, None))
+            for key in ('latitude', 'longitude', 'radius_m')
+        }
+        try:
+            validate_circle(**values)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return attrs
+
 class DroneDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = DroneData
@@ -0,0 +1,354 @@
+"""
+Спул телеметрии: журнал только на добавление, записываемый через mmap.
+
+Поток приёма UDP дописывает пакеты в текущий сегмент и никогда не ждёт БД.
+Фоновый поток воспроизведения читает сегменты по порядку, пачками загружает
+записи в DroneData и атомарно сохраняет смещение. После сбоя чтение
+продолжается с последнего сохранённого смещения, поэтому записи доставляются
+не менее одного раза.
+
+Формат записи: заголовок <длина:uint32><crc32:uint32>, затем JSON. Сегменты
+заранее заполнены нулями: нулевая длина означает конец записанных данных,
+длина END_OF_SEGMENT — переход к следующему сегменту.
+"""
+
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import OperationalError, InterfaceError
+
+from .metrics import REGISTRY
+from .log import get_logger
+from .storage import bulk_insert_drone_data, reset_connection_if_unusable
+
+HEADER = struct.Struct('<II')
+END_OF_SEGMENT = 0xFFFFFFFF
+OFFSET_FILE = 'offset'
+MAX_RECORD_SIZE = 64 * 1024
+
+log = get_logger('spool')
+
+SPOOL_RECORDS = REGISTRY.counter(
+    'spool_records_total', 'Записи спула телеметрии', ('result',)
+)
+SPOOL_BATCH_SECONDS = REGISTRY.histogram(
+    'spool_batch_seconds', 'Время загрузки пачки из спула в БД'
+)
+SPOOL_BATCH_ROWS = REGISTRY.histogram(
+    'spool_batch_rows', 'Размер пачки, загруженной из спула',
+    buckets=(1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+
+
+def segment_path(directory, number):
+    return os.path.join(directory, f'segment-{number:010d}.spool')
+
+
+def list_segments(directory):
+    numbers = []
+    for name in os.listdir(directory):
+        if name.startswith('segment-') and name.endswith('.spool'):
+            numbers.append(int(name[len('segment-'):-len('.spool')]))
+    return sorted(numbers)
+
+
+def read_record(buffer, position):
+    """
+    Прочитать запись по смещению.
+
+    Возвращает (payload, следующее смещение); (None, position), если данных
+    пока нет или запись повреждена; (END_OF_SEGMENT, position) на маркере конца.
+    """
+    if position + HEADER.size > len(buffer):
+        return None, position
+    length, crc = HEADER.unpack_from(buffer, position)
+    if length == END_OF_SEGMENT:
+        return END_OF_SEGMENT, position
+    start = position + HEADER.size
+    if length == 0 or start + length > len(buffer):
+        return None, position
+    payload = bytes(buffer[start:start + length])
+    if zlib.crc32(payload) != crc:
+        return None, position
+    return payload, start + length
+
+
+def encode_row(row, trace=None):
+    record = dict(row, timestamp=row['timestamp'].timestamp())
+    if trace is not None:
+        record['trace'] = trace
+    return json.dumps(record, separators=(',', ':')).encode('utf-8')
+
+
+def decode_row(payload):
+    row = json.loads(payload)
+    trace = row.pop('trace', None)
+    row['timestamp'] = datetime.fromtimestamp(row['timestamp'], tz=timezone.utc)
+    return row, trace
+
+
+def read_offset(directory):
+    try:
+        with open(os.path.join(directory, OFFSET_FILE)) as f:
+            segment, position = f.read().split()
+        return int(segment), int(position)
+    except (OSError, ValueError):
+        return None
+
+
+def write_offset(directory, segment, position):
+    """Атомарно сохранить смещение: запись во временный файл, fsync и rename"""
+    path = os.path.join(directory, OFFSET_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(f'{segment} {position}\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class SpoolWriter:
+    """Дозапись пакетов в сегменты спула через mmap (один пишущий поток)"""
+
+    def __init__(self, directory=None, segment_size=None, max_segments=None):
+        self.directory = str(directory or settings.TELEMETRY_SPOOL_DIR)
+        self.segment_size = segment_size or settings.TELEMETRY_SPOOL_SEGMENT_SIZE
+        self.max_segments = max_segments or settings.TELEMETRY_SPOOL_MAX_SEGMENTS
+        os.makedirs(self.directory, exist_ok=True)
+        self.segment = None
+        self.buffer = None
+        self.position = 0
+        self.recover()
+
+    def recover(self):
+        """Открыть последний сегмент и найти конец целых записей"""
+        segments = list_segments(self.directory)
+        if not segments:
+            self.open_segment(0)
+            return
+
+        self.open_segment(segments[-1])
+        position = 0
+        while True:
+            payload, next_position = read_record(self.buffer, position)
+            if payload is END_OF_SEGMENT:
+                self.rotate(write_marker=False)
+                return
+            if payload is None:
+                break
+            position = next_position
+        # Затираем хвост недописанной записи, чтобы он не был принят за данные.
+        # Запись ведётся последовательно, поэтому повреждена может быть только одна запись.
+        end = min(position + MAX_RECORD_SIZE, len(self.buffer))
+        self.buffer[position:end] = bytes(end - position)
+        self.position = position
+
+    def open_segment(self, number):
+        path = segment_path(self.directory, number)
+        with open(path, 'a+b') as f:
+            if os.fstat(f.fileno()).st_size < self.segment_size:
+                f.truncate(self.segment_size)
+            self.buffer = mmap.mmap(f.fileno(), 0)
+        self.segment = number
+        self.position = 0
+
+    def rotate(self, write_marker=True):
+        # Следующий сегмент создаётся до маркера, чтобы читатель всегда мог в него перейти
+        buffer, position = self.buffer, self.position
+        self.open_segment(self.segment + 1)
+        if write_marker:
+            HEADER.pack_into(buffer, position, END_OF_SEGMENT, 0)
+        buffer.flush()
+        buffer.close()
+
+    def append(self, payload):
+        """Дописать запись; False, если спул переполнен и запись отброшена"""
+        size = HEADER.size + len(payload)
+        if size > MAX_RECORD_SIZE or size + HEADER.size > self.segment_size:
+            SPOOL_RECORDS.labels('dropped').inc()
+            return False
+        # В конце сегмента всегда остаётся место для маркера перехода
+        if self.position + size + HEADER.size > len(self.buffer):
+            if len(list_segments(self.directory)) >= self.max_segments:
+                SPOOL_RECORDS.labels('dropped').inc()
+                return False
+            self.rotate()
+
+        start = self.position + HEADER.size
+        self.buffer[start:start + len(payload)] = payload
+        # Заголовок пишется последним: читатель не увидит запись раньше данных
+        HEADER.pack_into(self.buffer, self.position, len(payload), zlib.crc32(payload))
+        self.position = start + len(payload)
+        SPOOL_RECORDS.labels('appended').inc()
+        return True
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.flush()
+            self.buffer.close()
+            self.buffer = None
+
+
+class SpoolReplayer:
+    """
+    Фоновая загрузка записей спула в DroneData по порядку.
+
+    Смещение сохраняется только после фиксации пачки в БД. Пока БД
+    недоступна, пачка повторяется с экспоненциальной задержкой, а приём
+    продолжает писать в спул.
+    """
+
+    def __init__(self, directory=None, on_flush=None, batch_size=None, poll_interval=None):
+        self.directory = str(directory or settings.TELEMETRY_SPOOL_DIR)
+        self.on_flush = on_flush
+        self.batch_size = batch_size or settings.TELEMETRY_BATCH_SIZE
+        self.poll_interval = poll_interval or settings.TELEMETRY_FLUSH_INTERVAL
+        self.running = False
+        self.thread = None
+        self.segment = None
+        self.buffer = None
+        self.position = 0
+
+    def start(self):
+        self.running = True
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        self.thread = thread
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+        self.close_segment()
+
+    def open_segment(self, number, position=0):
+        self.close_segment()
+        path = segment_path(self.directory, number)
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.segment = number
+        self.position = position
+
+    def close_segment(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+
+    def seek_committed(self):
+        """Встать на сохранённое смещение или на начало самого старого сегмента"""
+        segments = list_segments(self.directory)
+        if not segments:
+            return False
+        offset = read_offset(self.directory)
+        if offset is not None and offset[0] in segments:
+            self.open_segment(*offset)
+        else:
+            self.open_segment(segments[0])
+        return True
+
+    def next_batch(self):
+        """Прочитать до batch_size записей; при маркере конца перейти к следующему сегменту"""
+        payloads = []
+        while len(payloads) < self.batch_size:
+            payload, next_position = read_record(self.buffer, self.position)
+            if payload is END_OF_SEGMENT:
+                if payloads:
+                    break
+                self.advance_segment()
+                continue
+            if payload is None:
+                break
+            payloads.append(payload)
+            self.position = next_position
+        return payloads
+
+    def advance_segment(self):
+        """Перейти к следующему сегменту и удалить полностью загруженный"""
+        finished = self.segment
+        self.open_segment(finished + 1)
+        write_offset(self.directory, self.segment, 0)
+        os.remove(segment_path(self.directory, finished))
+
+    def run(self):
+        while self.running and not self.seek_committed():
+            time.sleep(self.poll_interval)
+
+        while self.running:
+            start_position = self.position
+            payloads = self.next_batch()
+            if not payloads:
+                time.sleep(self.poll_interval)
+                continue
+            if not self.load(payloads):
+                # Остановка во время недоступности БД: перечитаем пачку при следующем запуске
+                self.position = start_position
+                return
+
+    def load(self, payloads):
+        batch = []
+        for payload in payloads:
+            try:
+                batch.append(decode_row(payload))
+            except (ValueError, KeyError, TypeError):
+                SPOOL_RECORDS.labels('corrupt').inc()
+
+        loaded = self.insert(batch) if batch else []
+        if loaded is None:
+            return False
+
+        write_offset(self.directory, self.segment, self.position)
+        if loaded:
+            SPOOL_RECORDS.labels('replayed').inc(len(loaded))
+            SPOOL_BATCH_ROWS.observe(len(loaded))
+            if self.on_flush:
+                self.on_flush(loaded)
+        return True
+
+    def insert(self, batch):
+        """
+        Записать пачку [(row, trace)] в БД.
+
+        Пачку, которую БД отвергает не из-за недоступности, делим пополам,
+        пока не найдём отвергнутые записи: пропускаются только они.
+        Возвращает загруженные записи или None, если сервер остановлен,
+        пока БД недоступна.
+        """
+        rows = [row for row, _ in batch]
+        delay = 0.05
+        while True:
+            start = time.perf_counter()
+            try:
+                bulk_insert_drone_data(rows)
+                return batch
+            except (OperationalError, InterfaceError) as e:
+                SPOOL_RECORDS.labels('retried').inc(len(rows))
+                log.warning("БД недоступна, телеметрия остаётся в спуле", extra={"fields": {"rows": len(rows), "error": str(e)}})
+                reset_connection_if_unusable()
+                if not self.running:
+                    return None
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+            except Exception as e:
+                if len(batch) > 1:
+                    break
+                SPOOL_RECORDS.labels('failed').inc()
+                log.error("Запись телеметрии из спула отвергнута БД", extra={"fields": {"drone_id": rows[0].get('drone_id'), "error": str(e)}})
+                return []
+            finally:
+                SPOOL_BATCH_SECONDS.observe(time.perf_counter() - start)
+
+        middle = len(batch) // 2
+        loaded = []
+        for part in (batch[:middle], batch[middle:]):
+            result = self.insert(part)
+            if result is None:
+                return None
+            loaded.extend(result)
+        return loaded
@@ -0,0 +1,103 @@
+"""
+Настройка хранилища для конкурентной записи и пакетная загрузка телеметрии.
+
+SQLite переводится в режим WAL с synchronous=NORMAL и таймаутом ожидания
+блокировки, чтобы потоки UDP, TCP и HTTP не падали с "database is locked".
+Телеметрия пишется пачками (см. api/spool.py): в PostgreSQL через COPY,
+в остальных СУБД через bulk_create.
+"""
+
+import csv
+import io
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import DroneData, EmergencyEvent, EventType
+
+TELEMETRY_COLUMNS = (
+    'drone_id', 'latitude', 'longitude', 'altitude', 'speed',
+    'battery_level', 'status', 'timestamp', 'related_event_id', 'trace_id',
+)
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Обработчик connection_created: прагмы SQLite для конкурентной записи"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+def reset_connection_if_unusable():
+    """Закрыть соединение потока, если оно сломано (переподключение при следующем запросе)"""
+    if connection.connection is not None and not connection.is_usable():
+        connection.close()
+
+
+def event_type_by_name(name):
+    """
+    Тип события по имени, при отсутствии — создаётся.
+
+    Имя не уникально в схеме, и параллельные get_or_create из потоков TCP и
+    федерации могут создать дубликаты; тогда берётся самый ранний тип.
+    """
+    event_type = EventType.objects.filter(name=name).order_by('id').first()
+    if event_type is None:
+        event_type = EventType.objects.create(name=name)
+    return event_type
+
+
+def resolve_related_events(rows):
+    """Обнулить ссылки на несуществующие события, чтобы не нарушить внешний ключ"""
+    event_ids = {row['related_event_id'] for row in rows if row['related_event_id']}
+    if not event_ids:
+        return
+    existing = set(EmergencyEvent.objects.filter(id__in=event_ids).values_list('id', flat=True))
+    for row in rows:
+        if row['related_event_id'] not in existing:
+            row['related_event_id'] = None
+
+
+def copy_drone_data(rows):
+    """Загрузка пачки в PostgreSQL командой COPY (psycopg2 и psycopg 3)"""
+    quote = connection.ops.quote_name
+    sql = 'COPY {} ({}) FROM STDIN'.format(
+        quote(DroneData._meta.db_table),
+        ', '.join(quote(column) for column in TELEMETRY_COLUMNS)
+    )
+    values = [[row[column] for column in TELEMETRY_COLUMNS] for row in rows]
+
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for value in values:
+                # Пустое поле без кавычек в CSV-режиме COPY означает NULL
+                writer.writerow(['' if v is None else v for v in value])
+            buffer.seek(0)
+            # Для NOT NULL колонок (trace_id, status) пустое поле — пустая строка
+            nullable = {field.column for field in DroneData._meta.concrete_fields if field.null}
+            not_null = ', '.join(quote(column) for column in TELEMETRY_COLUMNS if column not in nullable)
+            raw_cursor.copy_expert(f'{sql} WITH (FORMAT csv, FORCE_NOT_NULL ({not_null}))', buffer)
+        else:
+            with raw_cursor.copy(sql) as copy:
+                for value in values:
+                    copy.write_row(value)
+
+
+def bulk_insert_drone_data(rows):
+    """Записать пачку телеметрии одной транзакцией"""
+    if not rows:
+        return
+    with transaction.atomic():
+        resolve_related_events(rows)
+        if connection.vendor == 'postgresql':
+            copy_drone_data(rows)
+        else:
+            DroneData.objects.bulk_create(
+                [DroneData(**row) for row in rows],
+                batch_size=settings.TELEMETRY_BATCH_SIZE
+            )
@@ -1,18 +1,24 @@
 import socket
-import json
 import threading
-import django
-import os
+import time
 import uuid
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
-# Настраиваем Django для работы в отдельном потоке
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emergency_notification.settings')
-django.setup()
 
 from django.conf import settings
-from api.models import EmergencyEvent, EventType
+from api.models import EmergencyEvent
+from api.broadcast import ALERT_LANE, EMERGENCY_GROUP, event_payload, group_send
+from api.correlation import CORRELATOR
+from api.geofence import parse_geofence_fields
+from api.federation import apply_federated_alerts, federated_alert
+from api.framing import INVALID, JsonStream, encode_frame
+from api.storage import event_type_by_name
+from api.tracing import new_trace, elapsed, record
+from api.log import get_logger, setup_ingest_logging
+from api.metrics import (
+    TCP_SESSIONS, TCP_ACTIVE_SESSIONS, TCP_MESSAGES, TCP_ALERTS, TCP_ALERT_SECONDS
+)
+
+log = get_logger('tcp')
+message_log = get_logger('tcp.message')
 
 class ClientHandler:
     def __init__(self, client_socket, address, server):
@@ -24,110 +30,230 @@ class ClientHandler:
         
     def handle(self):
         self.running = True
-        print(f"Клиент подключен: {self.address}, ID сессии: {self.session_id}")
+        TCP_SESSIONS.inc()
+        TCP_ACTIVE_SESSIONS.inc()
+        log.info("Клиент подключен", extra={"fields": self.log_fields()})
         
         try:
-            # Отправляем ID сессии клиенту
-            self.client_socket.send(json.dumps({
+            # Отправляем ID сессии и узла клиенту
+            self.send({
                 "status": "connected",
-                "session_id": self.session_id
-            }).encode('utf-8'))
+                "session_id": self.session_id,
+                "node_id": self.server.node_id
+            })
             
+            stream = JsonStream()
             while self.running:
-                data = self.client_socket.recv(4096)
+                data = self.client_socket.recv(65536)
                 if not data:
                     break
-                    
-                self.process_data(data)
+                
+                # За одно чтение может прийти несколько сообщений или часть сообщения
+                received = new_trace()
+                for message in stream.feed(data):
+                    self.process_message(message, dict(received, id=uuid.uuid4().hex))
                 
         except Exception as e:
-            print(f"Ошибка обработки клиента {self.session_id}: {e}")
+            log.warning("Ошибка обработки клиента", extra={"fields": self.log_fields(error=str(e))})
         finally:
             self.client_socket.close()
+            TCP_ACTIVE_SESSIONS.dec()
             if self.session_id in self.server.clients:
                 del self.server.clients[self.session_id]
-            print(f"Клиент отключен: {self.address}, ID сессии: {self.session_id}")
+            log.info("Клиент отключен", extra={"fields": self.log_fields()})
+            
+    def send(self, message):
+        """Отправить ответ клиенту (JSON, завершённый переводом строки)"""
+        self.client_socket.sendall(encode_frame(message))
             
-    def process_data(self, data):
+    def process_message(self, message, trace=None):
+        trace = trace or new_trace()
+        if message is INVALID or not isinstance(message, dict):
+            TCP_MESSAGES.labels("invalid").inc()
+            message_log.warning("Получены некорректные данные", extra={"fields": self.log_fields()})
+            return
         try:
-            message = json.loads(data.decode('utf-8'))
             message_type = message.get("type")
+            record('parse', elapsed(trace, 'recv'))
+            TCP_MESSAGES.labels(message_type or "unknown").inc()
             
             if message_type == "emergency_alert":
                 # Обработка экстренного оповещения от МЧС
-                event_data = message.get("data", {})
-                
-                # Получаем или создаем тип события
-                event_type, _ = EventType.objects.get_or_create(
-                    name=event_data.get("event_type", "Неизвестный тип")
-                )
-                
-                # Создаем событие
-                event = EmergencyEvent.objects.create(
-                    title=event_data.get("title", "Без названия"),
-                    description=event_data.get("description", ""),
-                    event_type=event_type,
-                    location=event_data.get("location", ""),
-                    severity=event_data.get("severity", 2),
-                    is_active=True
-                )
-                
-                # Отправляем событие всем клиентам через WebSocket
-                channel_layer = get_channel_layer()
-                async_to_sync(channel_layer.group_send)(
-                    "emergency_broadcasts",
-                    {
-                        "type": "emergency_broadcast",
-                        "event": {
-                            "id": event.id,
-                            "title": event.title,
-                            "description": event.description,
-                            "event_type": event_type.name,
-                            "location": event.location,
-                            "severity": event.get_severity_display(),
-                            "created_at": event.created_at.isoformat()
-                        }
-                    }
-                )
-                
-                # Отправляем подтверждение клиенту МЧС
-                self.client_socket.send(json.dumps({
-                    "status": "success",
-                    "message": "Оповещение успешно создано",
-                    "event_id": event.id
-                }).encode('utf-8'))
+                with TCP_ALERT_SECONDS.time():
+                    try:
+                        self.process_alert(message.get("data", {}), trace)
+                    except Exception:
+                        TCP_ALERTS.labels('failed').inc()
+                        raise
                 
-                print(f"Создано новое оповещение: {event.title}")
+            elif message_type == "federated_alerts":
+                # Пачка оповещений, реплицированных с другого узла
+                try:
+                    apply_federated_alerts(message, self.server.node_id, self.send)
+                except Exception as e:
+                    # Отказ вместо молчания: узел-источник повторит пачку сразу, не дожидаясь
+                    # таймаута (если пачка уже подтверждена, отказ будет проигнорирован)
+                    self.send({"type": "federated_nack", "seq": message.get("seq"), "error": str(e)})
+                    raise
                 
             elif message_type == "heartbeat":
                 # Простое сообщение для поддержания соединения
-                self.client_socket.send(json.dumps({
+                self.send({
                     "status": "ok",
                     "message": "Соединение активно"
-                }).encode('utf-8'))
+                })
                 
-        except json.JSONDecodeError:
-            print(f"Получены некорректные данные от клиента {self.session_id}")
         except Exception as e:
-            print(f"Ошибка обработки сообщения от клиента {self.session_id}: {e}")
+            log.exception("Ошибка обработки сообщения", extra={"fields": self.log_fields()})
             
+    def process_alert(self, event_data, trace):
+        """Обработка экстренного оповещения от МЧС"""
+        event_type_name = event_data.get("event_type", "Неизвестный тип")
+        severity = int(event_data.get("severity", 2))
+        key = CORRELATOR.key(event_type_name, event_data.get("location", ""))
+
+        is_new, entry = CORRELATOR.claim(key)
+        while not is_new:
+            if self.merge_alert(key, entry, severity, trace):
+                return
+            # Событие закрыто и его запись освобождена: занимаем ключ заново,
+            # чтобы следующие дубликаты объединялись с новым событием
+            is_new, entry = CORRELATOR.claim(key)
+
+        try:
+            geofence = parse_geofence_fields(event_data)
+        except ValueError as e:
+            # Оповещение важнее геозоны: событие создаётся без неё
+            geofence = {}
+            message_log.warning("Некорректная геозона в оповещении", extra={"fields": self.log_fields(error=str(e))})
+
+        db_start = time.perf_counter()
+        try:
+            # Получаем или создаем тип события
+            event_type = event_type_by_name(event_type_name)
+
+            # Создаем событие
+            event = EmergencyEvent.objects.create(
+                title=event_data.get("title", "Без названия"),
+                description=event_data.get("description", ""),
+                event_type=event_type,
+                location=event_data.get("location", ""),
+                severity=severity,
+                is_active=True,
+                trace_id=trace["id"],
+                **geofence
+            )
+        except Exception:
+            if entry is not None:
+                CORRELATOR.release(key, entry)
+            raise
+        if entry is not None:
+            CORRELATOR.commit(entry, event.id, severity)
+        record('db', time.perf_counter() - db_start)
+        
+        # Отправляем событие всем клиентам через WebSocket
+        group_send(
+            EMERGENCY_GROUP,
+            {"type": "emergency_broadcast", "event": event_payload(event)},
+            trace=trace,
+            lane=ALERT_LANE
+        )
+        self.replicate(event, trace)
+        
+        # Отправляем подтверждение клиенту МЧС
+        self.send({
+            "status": "success",
+            "message": "Оповещение успешно создано",
+            "event_id": event.id,
+            "merged": False
+        })
+        
+        TCP_ALERTS.labels('created').inc()
+        message_log.info("Создано новое оповещение", extra={"fields": self.log_fields(event_id=event.id, trace_id=trace["id"])})
+
+    def merge_alert(self, key, entry, severity, trace):
+        """
+        Объединить повторное оповещение с существующим событием.
+
+        Рассылка выполняется только при повышении серьёзности. False, если
+        событие уже закрыто и нужно создать новое.
+        """
+        event = EmergencyEvent.objects.select_related('event_type').filter(
+            pk=entry.event_id, is_active=True
+        ).first()
+        if event is None:
+            CORRELATOR.release(key, entry)
+            return False
+        CORRELATOR.merged(entry)
+
+        escalated = CORRELATOR.escalate(entry, severity) and severity > event.severity
+        if escalated:
+            EmergencyEvent.objects.filter(pk=event.pk, severity__lt=severity).update(severity=severity)
+            event.severity = severity
+            group_send(
+                EMERGENCY_GROUP,
+                {"type": "emergency_broadcast", "event": event_payload(event)},
+                trace=trace,
+                lane=ALERT_LANE
+            )
+            self.replicate(event, trace)
+
+        self.send({
+            "status": "success",
+            "message": "Оповещение объединено с существующим событием",
+            "event_id": event.id,
+            "merged": True,
+            "duplicates": entry.duplicates,
+            "escalated": escalated
+        })
+
+        TCP_ALERTS.labels('escalated' if escalated else 'merged').inc()
+        message_log.info(
+            "Оповещение объединено с существующим",
+            extra={"fields": self.log_fields(
+                event_id=event.id, duplicates=entry.duplicates,
+                escalated=escalated, trace_id=trace["id"]
+            )}
+        )
+        return True
+
+    def replicate(self, event, trace):
+        """Поставить событие в очередь репликации на другие узлы"""
+        if self.server.federation is not None:
+            self.server.federation.publish(federated_alert(event, trace))
+
+    def log_fields(self, **fields):
+        return dict(session_id=self.session_id, addr=self.address[0], **fields)
+
     def stop(self):
         self.running = False
 
 class TCPServer:
     def __init__(self, host=None, port=None):
-        self.host = host or settings.TCP_SERVER_HOST
-        self.port = port or settings.TCP_SERVER_PORT
+        self.host = host if host is not None else settings.TCP_SERVER_HOST
+        self.port = port if port is not None else settings.TCP_SERVER_PORT
+        self.socket = None
+        self.running = False
+        self.clients = {}  # session_id -> ClientHandler
+        self.node_id = settings.NODE_ID or None
+        self.federation = None
+
+    def bind(self):
+        """Открыть и привязать сокет (не при создании объекта, а перед запуском)"""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.host, self.port))
-        self.running = False
-        self.clients = {}  # session_id -> ClientHandler
+        # При port=0 система выбирает свободный порт
+        self.port = self.socket.getsockname()[1]
+        if not self.node_id:
+            self.node_id = f"{socket.gethostname()}:{self.port}"
+        self.socket.listen(5)
         
     def start(self):
+        if self.socket is None:
+            self.bind()
         self.running = True
-        self.socket.listen(5)
-        print(f"TCP сервер запущен на {self.host}:{self.port}")
+        log.info("TCP сервер запущен", extra={"fields": {"host": self.host, "port": self.port}})
         
         while self.running:
             try:
@@ -140,7 +266,7 @@ class TCPServer:
                 self.clients[client_handler.session_id] = client_handler
             except Exception as e:
                 if self.running:
-                    print(f"Ошибка TCP сервера: {e}")
+                    log.error("Ошибка TCP сервера", extra={"fields": {"error": str(e)}})
     
     def stop(self):
         self.running = False
@@ -150,10 +276,12 @@ class TCPServer:
             client_handler.stop()
             
         self.socket.close()
-        print("TCP сервер остановлен")
+        log.info("TCP сервер остановлен")
 
-def start_tcp_server():
-    server = TCPServer()
+def start_tcp_server(host=None, port=None):
+    setup_ingest_logging()
+    server = TCPServer(host, port)
+    server.bind()
     server_thread = threading.Thread(target=server.start)
     server_thread.daemon = True
     server_thread.start()
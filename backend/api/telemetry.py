@@ -0,0 +1,213 @@
+"""
+Бинарный поток телеметрии дронов для карты.
+
+Поток приёма UDP сохраняет последнее положение каждого дрона, а фоновый
+поток TELEMETRY_FRAME_RATE раз в секунду упаковывает изменившиеся дроны в
+один бинарный кадр и отправляет его в группу TELEMETRY_GROUP. Кадр —
+заголовок и колонки little-endian, которые браузер читает через
+Float64Array/Uint32Array/Float32Array без разбора JSON:
+
+    заголовок (24 байта): тип (u8), версия формата (u8), резерв (u16),
+        эпоха словаря (u32), размер словаря (u32), число дронов n (u32),
+        время кадра, секунды Unix (f64)
+    latitude f64[n], longitude f64[n], индекс дрона u32[n],
+    altitude f32[n], speed f32[n], battery f32[n]
+
+Индекс дрона — позиция его идентификатора в словаре. Словарь только
+дополняется: клиент получает его целиком при подключении, затем только
+новые идентификаторы. Полный словарь хранится в кэше Django, эпоха
+меняется при перезапуске сервера приёма.
+"""
+
+import random
+import struct
+import sys
+import threading
+import time
+from array import array
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .broadcast import BROADCASTER, TELEMETRY_GROUP, group_send, group_send_telemetry
+from .log import get_logger
+from .metrics import REGISTRY
+
+FRAME_POSITIONS = 1
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<BBHIIId')
+DICTIONARY_CACHE_KEY = 'telemetry_dictionary'
+
+# Колонки кадра и коды типов array: d — f64, I — u32, f — f32
+COLUMNS = (
+    ('latitude', 'd'),
+    ('longitude', 'd'),
+    ('index', 'I'),
+    ('altitude', 'f'),
+    ('speed', 'f'),
+    ('battery', 'f'),
+)
+
+log = get_logger('telemetry')
+
+TELEMETRY_FRAMES = REGISTRY.counter(
+    'telemetry_frames_total', 'Отправленные бинарные кадры телеметрии'
+)
+TELEMETRY_FRAME_DRONES = REGISTRY.histogram(
+    'telemetry_frame_drones', 'Число дронов в кадре телеметрии',
+    buckets=(1, 10, 100, 1000, 10000, 100000)
+)
+TELEMETRY_DICTIONARY_OVERFLOW = REGISTRY.counter(
+    'telemetry_dictionary_overflow_total', 'Пакеты дронов, не поместившихся в словарь'
+)
+
+
+def encode_positions(epoch, dictionary_size, positions, timestamp=None):
+    """Упаковать {индекс: (lat, lon, alt, speed, battery)} в бинарный кадр"""
+    count = len(positions)
+    # Упаковка через array: процесс приёма не загружает NumPy
+    latitude, longitude, altitude, speed, battery = zip(*positions.values()) if count else ((),) * 5
+    columns = {
+        'latitude': latitude,
+        'longitude': longitude,
+        'index': positions.keys(),
+        'altitude': altitude,
+        'speed': speed,
+        'battery': battery,
+    }
+    header = HEADER.pack(
+        FRAME_POSITIONS, FORMAT_VERSION, 0, epoch, dictionary_size, count,
+        time.time() if timestamp is None else timestamp
+    )
+    parts = [header]
+    # Колонки f64 идут первыми, поэтому все смещения кратны размеру элемента
+    for name, typecode in COLUMNS:
+        column = array(typecode, columns[name])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        parts.append(column.tobytes())
+    return b''.join(parts)
+
+
+def decode_positions(frame):
+    """Разобрать кадр (для проверок и нагрузочного теста)"""
+    import numpy as np
+
+    kind, version, _, epoch, dictionary_size, count, timestamp = HEADER.unpack_from(frame)
+    if kind != FRAME_POSITIONS or version != FORMAT_VERSION:
+        raise ValueError("неизвестный формат кадра телеметрии")
+    result = {'epoch': epoch, 'dictionary_size': dictionary_size, 'timestamp': timestamp}
+    offset = HEADER.size
+    for name, typecode in COLUMNS:
+        dtype = np.dtype('<' + typecode)
+        result[name] = np.frombuffer(frame, dtype=dtype, count=count, offset=offset)
+        offset += count * dtype.itemsize
+    return result
+
+
+def current_dictionary():
+    """Полный словарь из кэша: {'epoch': ..., 'drone_ids': [...]} или None"""
+    return cache.get(DICTIONARY_CACHE_KEY)
+
+
+class TelemetryFrames:
+    """
+    Последние положения дронов и поток отправки кадров.
+
+    observe() вызывается потоком приёма для каждого пакета и только
+    заменяет запись дрона: между кадрами дрон отправляется один раз.
+    """
+
+    def __init__(self, rate=None, max_drones=None, group=TELEMETRY_GROUP):
+        self.interval = 1 / (rate or settings.TELEMETRY_FRAME_RATE)
+        self.max_drones = max_drones or settings.TELEMETRY_MAX_DRONES
+        self.group = group
+        self.epoch = random.getrandbits(32)
+        self.indexes = {}  # drone_id -> индекс в словаре
+        self.drone_ids = []
+        self.published = 0  # размер словаря, уже отправленный клиентам
+        self.latest = {}  # индекс -> (lat, lon, alt, speed, battery)
+        self.queued = {}  # положения последнего кадра, поставленного в очередь
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self.thread = None
+
+    def observe(self, row):
+        with self._lock:
+            index = self.indexes.get(row['drone_id'])
+            if index is None:
+                if len(self.drone_ids) >= self.max_drones:
+                    TELEMETRY_DICTIONARY_OVERFLOW.inc()
+                    return
+                index = self.indexes[row['drone_id']] = len(self.drone_ids)
+                self.drone_ids.append(row['drone_id'])
+            self.latest[index] = (
+                row['latitude'], row['longitude'], row['altitude'],
+                row['speed'], row['battery_level'],
+            )
+
+    def start(self):
+        self._stopping.clear()
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        self.thread = thread
+
+    def stop(self):
+        self._stopping.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        next_tick = time.monotonic()
+        while True:
+            next_tick += self.interval
+            if self._stopping.wait(max(next_tick - time.monotonic(), 0)):
+                return
+            if next_tick < time.monotonic():
+                # Отстали (долгая отправка) — не наверстываем пропущенные кадры
+                next_tick = time.monotonic()
+            try:
+                self.tick()
+            except Exception as e:
+                log.error("Ошибка отправки кадра телеметрии", extra={"fields": {"error": str(e)}})
+
+    def tick(self):
+        with self._lock:
+            positions, self.latest = self.latest, {}
+            size = len(self.drone_ids)
+            added = self.drone_ids[self.published:size]
+            drone_ids = list(self.drone_ids) if added else None
+        if added:
+            # Кэш обновляется до рассылки: клиент, пропустивший дополнение,
+            # перечитывает из него полный словарь
+            cache.set(DICTIONARY_CACHE_KEY, {'epoch': self.epoch, 'drone_ids': drone_ids}, None)
+            group_send(self.group, {
+                'type': 'telemetry_dictionary',
+                'epoch': self.epoch,
+                'offset': self.published,
+                'drone_ids': added,
+            })
+            self.published = size
+        if not positions:
+            return
+        if BROADCASTER.telemetry_queued(self.group, 'frame'):
+            # Под нагрузкой неотправленный кадр заменяется следующим: переносим
+            # из него дроны, не изменившиеся с тех пор. Если кадр успеют
+            # отправить до замены, эти положения просто придут повторно.
+            positions = {**self.queued, **positions}
+        frame = encode_positions(self.epoch, size, positions)
+        result = group_send_telemetry(self.group, 'frame', {
+            'type': 'telemetry_frame',
+            'epoch': self.epoch,
+            'dictionary_size': size,
+            'frame': frame,
+        })
+        if result == 'dropped':
+            # Очередь переполнена: положения уйдут со следующим кадром
+            with self._lock:
+                self.latest = {**positions, **self.latest}
+            return
+        self.queued = positions
+        TELEMETRY_FRAMES.inc()
+        TELEMETRY_FRAME_DRONES.observe(len(positions))
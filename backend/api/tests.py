@@ -1,3 +1,776 @@
-from django.test import TestCase
+import asyncio
+import json
+import logging
+import socket
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from .broadcast import ALERT_LANE, STATE_LANE, Broadcaster
+from .consumers import EmergencyConsumer
+from .correlation import ALERTS_SUPPRESSED, AlertCorrelator
+from .federation import Federation, apply_federated_alerts
+from .geofence import METERS_PER_DEGREE, Fence, GeofenceIndex
+from .metrics import UDP_PACKETS, Registry
+from .liveness import LOST, ONLINE, LivenessTracker, current_drone_states
+from .log import SamplingFilter
+from .models import DroneData, EmergencyEvent, EventType, Server
+from .probes import HEALTH_PATH, ProbeScheduler, probe_statuses
+from .spool import SpoolReplayer, SpoolWriter, encode_row
+from .storage import bulk_insert_drone_data
+from .tcp_server import ClientHandler, TCPServer
+from .tracing import SlidingWindow
+from .telemetry import TelemetryFrames, decode_positions
+from .udp_server import UDPServer, parse_drone_packet
+
+
+def federated_batch(*alerts, origin='node-b', seq=1):
+    return {"type": "federated_alerts", "origin": origin, "seq": seq, "alerts": list(alerts)}
+
+
+def federated_alert(alert_id, severity):
+    return {
+        "id": alert_id,
+        "title": "Пожар",
+        "event_type": "Пожар",
+        "location": "г. Москва",
+        "severity": severity,
+    }
+
+
+class FederatedAlertsTests(TestCase):
+    def apply(self, message):
+        replies = []
+        apply_federated_alerts(message, 'node-a', replies.append)
+        return replies[0]
+
+    def test_escalation_in_same_batch_as_new_event(self):
+        ack = self.apply(federated_batch(federated_alert(77, 2), federated_alert(77, 4)))
+
+        event = EmergencyEvent.objects.get(origin_node='node-b', origin_event_id=77)
+        self.assertEqual(event.severity, 4)
+        self.assertEqual((ack["applied"], ack["duplicates"]), (1, 1))
+
+    def test_escalation_of_known_event(self):
+        self.apply(federated_batch(federated_alert(5, 2)))
+        ack = self.apply(federated_batch(federated_alert(5, 3), seq=2))
+
+        self.assertEqual(EmergencyEvent.objects.get(origin_event_id=5).severity, 3)
+        self.assertEqual((ack["applied"], ack["duplicates"]), (0, 1))
+        self.assertEqual(EmergencyEvent.objects.count(), 1)
+
+    def test_invalid_ids_are_skipped(self):
+        alerts = [federated_alert(alert_id, 2) for alert_id in ("7", None, True, 2 ** 70, -1, [1], {"a": 1})]
+        with self.assertLogs('ingest.federation', 'WARNING'):
+            ack = self.apply(federated_batch(federated_alert(8, 2), *alerts, "not an alert"))
+
+        self.assertEqual((ack["applied"], ack["duplicates"], ack["rejected"]), (1, 0, 8))
+        self.assertEqual(list(EmergencyEvent.objects.values_list('origin_event_id', flat=True)), [8])
+
+    def test_own_events_are_not_applied(self):
+        ack = self.apply(federated_batch(federated_alert(1, 2), origin='node-a'))
+
+        self.assertEqual(ack["duplicates"], 1)
+        self.assertFalse(EmergencyEvent.objects.exists())
+
+
+def telemetry_row(drone_id, **fields):
+    row = {
+        "drone_id": drone_id,
+        "latitude": 55.75,
+        "longitude": 37.61,
+        "altitude": 120.0,
+        "speed": 12.5,
+        "battery_level": 80.0,
+        "status": "active",
+        "timestamp": timezone.now(),
+        "related_event_id": None,
+        "trace_id": "",
+    }
+    row.update(fields)
+    return row
+
+
+class TelemetryBatchTests(TestCase):
+    def test_empty_strings_and_nulls_are_kept(self):
+        event = EmergencyEvent.objects.create(
+            title="Пожар", event_type=EventType.objects.create(name="Пожар"), location="г. Москва", severity=2
+        )
+        bulk_insert_drone_data([
+            telemetry_row("drone-1"),
+            telemetry_row("drone-2", status="", trace_id="ab12", related_event_id=event.id),
+            telemetry_row("drone-3", related_event_id=event.id + 1),
+        ])
+
+        rows = {d.drone_id: d for d in DroneData.objects.all()}
+        self.assertEqual((rows["drone-1"].trace_id, rows["drone-1"].related_event_id), ("", None))
+        self.assertEqual((rows["drone-2"].status, rows["drone-2"].related_event_id), ("", event.id))
+        self.assertIsNone(rows["drone-3"].related_event_id)
+
+
+class SpoolReplayTests(TestCase):
+    def test_rejected_row_does_not_drop_batch(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        writer = SpoolWriter(directory.name, segment_size=1024 * 1024, max_segments=2)
+        for number in range(5):
+            row = telemetry_row(f"drone-{number}")
+            if number == 3:
+                row["latitude"] = None
+            writer.append(encode_row(row))
+        writer.close()
+
+        flushed = []
+        replayer = SpoolReplayer(directory.name, on_flush=flushed.extend, batch_size=500)
+        replayer.running = True
+        replayer.seek_committed()
+        with self.assertLogs('ingest.spool', 'ERROR') as logs:
+            self.assertTrue(replayer.load(replayer.next_batch()))
+        replayer.close_segment()
+        self.assertEqual(len(logs.records), 1)
+
+        self.assertEqual(DroneData.objects.count(), 4)
+        self.assertFalse(DroneData.objects.filter(drone_id="drone-3").exists())
+        self.assertEqual(len(flushed), 4)
+
+
+class SamplingFilterTests(TestCase):
+    def record(self, drone_id):
+        record = logging.LogRecord('ingest.udp.packet', logging.INFO, __file__, 0, "пакет", None, None)
+        record.fields = {"drone_id": drone_id}
+        return record
+
+    def test_counters_are_bounded(self):
+        sampling = SamplingFilter({'ingest.udp.packet': {'every': 3, 'key': 'drone_id'}}, max_keys=100)
+        passed = [sampling.filter(self.record("drone-1")) for _ in range(6)]
+        self.assertEqual(passed, [True, False, False, True, False, False])
+
+        for number in range(1000):
+            sampling.filter(self.record(f"spoofed-{number}"))
+        self.assertLessEqual(len(sampling.counters), 100)
+
+    def test_counters_reset_each_period(self):
+        sampling = SamplingFilter({'ingest.udp.packet': {'every': 3, 'key': 'drone_id'}}, reset_interval=60)
+        self.assertTrue(sampling.filter(self.record("drone-1")))
+        self.assertFalse(sampling.filter(self.record("drone-1")))
+        with mock.patch('api.log.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertTrue(sampling.filter(self.record("drone-1")))
+        self.assertEqual(len(sampling.counters), 1)
+
+
+class TelemetryFramesTests(TestCase):
+    def setUp(self):
+        # Поток отправки не запускается: кадры остаются в очереди
+        self.broadcaster = Broadcaster(telemetry_limit=10, batch_size=10, send_timeout=1)
+        self.broadcaster.ensure_started = lambda: None
+        for target in ('api.broadcast.BROADCASTER', 'api.telemetry.BROADCASTER'):
+            patcher = mock.patch(target, self.broadcaster)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.frames = TelemetryFrames(rate=1, max_drones=10, group='test_telemetry')
+
+    def observe(self, drone_id, latitude):
+        self.frames.observe({
+            "drone_id": drone_id, "latitude": latitude, "longitude": 37.61,
+            "altitude": 120.0, "speed": 12.5, "battery_level": 80.0,
+        })
+
+    def queued_frame(self):
+        message, _ = self.broadcaster.telemetry['test_telemetry']['frame']
+        frame = decode_positions(message['frame'])
+        return dict(zip(frame['index'].tolist(), frame['latitude'].tolist()))
+
+    def test_replaced_frame_keeps_its_drones(self):
+        self.observe("drone-a", 55.0)
+        self.observe("drone-b", 56.0)
+        self.frames.tick()
+        self.observe("drone-a", 55.5)
+        self.frames.tick()
+
+        self.assertEqual(self.queued_frame(), {0: 55.5, 1: 56.0})
+
+    def test_sent_frame_is_not_repeated(self):
+        self.observe("drone-a", 55.0)
+        self.observe("drone-b", 56.0)
+        self.frames.tick()
+        while self.broadcaster.telemetry:
+            self.broadcaster.next_message()
+        self.observe("drone-a", 55.5)
+        self.frames.tick()
+
+        self.assertEqual(self.queued_frame(), {0: 55.5})
+
+
+class DroneTrackTests(TestCase):
+    def test_tolerance_must_be_finite(self):
+        DroneData.objects.create(**telemetry_row("drone-1"))
+        for tolerance in ("inf", "-1", "nan", "abc"):
+            response = self.client.get("/api/drone-data/drone-1/track/", {"tolerance": tolerance})
+            self.assertEqual(response.status_code, 400, tolerance)
+
+        response = self.client.get("/api/drone-data/drone-1/track/", {"tolerance": "5"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tolerance"], 5.0)
+
+    def create_line(self, drone_id, count, **fields):
+        """Прямой пролёт на север: шаг 0.001° широты раз в 10 секунд"""
+        start = timezone.now() - timezone.timedelta(hours=1)
+        for i in range(count):
+            DroneData.objects.create(**telemetry_row(
+                drone_id, latitude=55.75 + i * 0.001, longitude=37.61,
+                speed=10.0 + i, timestamp=start + timezone.timedelta(seconds=10 * i), **fields
+            ))
+
+    def test_simplification_and_stats(self):
+        self.create_line("drone-1", 5)
+        # точка в стороне от прямой должна пережить упрощение
+        DroneData.objects.filter(drone_id="drone-1", speed=12.0).update(longitude=37.62)
+
+        track = self.client.get("/api/drone-data/drone-1/track/", {"tolerance": "150"}).json()
+        self.assertEqual(track["points_total"], 5)
+        self.assertEqual(track["points"], 3)
+        self.assertEqual([point[1] for point in track["polyline"]], [37.61, 37.62, 37.61])
+        self.assertFalse(track["truncated"])
+
+        stats = track["stats"]
+        self.assertEqual(stats["duration_s"], 40.0)
+        self.assertEqual(stats["avg_reported_speed"], 12.0)
+        self.assertEqual(stats["max_reported_speed"], 14.0)
+        # дистанция считается по всем точкам: два шага по 111 м вдоль
+        # меридиана и два отрезка к точке, смещённой на 626 м к востоку
+        self.assertAlmostEqual(stats["distance_m"], 2 * (111.2 + 635.6), delta=5)
+        self.assertAlmostEqual(stats["avg_speed_kmh"], stats["distance_m"] / 40 * 3.6, places=1)
+
+        track = self.client.get("/api/drone-data/drone-1/track/", {"tolerance": "0"}).json()
+        self.assertEqual(track["points"], 5)
+
+    def test_straight_line_collapses(self):
+        self.create_line("drone-1", 20)
+        track = self.client.get("/api/drone-data/drone-1/track/", {"tolerance": "1"}).json()
+        self.assertEqual(track["points"], 2)
+        self.assertAlmostEqual(track["stats"]["distance_m"], 19 * 111.2, delta=5)
+
+    def test_drone_id_with_dot(self):
+        self.create_line("uav.7", 3)
+        response = self.client.get("/api/drone-data/uav.7/track/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["points_total"], 3)
+
+    def test_non_finite_rows_skipped(self):
+        self.create_line("drone-1", 4)
+        DroneData.objects.create(**telemetry_row("drone-1", altitude=float("inf")))
+        DroneData.objects.create(**telemetry_row("drone-1", speed=float("-inf")))
+
+        response = self.client.get("/api/drone-data/drone-1/track/")
+        self.assertEqual(response.status_code, 200)
+        track = response.json()
+        self.assertEqual(track["points_total"], 4)
+        self.assertEqual(track["points_skipped"], 2)
+
+    def test_rows_limited(self):
+        self.create_line("drone-1", 10)
+        with self.settings(TRACK_MAX_POINTS=4):
+            track = self.client.get("/api/drone-data/drone-1/track/", {"tolerance": "0"}).json()
+        self.assertTrue(track["truncated"])
+        self.assertEqual(track["points_total"], 4)
+        # остаются последние точки периода
+        self.assertEqual(track["polyline"][-1][0], round(55.75 + 9 * 0.001, 6))
+        self.assertEqual(track["stats"]["duration_s"], 30.0)
+
+
+class GeofenceTests(TestCase):
+    square = [[55.745, 37.605], [55.745, 37.615], [55.755, 37.615], [55.755, 37.605]]
+
+    def test_grid_matching(self):
+        # квадрат пересекает границы ячеек 55.75 и 37.61
+        index = GeofenceIndex([Fence(1, 2, geofence=self.square)], 0.01, 4096)
+        self.assertEqual(len(index.cells), 4)
+        for lat, lon in ((55.746, 37.606), (55.754, 37.614), (55.746, 37.614), (55.754, 37.606)):
+            self.assertEqual(index.match(lat, lon), 1, (lat, lon))
+        # та же ячейка, но вне многоугольника, и соседняя ячейка
+        self.assertIsNone(index.match(55.744, 37.606))
+        self.assertIsNone(index.match(55.766, 37.606))
+
+    def test_negative_coordinates_and_wide_fences(self):
+        circle = Fence(1, 2, latitude=-33.45, longitude=-70.66, radius_m=500)
+        for max_cells in (4096, 1):
+            index = GeofenceIndex([circle], 0.01, max_cells)
+            self.assertEqual(len(index.wide), 0 if max_cells > 1 else 1)
+            self.assertEqual(index.match(-33.452, -70.661), 1)
+            self.assertIsNone(index.match(-33.46, -70.66))
+
+    def test_circle_edge(self):
+        fence = Fence(1, 2, latitude=55.75, longitude=37.61, radius_m=1000)
+        step = 1000 / METERS_PER_DEGREE
+        self.assertTrue(fence.contains(55.75 + step * 0.999, 37.61))
+        self.assertFalse(fence.contains(55.75 + step * 1.001, 37.61))
+        # градус долготы короче градуса широты в cos(широты) раз
+        self.assertTrue(fence.contains(55.75, 37.61 + step / fence.cos_lat * 0.999))
+        self.assertFalse(fence.contains(55.75, 37.61 + step / fence.cos_lat * 1.001))
+
+    def test_overlap_priority(self):
+        index = GeofenceIndex([
+            Fence(1, 3, geofence=self.square),
+            Fence(2, 2, latitude=55.75, longitude=37.61, radius_m=300),
+            Fence(3, 3, latitude=55.75, longitude=37.61, radius_m=100),
+        ], 0.01, 4096)
+        # более серьёзное событие, при равной серьёзности — более новое
+        self.assertEqual(index.match(55.75, 37.61), 3)
+        self.assertEqual(index.match(55.7515, 37.61), 1)
+
+    def test_rest_edits_invalidate_index(self):
+        event_type = EventType.objects.create(name="Пожар")
+        with mock.patch('api.geofence.GEOFENCES.invalidate') as invalidate:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post("/api/emergency-events/", {
+                    "title": "Пожар", "description": "Склад", "event_type": event_type.id, "location": "Москва",
+                    "severity": 2, "latitude": 55.75, "longitude": 37.61, "radius_m": 500,
+                }, content_type="application/json")
+            self.assertEqual(response.status_code, 201)
+            event_id = response.json()["id"]
+            self.assertEqual(invalidate.call_count, 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.patch(f"/api/emergency-events/{event_id}/", {"is_active": False},
+                                  content_type="application/json")
+            self.assertEqual(invalidate.call_count, 2)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.delete(f"/api/emergency-events/{event_id}/")
+            self.assertEqual(invalidate.call_count, 3)
+
+
+class DronePacketTests(TestCase):
+    def packet(self, **fields):
+        packet = {"id": "drone-1", "lat": 55.75, "lon": 37.61, "alt": 120,
+                  "speed": 12.5, "battery": 80, "status": "active"}
+        packet.update(fields)
+        return packet
+
+    def test_non_finite_numbers_rejected(self):
+        self.assertEqual(parse_drone_packet(self.packet())["altitude"], 120.0)
+        for field in ("lat", "lon", "alt", "speed", "battery"):
+            for value in (float("nan"), float("inf"), -float("inf"), 10 ** 400):
+                with self.assertRaises(ValueError, msg=(field, value)):
+                    parse_drone_packet(self.packet(**{field: value}))
+
+    def test_non_finite_packet_counted_as_rejected(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with self.settings(TELEMETRY_SPOOL_DIR=directory.name):
+            server = UDPServer(port=0)
+        rejected = UDP_PACKETS.labels('rejected').get()
+        parsed = UDP_PACKETS.labels('parsed').get()
+
+        # json.dumps по умолчанию пишет NaN и Infinity, json.loads их принимает
+        for value in (float("nan"), float("inf")):
+            server.process_data(json.dumps(self.packet(lat=value)).encode(), ("127.0.0.1", 5000))
+
+        self.assertEqual(UDP_PACKETS.labels('rejected').get(), rejected + 2)
+        self.assertEqual(UDP_PACKETS.labels('parsed').get(), parsed)
+        # сокет не открывался — остановка всё равно проходит
+        server.stop()
+
+
+class DroneStatesTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch('api.liveness.group_send')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def wait_for_states(self, expected):
+        """Дождаться в кэше {drone_id: состояние связи}"""
+        deadline = time.monotonic() + 2
+        while time.monotonic() < deadline:
+            states = {state["drone_id"]: state for state in current_drone_states()}
+            if {drone_id: state["liveness"] for drone_id, state in states.items()} == expected:
+                break
+            time.sleep(0.01)
+        return states
+
+    def test_snapshot_on_connect(self):
+        tracker = LivenessTracker(
+            stale_after=0.2, lost_after=0.4, battery_thresholds={'low': 20}, battery_hysteresis=5
+        )
+        tracker.start()
+        self.addCleanup(tracker.stop)
+        tracker.observe(telemetry_row("drone-a", battery_level=80.0))
+        tracker.observe(telemetry_row("drone-b", battery_level=10.0))
+
+        states = self.wait_for_states({"drone-a": LOST, "drone-b": LOST})
+        self.assertEqual(states["drone-a"]["liveness"], LOST)
+        self.assertEqual(states["drone-b"]["battery"], 'low')
+
+        tracker.observe(telemetry_row("drone-a", battery_level=80.0))
+        tracker.observe(telemetry_row("drone-b", battery_level=10.0))
+        states = self.wait_for_states({"drone-b": ONLINE})
+        self.assertEqual(list(states), ["drone-b"])
+
+        async def connect():
+            communicator = WebsocketCommunicator(EmergencyConsumer.as_asgi(), "/ws/emergency/")
+            await communicator.connect()
+            await communicator.receive_json_from()  # initial_events
+            message = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return message
+
+        message = async_to_sync(connect)()
+        self.assertEqual(message["type"], "drone_states")
+        self.assertEqual([state["drone_id"] for state in message["drones"]], ["drone-b"])
+
+    def test_lost_drone_is_forgotten(self):
+        tracker = LivenessTracker(stale_after=0.05, lost_after=0.1, forget_after=0.3)
+        tracker.start()
+        self.addCleanup(tracker.stop)
+        tracker.observe(telemetry_row("drone-a"))
+
+        self.assertEqual(list(self.wait_for_states({"drone-a": LOST})), ["drone-a"])
+        self.assertEqual(self.wait_for_states({}), {})
+        self.assertEqual(tracker.states, {})
+
+    def test_battery_recovers_through_each_threshold(self):
+        tracker = LivenessTracker(battery_thresholds={'low': 20, 'critical': 10}, battery_hysteresis=5)
+
+        self.assertEqual(tracker.battery_band(12, 'critical'), 'critical')
+        self.assertEqual(tracker.battery_band(22, 'critical'), 'low')
+        self.assertEqual(tracker.battery_band(25, 'critical'), 'ok')
+        self.assertEqual(tracker.battery_band(22, 'low'), 'low')
+        self.assertEqual(tracker.battery_band(8, 'ok'), 'critical')
+
+
+class FakeChannelLayer:
+    def __init__(self, failures=0, delays=None):
+        self.failures = failures
+        self.delays = delays or {}
+        self.sent = []
+
+    async def group_send(self, group, message):
+        await asyncio.sleep(self.delays.get(group, 0))
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("channel layer недоступен")
+        self.sent.append((group, message))
+
+
+class BroadcasterTests(TestCase):
+    def start(self, layer, **options):
+        patcher = mock.patch('api.broadcast.get_channel_layer', return_value=layer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return Broadcaster(telemetry_limit=10, batch_size=10, send_timeout=1, **options)
+
+    def wait_for(self, condition, timeout=3):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_failed_alert_is_retried(self):
+        layer = FakeChannelLayer(failures=2)
+        broadcaster = self.start(layer, retry_limit=3)
+        with self.assertLogs('ingest.broadcast', 'ERROR'):
+            broadcaster.publish('alerts', {'type': 'emergency_broadcast', 'n': 1}, ALERT_LANE)
+            broadcaster.publish('alerts', {'type': 'emergency_broadcast', 'n': 2}, ALERT_LANE)
+            self.assertTrue(self.wait_for(lambda: layer.sent))
+
+        # Повтор уходит первым и сохраняет порядок оповещений
+        messages = layer.sent[0][1]['messages']
+        self.assertEqual([message['n'] for message in messages], [1, 2])
+
+    def test_alert_is_dropped_after_retry_limit(self):
+        layer = FakeChannelLayer(failures=2)
+        broadcaster = self.start(layer, retry_limit=1)
+        with self.assertLogs('ingest.broadcast', 'ERROR') as logs:
+            broadcaster.publish('alerts', {'type': 'emergency_broadcast', 'n': 1}, ALERT_LANE)
+            self.assertTrue(self.wait_for(lambda: any('после повторов' in line for line in logs.output)))
+            broadcaster.publish('alerts', {'type': 'emergency_broadcast', 'n': 2}, ALERT_LANE)
+            self.assertTrue(self.wait_for(lambda: layer.sent))
+
+        self.assertEqual(layer.sent, [('alerts', {'type': 'emergency_broadcast', 'n': 2})])
+
+    def test_alert_is_sent_before_waiting_telemetry_and_state(self):
+        layer = FakeChannelLayer(delays={'slow': 0.3})
+        broadcaster = self.start(layer)
+        broadcaster.publish('slow', {'type': 'drone_state'})
+        self.assertTrue(self.wait_for(lambda: not broadcaster.lanes[STATE_LANE]))
+        broadcaster.publish_telemetry('telemetry', 'frame', {'type': 'telemetry_frame'})
+        broadcaster.publish('states', {'type': 'drone_state'})
+        broadcaster.publish('alerts', {'type': 'emergency_broadcast'}, ALERT_LANE)
+
+        self.assertTrue(self.wait_for(lambda: len(layer.sent) == 4))
+        self.assertEqual([group for group, _ in layer.sent], ['slow', 'alerts', 'states', 'telemetry'])
+
+    def test_failed_state_change_is_sent_before_next(self):
+        layer = FakeChannelLayer(failures=1)
+        broadcaster = self.start(layer, retry_limit=3)
+        with self.assertLogs('ingest.broadcast', 'ERROR'):
+            broadcaster.publish('states', {'type': 'drone_state', 'n': 1})
+            self.assertTrue(self.wait_for(lambda: STATE_LANE in broadcaster.retry_at))
+            broadcaster.publish('other', {'type': 'drone_state', 'n': 2})
+            self.assertTrue(self.wait_for(lambda: len(layer.sent) == 2))
+
+        self.assertEqual([message['n'] for _, message in layer.sent], [1, 2])
+
+
+class MetricsTests(TestCase):
+    def run_threads(self, target, count):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_exposition_format(self):
+        registry = Registry()
+        registry.counter('test_requests_total', 'Запросы', ('path',)).labels('/a "b"\n').inc(2)
+        registry.gauge('test_active', 'Активные').dec(1.5)
+        histogram = registry.histogram('test_seconds', 'Длительность', buckets=(0.1, 1))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(3)
+
+        self.assertEqual(registry.render(), "\n".join([
+            '# HELP test_requests_total Запросы',
+            '# TYPE test_requests_total counter',
+            'test_requests_total{path="/a \\"b\\"\\n"} 2',
+            '# HELP test_active Активные',
+            '# TYPE test_active gauge',
+            'test_active -1.5',
+            '# HELP test_seconds Длительность',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 1',
+            'test_seconds_bucket{le="1"} 2',
+            'test_seconds_bucket{le="+Inf"} 3',
+            'test_seconds_sum 3.55',
+            'test_seconds_count 3',
+        ]) + "\n")
+
+    def test_endpoint(self):
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response["Content-Type"], 'text/plain; version=0.0.4; charset=utf-8')
+        self.assertIn(b'# TYPE tcp_alerts_total counter', response.content)
+
+    def test_counters_merge_across_threads(self):
+        counter = Registry().counter('test_total', 'Счётчик')
+
+        def work():
+            for _ in range(1000):
+                counter.inc()
+
+        self.run_threads(work, 8)
+        counter.inc()
+        self.assertEqual(counter.get(), 8001)
+
+    def test_dead_thread_shards_are_retired_without_scrape(self):
+        counter = Registry().counter('test_total', 'Счётчик')
+        for _ in range(50):
+            self.run_threads(counter.inc, 1)
+
+        self.assertLessEqual(len(counter._value._shards), 1)
+        self.assertEqual(counter.get(), 50)
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.replies = []
+
+    def sendall(self, data):
+        self.replies.append(json.loads(data))
+
+
+class AlertCorrelationTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch('api.tcp_server.CORRELATOR', AlertCorrelator(window=60))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.socket = RecordingSocket()
+        self.handler = ClientHandler(self.socket, ('127.0.0.1', 0), TCPServer('127.0.0.1', 0))
+
+    def alert(self, severity=2):
+        self.handler.process_message({
+            "type": "emergency_alert",
+            "data": {"title": "Пожар", "event_type": "Пожар", "location": "г. Москва", "severity": severity},
+        })
+        return self.socket.replies[-1]
+
+    def test_duplicate_is_merged(self):
+        created = self.alert()
+        merged = self.alert()
+
+        self.assertTrue(merged["merged"])
+        self.assertEqual(merged["event_id"], created["event_id"])
+
+    def test_alert_after_closed_event_takes_the_key_again(self):
+        closed = self.alert()
+        EmergencyEvent.objects.filter(pk=closed["event_id"]).update(is_active=False)
+
+        created = self.alert()
+        merged = self.alert()
+
+        self.assertFalse(created["merged"])
+        self.assertNotEqual(created["event_id"], closed["event_id"])
+        self.assertTrue(merged["merged"])
+        self.assertEqual(merged["event_id"], created["event_id"])
+        self.assertEqual(EmergencyEvent.objects.filter(is_active=True).count(), 1)
+
+    def test_alert_after_window_opens_new_event(self):
+        with mock.patch('api.tcp_server.CORRELATOR', AlertCorrelator(window=0.05)):
+            first = self.alert()
+            time.sleep(0.1)
+            second = self.alert()
+
+        self.assertFalse(second["merged"])
+        self.assertNotEqual(second["event_id"], first["event_id"])
+
+    def test_window_ends_for_entry_committed_after_purge(self):
+        correlator = AlertCorrelator(window=0.05)
+        key = correlator.key("Пожар", "г. Москва")
+        _, entry = correlator.claim(key)
+        time.sleep(0.1)
+        # Очистка срабатывает, пока первое событие по ключу ещё сохраняется
+        correlator.claim(correlator.key("Наводнение", "г. Москва"))
+        correlator.commit(entry, 1, 2)
+
+        is_new, _ = correlator.claim(key)
+        self.assertTrue(is_new)
+
+    def test_only_merged_duplicates_are_suppressed(self):
+        closed = self.alert()
+        EmergencyEvent.objects.filter(pk=closed["event_id"]).update(is_active=False)
+        suppressed = ALERTS_SUPPRESSED.get()
+
+        self.alert()
+        self.assertEqual(ALERTS_SUPPRESSED.get(), suppressed)
+        self.alert()
+        self.assertEqual(ALERTS_SUPPRESSED.get(), suppressed + 1)
+
+
+class HealthStub(BaseHTTPRequestHandler):
+    """HTTP-сервер узла: запоминает пути запросов и отвечает кодом code"""
+    code = 200
+    paths = []
+
+    def do_GET(self):
+        self.paths.append(self.path)
+        self.send_response(self.code)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class ProbeSchedulerTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        patcher = mock.patch('api.probes.group_send')
+        self.group_send = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def http_node(self, code):
+        handler = type('Handler', (HealthStub,), {'code': code, 'paths': []})
+        httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        self.addCleanup(httpd.server_close)
+        self.addCleanup(httpd.shutdown)
+        return httpd.server_address[1], handler.paths
+
+    def closed_port(self):
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def run_scheduler(self, until):
+        scheduler = ProbeScheduler(interval=0.05, timeout=1, max_backoff=0.2, jitter=0, reload_interval=0.05)
+        scheduler.start()
+        self.addCleanup(scheduler.stop)
+        ids = list(Server.objects.values_list('id', flat=True))
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            statuses = probe_statuses(ids)
+            if until(statuses):
+                break
+            time.sleep(0.02)
+        return statuses
+
+    def test_health_endpoint(self):
+        response = self.client.get(HEALTH_PATH)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"status": "ok"})
+
+    def test_statuses_and_backoff(self):
+        port, paths = self.http_node(200)
+        up = Server.objects.create(name="up", ip_address="127.0.0.1", port=port, is_active=False)
+        failing = Server.objects.create(name="5xx", ip_address="127.0.0.1", port=self.http_node(503)[0])
+        down = Server.objects.create(name="down", ip_address="127.0.0.1", port=self.closed_port())
+
+        statuses = self.run_scheduler(lambda statuses: len(statuses) == 3 and all(
+            statuses[server.id]["consecutive_failures"] >= 3 for server in (failing, down)
+        ))
+
+        self.assertTrue(statuses[up.id]["available"])
+        self.assertIsNotNone(statuses[up.id]["latency_ms"])
+        self.assertEqual(statuses[failing.id]["error"], "HTTP 503")
+        self.assertFalse(statuses[down.id]["available"])
+        # экспоненциальная задержка после неудач упирается в max_backoff
+        self.assertEqual(statuses[down.id]["next_check_in"], 0.2)
+        self.assertEqual(statuses[up.id]["next_check_in"], 0.05)
+        # проверка — HTTP-запрос состояния, а не сессия сервера приёма
+        self.assertEqual(set(paths), {HEALTH_PATH})
+
+        self.assertEqual(
+            dict(Server.objects.values_list('name', 'is_active')),
+            {"up": True, "5xx": False, "down": False},
+        )
+        changed = {call.args[1]["server"]["server_id"] for call in self.group_send.call_args_list}
+        self.assertEqual(changed, {up.id, failing.id, down.id})
+
+    def test_federation_uses_tcp_port(self):
+        Server.objects.create(name="web", ip_address="10.0.0.1", port=8000)
+        peer = Server.objects.create(name="peer", ip_address="10.0.0.2", port=8000, tcp_port=8888)
+        federation = Federation("node-a")
+        self.addCleanup(federation.executor.shutdown)
+        self.assertEqual(federation.load_servers(), [(peer.id, "10.0.0.2", 8888)])
+
+
+class SlidingWindowTests(TestCase):
+    def test_percentiles(self):
+        window = SlidingWindow(300, 10000, 30)
+        for ms in range(100, 0, -1):
+            window.add('db', ms / 1000, now=1000.0)
+        window.add('parse', 0.002, now=1000.0)
+
+        report = window.percentiles(now=1000.0)
+        self.assertEqual(report['db'], {'count': 100, 'p50_ms': 50.0, 'p95_ms': 95.0, 'p99_ms': 99.0})
+        self.assertEqual(report['parse'], {'count': 1, 'p50_ms': 2.0, 'p95_ms': 2.0, 'p99_ms': 2.0})
+
+    def test_window_expires_by_time(self):
+        window = SlidingWindow(300, 30, 30)
+        # 1000 медленных значений за один интервал: выборка прорежена до одного
+        for _ in range(1000):
+            window.add('db', 0.5, now=1000.0)
+        for second in range(1010, 1100, 10):
+            window.add('db', 0.001, now=second)
+
+        report = window.percentiles(now=1100.0)['db']
+        self.assertEqual(report['count'], 1009)
+        # вес прореженного интервала сохраняется: медленных значений 99%
+        self.assertEqual((report['p50_ms'], report['p99_ms']), (500.0, 500.0))
+
+        report = window.percentiles(now=1300.0)['db']
+        self.assertEqual(report['count'], 9)
+        self.assertEqual(report['p99_ms'], 1.0)
+        self.assertEqual(window.percentiles(now=1400.0), {})
 
-# Create your tests here.
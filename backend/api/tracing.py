@@ -0,0 +1,149 @@
+"""
+Сквозная трассировка задержки: от приёма сокетом до отправки в WebSocket.
+
+Каждое сообщение получает trace — словарь с идентификатором и монотонным
+временем приёма, который передаётся через сохранение в БД и group_send.
+Длительности этапов копятся в скользящем окне для расчёта p50/p95/p99.
+"""
+
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+
+from django.conf import settings
+
+from .metrics import REGISTRY
+
+STAGES = ('parse', 'db', 'channel_layer', 'consumer_send', 'end_to_end', 'replication')
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'pipeline_stage_seconds', 'Длительность этапов конвейера доставки', ('stage',)
+)
+
+
+def new_trace():
+    """Создать trace в момент приёма сообщения сокетом"""
+    return {
+        'id': uuid.uuid4().hex,
+        'pid': os.getpid(),
+        'recv_ns': time.monotonic_ns(),
+        'recv_wall': time.time(),
+    }
+
+
+def stamp(trace, key):
+    """Отметить момент времени в trace (монотонно и по настенным часам)"""
+    trace[f'{key}_ns'] = time.monotonic_ns()
+    trace[f'{key}_wall'] = time.time()
+
+
+def elapsed(trace, key):
+    """
+    Секунды с отметки key до текущего момента.
+
+    Монотонные часы сравнимы только внутри одного процесса, поэтому для
+    сообщений из другого процесса используется настенное время.
+    """
+    if trace.get('pid') == os.getpid() and f'{key}_ns' in trace:
+        return (time.monotonic_ns() - trace[f'{key}_ns']) / 1e9
+    return max(time.time() - trace[f'{key}_wall'], 0.0)
+
+
+def record(stage, seconds):
+    """Учесть длительность этапа в окне и в гистограмме Prometheus"""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    LATENCY_WINDOW.add(stage, seconds)
+
+
+class SlidingWindow:
+    """
+    Выборки длительностей по этапам за последние window секунд.
+
+    Окно разбито на slots интервалов. Интервалы старше окна отбрасываются
+    целиком, поэтому окно покрывает window секунд при любой частоте
+    сообщений. Память ограничена: интервал хранит не больше
+    max_samples / slots равномерно выбранных значений и число всех
+    значений, по которому выборка взвешивается при расчёте перцентилей.
+    """
+
+    def __init__(self, window, max_samples, slots):
+        self.window = window
+        self.slots = slots
+        self.slot_seconds = window / slots
+        self.slot_samples = max(max_samples // slots, 1)
+        self._slots = {}  # stage -> deque([номер интервала, число значений, выборка])
+        self._lock = threading.Lock()
+
+    def _expire(self, slots, now):
+        oldest = self._slot(now) - self.slots
+        while slots and slots[0][0] <= oldest:
+            slots.popleft()
+
+    def _slot(self, moment):
+        return int(moment // self.slot_seconds)
+
+    def add(self, stage, seconds, now=None):
+        now = time.monotonic() if now is None else now
+        number = self._slot(now)
+        with self._lock:
+            slots = self._slots.get(stage)
+            if slots is None:
+                slots = self._slots[stage] = deque()
+            if not slots or slots[-1][0] != number:
+                self._expire(slots, now)
+                slots.append([number, 0, []])
+            slot = slots[-1]
+            slot[1] += 1
+            sample = slot[2]
+            if len(sample) < self.slot_samples:
+                sample.append(seconds)
+            else:
+                # Равномерная выборка (reservoir sampling) из всех значений интервала
+                position = random.randrange(slot[1])
+                if position < self.slot_samples:
+                    sample[position] = seconds
+
+    def percentiles(self, now=None):
+        """p50/p95/p99 в миллисекундах по каждому этапу"""
+        # NumPy нужен только для отчёта, процесс приёма его не загружает
+        import numpy as np
+
+        now = time.monotonic() if now is None else now
+        report = {}
+        with self._lock:
+            snapshot = {}
+            for stage, slots in self._slots.items():
+                self._expire(slots, now)
+                snapshot[stage] = [(count, list(sample)) for _, count, sample in slots]
+
+        for stage, slots in snapshot.items():
+            if not slots:
+                continue
+            values = np.concatenate([np.asarray(sample, dtype=np.float64) for _, sample in slots])
+            # Значение интервала представляет count / len(sample) исходных значений
+            weights = np.concatenate([np.full(len(sample), count / len(sample)) for count, sample in slots])
+            order = np.argsort(values, kind='stable')
+            values = values[order]
+            cumulative = np.cumsum(weights[order])
+            total = cumulative[-1]
+            # Ранговый перцентиль: первое значение, на котором набирается доля q
+            # (допуск — на погрешность суммы дробных весов)
+            ranks = np.searchsorted(cumulative, np.array((0.5, 0.95, 0.99)) * total * (1 - 1e-9))
+            p50, p95, p99 = values[np.minimum(ranks, values.size - 1)] * 1000
+            report[stage] = {
+                'count': sum(count for count, _ in slots),
+                'p50_ms': round(float(p50), 3),
+                'p95_ms': round(float(p95), 3),
+                'p99_ms': round(float(p99), 3),
+            }
+        return report
+
+
+LATENCY_WINDOW = SlidingWindow(
+    settings.LATENCY_WINDOW_SECONDS,
+    settings.LATENCY_WINDOW_MAX_SAMPLES,
+    settings.LATENCY_WINDOW_SLOTS
+)
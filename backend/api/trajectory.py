@@ -0,0 +1,158 @@
+"""
+Построение траектории дрона: упрощение пути (Дуглас — Пекер) и статистика
+по колоночным массивам NumPy.
+"""
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def load_track_arrays(queryset, limit=None):
+    """
+    Загрузить телеметрию в виде колонок (timestamp, lat, lon, alt, speed).
+
+    При limit загружаются только последние limit точек; вторым значением
+    возвращается признак того, что трек обрезан.
+    """
+    columns = ('timestamp', 'latitude', 'longitude', 'altitude', 'speed')
+    if limit is None:
+        rows = list(queryset.order_by('timestamp').values_list(*columns))
+        truncated = False
+    else:
+        rows = list(queryset.order_by('-timestamp').values_list(*columns)[:limit + 1])
+        truncated = len(rows) > limit
+        rows = rows[:limit]
+        rows.reverse()
+
+    if not rows:
+        empty = np.empty(0, dtype=np.float64)
+        return ([], empty, empty, empty, empty), truncated
+
+    timestamps, lat, lon, alt, speed = zip(*rows)
+    return (
+        list(timestamps),
+        np.asarray(lat, dtype=np.float64),
+        np.asarray(lon, dtype=np.float64),
+        np.asarray(alt, dtype=np.float64),
+        np.asarray(speed, dtype=np.float64),
+    ), truncated
+
+
+def project_to_plane(lat, lon):
+    """Равнопромежуточная проекция в метры относительно центра трека"""
+    lat0 = np.radians(lat.mean())
+    x = np.radians(lon - lon.mean()) * np.cos(lat0) * EARTH_RADIUS_M
+    y = np.radians(lat - lat.mean()) * EARTH_RADIUS_M
+    return x, y
+
+
+def haversine_steps(lat, lon):
+    """Расстояния в метрах между соседними точками"""
+    phi = np.radians(lat)
+    dphi = np.diff(phi)
+    dlmb = np.radians(np.diff(lon))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi[:-1]) * np.cos(phi[1:]) * np.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def douglas_peucker(x, y, tolerance):
+    """
+    Маска точек, оставшихся после упрощения Дугласа — Пекера.
+
+    Рекурсия заменена стеком отрезков, а расстояния до отрезка для всех
+    внутренних точек считаются одной векторной операцией.
+    """
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    if n < 3 or tolerance <= 0:
+        keep[:] = True
+        return keep
+
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        px = x[start + 1:end] - x[start]
+        py = y[start + 1:end] - y[start]
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        seg_len2 = dx * dx + dy * dy
+
+        if seg_len2 == 0.0:
+            dist2 = px * px + py * py
+        else:
+            t = np.clip((px * dx + py * dy) / seg_len2, 0.0, 1.0)
+            ex = px - t * dx
+            ey = py - t * dy
+            dist2 = ex * ex + ey * ey
+
+        idx = int(np.argmax(dist2))
+        if dist2[idx] > tolerance * tolerance:
+            split = start + 1 + idx
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return keep
+
+
+def build_track(queryset, tolerance, limit=None):
+    """Упрощённый трек и статистика по нему за один проход по данным"""
+    (timestamps, lat, lon, alt, speed), truncated = load_track_arrays(queryset, limit)
+
+    # NaN и inf в сохранённых строках испортили бы всю статистику и JSON ответа
+    finite = np.isfinite(lat) & np.isfinite(lon) & np.isfinite(alt) & np.isfinite(speed)
+    skipped = int(finite.size - np.count_nonzero(finite))
+    if skipped:
+        timestamps = [moment for moment, ok in zip(timestamps, finite) if ok]
+        lat, lon, alt, speed = lat[finite], lon[finite], alt[finite], speed[finite]
+    total = len(timestamps)
+
+    if total == 0:
+        return {
+            'points_total': 0,
+            'points_skipped': skipped,
+            'truncated': truncated,
+            'points': 0,
+            'polyline': [],
+            'altitudes': [],
+            'timestamps': [],
+            'stats': {
+                'distance_m': 0.0,
+                'duration_s': 0.0,
+                'avg_speed_kmh': 0.0,
+                'avg_reported_speed': 0.0,
+                'max_reported_speed': 0.0,
+            },
+        }
+
+    x, y = project_to_plane(lat, lon)
+    keep = douglas_peucker(x, y, tolerance)
+    kept = np.flatnonzero(keep)
+
+    distance = float(haversine_steps(lat, lon).sum()) if total > 1 else 0.0
+    duration = (timestamps[-1] - timestamps[0]).total_seconds()
+    avg_speed = distance / duration * 3.6 if duration > 0 else 0.0
+
+    return {
+        'points_total': total,
+        'points_skipped': skipped,
+        'truncated': truncated,
+        'points': int(kept.size),
+        'polyline': np.round(np.column_stack((lat[kept], lon[kept])), 6).tolist(),
+        'altitudes': np.round(alt[kept], 1).tolist(),
+        'timestamps': [timestamps[i].isoformat() for i in kept],
+        'stats': {
+            'distance_m': round(distance, 1),
+            'duration_s': duration,
+            'avg_speed_kmh': round(avg_speed, 2),
+            'avg_reported_speed': round(float(speed.mean()), 2),
+            'max_reported_speed': round(float(speed.max()), 2),
+        },
+    }
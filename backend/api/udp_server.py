@@ -1,87 +1,189 @@
+import math
 import socket
 import json
 import threading
-import asyncio
-import django
-import os
-import time
-from datetime import datetime
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-
-# Настраиваем Django для работы в отдельном потоке
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emergency_notification.settings')
-django.setup()
 
 from django.conf import settings
-from api.models import DroneData
-from api.serializers import DroneDataSerializer
+from django.utils import timezone
+from api.broadcast import event_group, group_send_telemetry
+from api.metrics import UDP_PACKETS, UDP_PROCESS_SECONDS
+from api.spool import SpoolWriter, SpoolReplayer, encode_row
+from api.liveness import LivenessTracker
+from api.telemetry import TelemetryFrames
+from api.geofence import GEOFENCES
+from api.tracing import new_trace, elapsed, record, stamp
+from api.log import get_logger, setup_ingest_logging
+
+log = get_logger('udp')
+packet_log = get_logger('udp.packet')
+
+MAX_TEXT_LENGTH = 50
+
+def _number(drone_data, key):
+    value = drone_data.get(key)
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"поле '{key}' должно быть числом")
+    # json.loads пропускает NaN, Infinity и целые вне диапазона float,
+    # но в телеметрии им не место
+    try:
+        number = float(value)
+    except OverflowError:
+        number = math.inf
+    if not math.isfinite(number):
+        raise ValueError(f"поле '{key}' должно быть конечным числом")
+    return number
+
+def _text(drone_data, key):
+    value = drone_data.get(key)
+    if not isinstance(value, str) or not value or len(value) > MAX_TEXT_LENGTH:
+        raise ValueError(f"поле '{key}' должно быть непустой строкой до {MAX_TEXT_LENGTH} символов")
+    return value
+
+def parse_drone_packet(drone_data):
+    """
+    Проверить пакет дрона и превратить его в строку DroneData.
+
+    Проверка не обращается к БД: существование события проверяется
+    при записи пачки.
+    """
+    if not isinstance(drone_data, dict):
+        raise ValueError("пакет должен быть JSON-объектом")
+    event_id = drone_data.get("event_id")
+    if event_id is not None and (isinstance(event_id, bool) or not isinstance(event_id, int)):
+        raise ValueError("поле 'event_id' должно быть целым числом")
+    return {
+        "drone_id": _text(drone_data, "id"),
+        "latitude": _number(drone_data, "lat"),
+        "longitude": _number(drone_data, "lon"),
+        "altitude": _number(drone_data, "alt"),
+        "speed": _number(drone_data, "speed"),
+        "battery_level": _number(drone_data, "battery"),
+        "status": _text(drone_data, "status"),
+        "timestamp": timezone.now(),
+        "related_event_id": event_id,
+    }
+
+def drone_data_payload(row):
+    """Данные дрона в виде, совпадающем с DroneDataSerializer"""
+    return {
+        "drone_id": row["drone_id"],
+        "latitude": row["latitude"],
+        "longitude": row["longitude"],
+        "altitude": row["altitude"],
+        "speed": row["speed"],
+        "battery_level": row["battery_level"],
+        "status": row["status"],
+        "timestamp": row["timestamp"].isoformat(),
+        "related_event": row["related_event_id"],
+        "trace_id": row["trace_id"],
+    }
 
 class UDPServer:
     def __init__(self, host=None, port=None):
-        self.host = host or settings.UDP_SERVER_HOST
-        self.port = port or settings.UDP_SERVER_PORT
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.socket.bind((self.host, self.port))
+        self.host = host if host is not None else settings.UDP_SERVER_HOST
+        self.port = port if port is not None else settings.UDP_SERVER_PORT
+        self.socket = None
         self.running = False
-        self.channel_layer = get_channel_layer()
+        self.spool = SpoolWriter()
+        self.replayer = SpoolReplayer(on_flush=self.on_flush)
+        self.liveness = LivenessTracker()
+        self.telemetry = TelemetryFrames()
         
+    def bind(self):
+        """Открыть и привязать сокет (не при создании объекта, а перед запуском)"""
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((self.host, self.port))
+        # При port=0 система выбирает свободный порт
+        self.port = self.socket.getsockname()[1]
+
     def start(self):
+        if self.socket is None:
+            self.bind()
         self.running = True
-        print(f"UDP сервер запущен на {self.host}:{self.port}")
+        self.replayer.start()
+        self.liveness.start()
+        self.telemetry.start()
+        GEOFENCES.start()
+        log.info("UDP сервер запущен", extra={"fields": {"host": self.host, "port": self.port}})
         
         while self.running:
             try:
                 data, addr = self.socket.recvfrom(1024)
-                self.process_data(data, addr)
+                trace = new_trace()
+                UDP_PACKETS.labels('received').inc()
+                with UDP_PROCESS_SECONDS.time():
+                    self.process_data(data, addr, trace)
             except Exception as e:
-                print(f"Ошибка UDP сервера: {e}")
+                log.error("Ошибка UDP сервера", extra={"fields": {"error": str(e)}})
     
-    def process_data(self, data, addr):
+    def process_data(self, data, addr, trace=None):
+        trace = trace or new_trace()
         try:
             drone_data = json.loads(data.decode('utf-8'))
+            row = parse_drone_packet(drone_data)
+            row["trace_id"] = trace["id"]
+            if row["related_event_id"] is None:
+                # Дрон без event_id привязывается к событию, над которым летит
+                row["related_event_id"] = GEOFENCES.match(row["latitude"], row["longitude"])
+            UDP_PACKETS.labels('parsed').inc()
+            record('parse', elapsed(trace, 'recv'))
+            stamp(trace, 'parsed')
+            self.liveness.observe(row)
+            self.telemetry.observe(row)
             
-            # Сохраняем данные в БД
-            serializer = DroneDataSerializer(data={
-                "drone_id": drone_data.get("id"),
-                "latitude": drone_data.get("lat"),
-                "longitude": drone_data.get("lon"),
-                "altitude": drone_data.get("alt"),
-                "speed": drone_data.get("speed"),
-                "battery_level": drone_data.get("battery"),
-                "status": drone_data.get("status"),
-                "related_event": drone_data.get("event_id")
-            })
-            
-            if serializer.is_valid():
-                serializer.save()
+            # Пакет пишется в спул, в БД его загружает фоновый поток пачками
+            if not self.spool.append(encode_row(row, trace)):
+                UDP_PACKETS.labels('dropped').inc()
+                packet_log.warning("Спул переполнен, пакет отброшен", extra={"fields": {"drone_id": row["drone_id"]}})
+                return
                 
-                # Отправляем данные через WebSocket если связаны с событием
-                if drone_data.get("event_id"):
-                    async_to_sync(self.channel_layer.group_send)(
-                        "emergency_broadcasts",
-                        {
-                            "type": "drone_data",
-                            "data": serializer.data
-                        }
-                    )
-                    
-                print(f"Получены данные от дрона {drone_data.get('id')}")
-            else:
-                print(f"Ошибка валидации данных дрона: {serializer.errors}")
+            packet_log.info("Получены данные от дрона", extra={"fields": {"drone_id": row["drone_id"], "trace_id": trace["id"]}})
                 
-        except json.JSONDecodeError:
-            print("Ошибка декодирования JSON")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            UDP_PACKETS.labels('rejected').inc()
+            packet_log.info("Ошибка декодирования JSON", extra={"fields": {"addr": addr[0]}})
+        except ValueError as e:
+            UDP_PACKETS.labels('rejected').inc()
+            packet_log.info("Ошибка валидации данных дрона", extra={"fields": {"addr": addr[0], "error": str(e)}})
         except Exception as e:
-            print(f"Ошибка обработки данных: {e}")
+            UDP_PACKETS.labels('failed').inc()
+            log.exception("Ошибка обработки данных", extra={"fields": {"addr": addr[0]}})
+
+    def on_flush(self, batch):
+        """Вызывается потоком воспроизведения спула после сохранения пачки"""
+        UDP_PACKETS.labels('persisted').inc(len(batch))
+        for row, trace in batch:
+            if trace is not None:
+                record('db', elapsed(trace, 'parsed'))
+            
+            # Отправляем данные подписчикам события, с которым они связаны;
+            # ещё не отправленный пакет дрона заменяется более новым
+            if row["related_event_id"]:
+                group_send_telemetry(
+                    event_group(row["related_event_id"]),
+                    row["drone_id"],
+                    {
+                        "type": "drone_data",
+                        "data": drone_data_payload(row)
+                    },
+                    trace=trace
+                )
     
     def stop(self):
         self.running = False
-        self.socket.close()
-        print("UDP сервер остановлен")
+        if self.socket is not None:
+            self.socket.close()
+        self.replayer.stop()
+        self.liveness.stop()
+        self.telemetry.stop()
+        GEOFENCES.stop()
+        self.spool.close()
+        log.info("UDP сервер остановлен")
 
-def start_udp_server():
-    server = UDPServer()
+def start_udp_server(host=None, port=None):
+    setup_ingest_logging()
+    server = UDPServer(host, port)
+    server.bind()
     server_thread = threading.Thread(target=server.start)
     server_thread.daemon = True
     server_thread.start()
@@ -11,4 +11,7 @@ router.register(r'drone-data', views.DroneDataViewSet)
 urlpatterns = [
     path('', include(router.urls)),
     path('statistics/', views.get_event_statistics, name='statistics'),
+    path('latency/', views.get_latency, name='latency'),
+    path('metrics/', views.metrics, name='metrics'),
+    path('health/', views.health, name='health'),
 ] 
\ No newline at end of file
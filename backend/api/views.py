@@ -1,10 +1,18 @@
 from django.shortcuts import render
-from rest_framework import viewsets
+from django.http import HttpResponse, JsonResponse
+from django.conf import settings
+from django.utils.dateparse import parse_datetime
+from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, action
 from .models import Server, EventType, EmergencyEvent, DroneData
 from .serializers import ServerSerializer, EventTypeSerializer, EmergencyEventSerializer, DroneDataSerializer
+from .trajectory import build_track
+from .metrics import REGISTRY
+from .tracing import LATENCY_WINDOW
+from .probes import probe_statuses
 import json
+import math
 
 # Create your views here.
 
@@ -12,6 +20,12 @@ class ServerViewSet(viewsets.ModelViewSet):
     queryset = Server.objects.all()
     serializer_class = ServerSerializer
 
+    @action(detail=False, methods=['get'], url_path='status')
+    def statuses(self, request):
+        """Результаты проверки доступности всех серверов"""
+        server_ids = list(Server.objects.values_list('id', flat=True))
+        return Response(probe_statuses(server_ids))
+
 class EventTypeViewSet(viewsets.ModelViewSet):
     queryset = EventType.objects.all()
     serializer_class = EventTypeSerializer
@@ -41,6 +55,43 @@ class DroneDataViewSet(viewsets.ModelViewSet):
                 latest_data[drone_id] = DroneDataSerializer(latest).data
         return Response(latest_data)
 
+    @action(detail=False, methods=['get'], url_path=r'(?P<drone_id>[^/]+)/track')
+    def track(self, request, drone_id=None):
+        """Получить упрощённую траекторию дрона за период"""
+        queryset = DroneData.objects.filter(drone_id=drone_id)
+
+        for param, lookup in (('from', 'timestamp__gte'), ('to', 'timestamp__lte')):
+            value = request.query_params.get(param)
+            if not value:
+                continue
+            moment = parse_datetime(value)
+            if moment is None:
+                return Response(
+                    {"error": f"Некорректная дата в параметре '{param}'"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            queryset = queryset.filter(**{lookup: moment})
+
+        try:
+            tolerance = float(request.query_params.get('tolerance', settings.TRACK_DEFAULT_TOLERANCE))
+        except ValueError:
+            tolerance = -1
+        # inf и nan не сериализуются в JSON ответа
+        if not (math.isfinite(tolerance) and tolerance >= 0):
+            return Response(
+                {"error": "Параметр 'tolerance' должен быть конечным неотрицательным числом (метры)"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        track = build_track(queryset, tolerance, settings.TRACK_MAX_POINTS)
+        track.update({
+            "drone_id": drone_id,
+            "from": request.query_params.get('from'),
+            "to": request.query_params.get('to'),
+            "tolerance": tolerance,
+        })
+        return Response(track)
+
 @api_view(['GET'])
 def get_event_statistics(request):
     """Получить статистику по активным ЧС"""
@@ -58,3 +109,22 @@ def get_event_statistics(request):
         "active": active_events,
         "by_severity": severity_stats
     })
+
+@api_view(['GET'])
+def get_latency(request):
+    """Получить перцентили задержки по этапам доставки за скользящее окно"""
+    return Response({
+        "window_seconds": LATENCY_WINDOW.window,
+        "stages": LATENCY_WINDOW.percentiles()
+    })
+
+def health(request):
+    """Лёгкая проверка доступности узла (без обращения к БД)"""
+    return JsonResponse({"status": "ok"})
+
+def metrics(request):
+    """Метрики конвейера приёма и рассылки в формате Prometheus"""
+    return HttpResponse(
+        REGISTRY.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
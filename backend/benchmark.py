@@ -0,0 +1,969 @@
+"""
+Нагрузочное тестирование системы оповещений на основе simulate_client.py.
+
+Сценарий load запускает против уже работающего локального сервера:
+    - рой дронов (несколько процессов), отправляющих телеметрию по UDP с заданной частотой;
+    - клиентов МЧС, параллельно отправляющих поток оповещений по TCP;
+    - N подписчиков WebSocket, измеряющих задержку доставки оповещений.
+
+По итогам печатается отчёт (пропускная способность, потери, перцентили задержки,
+CPU/RSS процесса сервера) и, при необходимости, сохраняется в JSON.
+
+Сценарий db измеряет запись телеметрии в настроенную БД напрямую (построчно
+и пачками) из нескольких потоков; бэкенд выбирается переменной DB_ENGINE.
+
+Сценарий federation запускает несколько узлов ingest.py на localhost (у каждого
+своя БД SQLite с реестром остальных узлов), отправляет оповещения на разные узлы
+и измеряет задержку репликации, потери и дубликаты; с --bounce один узел
+перезапускается посреди прогона.
+
+Сценарий priority запускает сервер (daphne с серверами приёма в одном процессе)
+и измеряет задержку доставки оповещений подписчикам WebSocket сначала без
+телеметрии, затем при насыщающем рое дронов над событием, на телеметрию
+которого подписаны те же подписчики.
+
+Сценарий startup измеряет время старта процесса приёма ingest.py с лёгкими
+и с полными настройками Django.
+
+Использование:
+    python benchmark.py load --drones 200 --hz 5 --agencies 4 --subscribers 10 --duration 30
+    python benchmark.py load --server-pid 12345 --json report.json --max-alert-p99-ms 250
+    python benchmark.py db --rows 20000 --threads 4
+    DB_ENGINE=postgresql python benchmark.py db --rows 20000 --threads 4
+    python benchmark.py federation --nodes 3 --duration 10 --bounce 2 --max-loss 0
+    python benchmark.py priority --drones 2000 --hz 10 --max-alert-p99-ms 250 --max-loss 0
+    python benchmark.py startup --runs 10 --max-startup-ms 500
+    python simulate_client.py bench load ...
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import uuid
+
+from simulate_client import (
+    DEFAULT_TCP_HOST, DEFAULT_TCP_PORT, DEFAULT_UDP_HOST, DEFAULT_UDP_PORT,
+    BASE_LAT, BASE_LON, make_emergency_alert, make_drone_packet
+)
+
+DEFAULT_HTTP_URL = 'http://127.0.0.1:8000'
+DEFAULT_WS_URL = 'ws://127.0.0.1:8000/ws/emergency/'
+
+# Префикс описания оповещения, по которому подписчики узнают сообщения прогона
+BENCH_MARKER = 'bench'
+
+
+def percentile(values, q):
+    """Перцентиль по методу ближайшего ранга"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(math.ceil(q / 100 * len(ordered)) - 1, 0)
+    return ordered[rank]
+
+
+def summarize_latency(values):
+    """Сводка задержек в миллисекундах"""
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 50) * 1000, 3),
+        "p95_ms": round(percentile(values, 95) * 1000, 3),
+        "p99_ms": round(percentile(values, 99) * 1000, 3),
+        "max_ms": round(max(values) * 1000, 3),
+    }
+
+
+def drone_swarm_worker(worker_id, drone_ids, hz, duration, host, port, results, event_id=None):
+    """Процесс роя: каждый дрон отправляет пакет hz раз в секунду"""
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    positions = {
+        drone_id: [BASE_LAT + random.uniform(-0.05, 0.05), BASE_LON + random.uniform(-0.05, 0.05)]
+        for drone_id in drone_ids
+    }
+    interval = 1.0 / hz
+    sent = errors = 0
+    deadline = time.monotonic() + duration
+    next_tick = time.monotonic()
+
+    while time.monotonic() < deadline:
+        for drone_id, position in positions.items():
+            position[0] += random.uniform(-0.0002, 0.0002)
+            position[1] += random.uniform(-0.0002, 0.0002)
+            packet = make_drone_packet(drone_id, position[0], position[1], event_id)
+            try:
+                client.sendto(json.dumps(packet).encode('utf-8'), (host, port))
+                sent += 1
+            except OSError:
+                errors += 1
+        next_tick += interval
+        time.sleep(max(next_tick - time.monotonic(), 0))
+
+    client.close()
+    results.put(('drones', worker_id, {"sent": sent, "errors": errors}))
+
+
+def agency_worker(worker_id, rate, duration, host, port, run_id, results):
+    """Процесс клиента МЧС: поток оповещений с ожиданием подтверждения каждого"""
+    stats = {"sent": 0, "acked": 0, "errors": 0, "ack_latencies": []}
+    interval = 1.0 / rate if rate > 0 else 0
+    deadline = time.monotonic() + duration
+
+    try:
+        client = socket.create_connection((host, port), timeout=10)
+        client.recv(4096)  # ID сессии
+    except OSError:
+        stats["errors"] += 1
+        results.put(('agencies', worker_id, stats))
+        return
+
+    seq = 0
+    next_tick = time.monotonic()
+    while time.monotonic() < deadline:
+        seq += 1
+        sent_at = time.time()
+        alert = make_emergency_alert(
+            title=f"Нагрузочный тест {run_id}",
+            description=f"{BENCH_MARKER}:{run_id}:{worker_id}:{seq}:{sent_at:.6f}",
+            location=f"Бенчмарк {run_id}-{worker_id}-{seq}"
+        )
+        start = time.perf_counter()
+        try:
+            client.send(json.dumps(alert).encode('utf-8'))
+            stats["sent"] += 1
+            response = json.loads(client.recv(4096).decode('utf-8'))
+            if response.get("status") == "success":
+                stats["acked"] += 1
+                stats["ack_latencies"].append(time.perf_counter() - start)
+            else:
+                stats["errors"] += 1
+        except (OSError, ValueError):
+            stats["errors"] += 1
+            break
+        if interval:
+            next_tick += interval
+            time.sleep(max(next_tick - time.monotonic(), 0))
+
+    client.close()
+    results.put(('agencies', worker_id, stats))
+
+
+async def websocket_subscriber(url, run_id, connected, stop, stats, event_id=None):
+    """
+    Подписчик WebSocket: считает доставленные оповещения прогона и их задержку.
+
+    С event_id подписывается на телеметрию дронов над событием и считает её.
+    """
+    import websockets
+
+    prefix = f"{BENCH_MARKER}:{run_id}:"
+    try:
+        async with websockets.connect(url, max_size=None) as ws:
+            if event_id is not None:
+                await ws.send(json.dumps({"action": "subscribe", "event_id": event_id}))
+            connected.set()
+            while not stop.is_set():
+                try:
+                    raw = await asyncio.wait_for(ws.recv(), timeout=0.5)
+                except asyncio.TimeoutError:
+                    continue
+                received_at = time.time()
+                if isinstance(raw, bytes):
+                    continue
+                message = json.loads(raw)
+                if message.get("type") == "drone_data":
+                    stats["telemetry"] = stats.get("telemetry", 0) + 1
+                    continue
+                if message.get("type") != "emergency_event":
+                    continue
+                description = message.get("event", {}).get("description", "")
+                if not description.startswith(prefix):
+                    continue
+                stats["received"] += 1
+                stats["latencies"].append(received_at - float(description.rsplit(':', 1)[1]))
+    except Exception as e:
+        stats["error"] = str(e)
+        connected.set()
+
+
+class ProcessSampler(threading.Thread):
+    """Периодический замер CPU и RSS процесса сервера через /proc (Linux)"""
+
+    def __init__(self, pid, interval=0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+
+    def read(self):
+        with open(f'/proc/{self.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        rss = 0
+        with open(f'/proc/{self.pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    rss = int(line.split()[1]) * 1024
+        return time.monotonic(), cpu, rss
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.samples.append(self.read())
+            except OSError:
+                return
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        try:
+            self.samples.append(self.read())
+        except OSError:
+            pass
+
+    def report(self):
+        if len(self.samples) < 2:
+            return None
+        (t0, cpu0, _), (t1, cpu1, rss_end) = self.samples[0], self.samples[-1]
+        return {
+            "cpu_percent": round((cpu1 - cpu0) / (t1 - t0) * 100, 1) if t1 > t0 else None,
+            "rss_peak_mb": round(max(s[2] for s in self.samples) / 2 ** 20, 1),
+            "rss_end_mb": round(rss_end / 2 ** 20, 1),
+        }
+
+
+def scrape_metrics(http_url):
+    """Прочитать /api/metrics/ сервера; пустой словарь, если он недоступен"""
+    try:
+        with urllib.request.urlopen(f"{http_url.rstrip('/')}/api/metrics/", timeout=5) as response:
+            text = response.read().decode('utf-8')
+    except OSError:
+        return {}
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, _, value = line.rpartition(' ')
+            values[name] = float(value.replace('+Inf', 'inf'))
+    return values
+
+
+def metric_delta(before, after, name):
+    if name not in after:
+        return None
+    return after[name] - before.get(name, 0.0)
+
+
+def metric_mean_ms(before, after, name, labels):
+    """Среднее гистограммы за фазу в миллисекундах"""
+    count = metric_delta(before, after, f'{name}_count{labels}')
+    total = metric_delta(before, after, f'{name}_sum{labels}')
+    if not count or total is None:
+        return None
+    return round(total / count * 1000, 3)
+
+
+def collect(results, expected, timeout=30):
+    collected = {"drones": [], "agencies": []}
+    for _ in range(expected):
+        try:
+            kind, _, stats = results.get(timeout=timeout)
+        except queue.Empty:
+            print("Не все процессы нагрузки вернули результаты")
+            break
+        collected[kind].append(stats)
+    return collected
+
+
+async def run_load_async(args, run_id, results):
+    processes = []
+    stop = asyncio.Event()
+    subscribers = []
+
+    if args.subscribers:
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            print("Для подписчиков WebSocket нужен пакет websockets (pip install websockets)")
+            return None, processes
+        for _ in range(args.subscribers):
+            stats = {"received": 0, "latencies": []}
+            connected = asyncio.Event()
+            task = asyncio.create_task(websocket_subscriber(
+                args.ws_url, run_id, connected, stop, stats, getattr(args, 'event_id', None)
+            ))
+            subscribers.append((task, connected, stats))
+        await asyncio.wait_for(asyncio.gather(*(c.wait() for _, c, _ in subscribers)), timeout=10)
+
+    drone_ids = [f"bench-{run_id}-{i}" for i in range(args.drones)]
+    procs = max(1, min(args.drone_procs, args.drones)) if args.drones else 0
+    for worker_id in range(procs):
+        processes.append(multiprocessing.Process(
+            target=drone_swarm_worker,
+            args=(worker_id, drone_ids[worker_id::procs], args.hz, args.duration,
+                  args.udp_host, args.udp_port, results, getattr(args, 'event_id', None))
+        ))
+    for worker_id in range(args.agencies):
+        processes.append(multiprocessing.Process(
+            target=agency_worker,
+            args=(worker_id, args.alert_rate, args.duration,
+                  args.tcp_host, args.tcp_port, run_id, results)
+        ))
+    for process in processes:
+        process.start()
+
+    await asyncio.sleep(args.duration + args.grace)
+    stop.set()
+    if subscribers:
+        await asyncio.gather(*(task for task, _, _ in subscribers))
+    return [stats for _, _, stats in subscribers], processes
+
+
+def run_load(args):
+    run_id = uuid.uuid4().hex[:8]
+    results = multiprocessing.Queue()
+    metrics_before = scrape_metrics(args.http_url)
+
+    sampler = None
+    if args.server_pid:
+        sampler = ProcessSampler(args.server_pid)
+        sampler.start()
+
+    started = time.monotonic()
+    subscriber_stats, processes = asyncio.run(run_load_async(args, run_id, results))
+    if subscriber_stats is None:
+        return 2
+    collected = collect(results, len(processes))
+    for process in processes:
+        process.join()
+    elapsed = time.monotonic() - started
+
+    if sampler:
+        sampler.stop()
+    metrics_after = scrape_metrics(args.http_url)
+
+    telemetry_sent = sum(s["sent"] for s in collected["drones"])
+    persisted = metric_delta(metrics_before, metrics_after, 'udp_packets_total{stage="persisted"}')
+    alerts_sent = sum(s["sent"] for s in collected["agencies"])
+    alerts_acked = sum(s["acked"] for s in collected["agencies"])
+    ack_latencies = [v for s in collected["agencies"] for v in s["ack_latencies"]]
+    delivery_latencies = [v for s in subscriber_stats for v in s["latencies"]]
+    expected_deliveries = alerts_acked * len(subscriber_stats)
+    delivered = sum(s["received"] for s in subscriber_stats)
+
+    report = {
+        "run_id": run_id,
+        "duration_s": round(elapsed, 2),
+        "telemetry": {
+            "drones": args.drones,
+            "hz": args.hz,
+            "sent": telemetry_sent,
+            "send_errors": sum(s["errors"] for s in collected["drones"]),
+            "sent_per_s": round(telemetry_sent / args.duration, 1),
+            "persisted": persisted,
+            "loss": round(1 - persisted / telemetry_sent, 4) if persisted is not None and telemetry_sent else None,
+        },
+        "alerts": {
+            "agencies": args.agencies,
+            "sent": alerts_sent,
+            "acked": alerts_acked,
+            "errors": sum(s["errors"] for s in collected["agencies"]),
+            "acked_per_s": round(alerts_acked / args.duration, 1),
+            "ack_latency": summarize_latency(ack_latencies),
+        },
+        "delivery": {
+            "subscribers": len(subscriber_stats),
+            "subscriber_errors": [s["error"] for s in subscriber_stats if "error" in s],
+            "expected": expected_deliveries,
+            "delivered": delivered,
+            "loss": round(1 - delivered / expected_deliveries, 4) if expected_deliveries else None,
+            "latency": summarize_latency(delivery_latencies),
+        },
+        "server": sampler.report() if sampler else None,
+    }
+    return finish(report, args, [
+        ("alerts.ack_latency.p99_ms", args.max_ack_p99_ms),
+        ("delivery.latency.p99_ms", args.max_alert_p99_ms),
+        ("telemetry.loss", args.max_loss),
+        ("delivery.loss", args.max_loss),
+    ])
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'emergency_notification.settings')
+    import django
+    django.setup()
+
+
+def db_insert_worker(rows, batch_size, stats):
+    """Поток записи: построчно (batch_size=1) или пачками через bulk_insert_drone_data"""
+    from django.db import connection, OperationalError
+    from api.models import DroneData
+    from api.storage import bulk_insert_drone_data
+
+    try:
+        for offset in range(0, len(rows), batch_size):
+            chunk = rows[offset:offset + batch_size]
+            try:
+                if batch_size == 1:
+                    DroneData.objects.create(**chunk[0])
+                else:
+                    bulk_insert_drone_data(chunk)
+                stats["written"] += len(chunk)
+            except OperationalError as e:
+                stats["errors"] += 1
+                stats["last_error"] = str(e)
+    finally:
+        connection.close()
+
+
+def run_db_pass(rows, threads, batch_size):
+    stats = [{"written": 0, "errors": 0} for _ in range(threads)]
+    workers = [
+        threading.Thread(target=db_insert_worker, args=(rows[i::threads], batch_size, stats[i]))
+        for i in range(threads)
+    ]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    written = sum(s["written"] for s in stats)
+    return {
+        "batch_size": batch_size,
+        "written": written,
+        "errors": sum(s["errors"] for s in stats),
+        "last_error": next((s["last_error"] for s in stats if "last_error" in s), None),
+        "elapsed_s": round(elapsed, 3),
+        "rows_per_s": round(written / elapsed, 1) if elapsed else None,
+    }
+
+
+def run_db(args):
+    setup_django()
+    from django.db import connection
+    from api.models import DroneData
+    from api.udp_server import parse_drone_packet
+
+    run_id = uuid.uuid4().hex[:8]
+    prefix = f"bench-{run_id}"
+
+    def make_rows(count):
+        return [parse_drone_packet(make_drone_packet(f"{prefix}-{i % 100}")) | {"trace_id": ""}
+                for i in range(count)]
+
+    per_row_count = min(args.rows, args.per_row_rows)
+    report = {
+        "run_id": run_id,
+        "backend": connection.vendor,
+        "threads": args.threads,
+    }
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            report["sqlite"] = {
+                pragma: cursor.execute(f'PRAGMA {pragma}').fetchone()[0]
+                for pragma in ('journal_mode', 'synchronous', 'busy_timeout')
+            }
+
+    try:
+        report["per_row"] = run_db_pass(make_rows(per_row_count), args.threads, 1)
+        report["batched"] = run_db_pass(make_rows(args.rows), args.threads, args.batch_size)
+        if report["per_row"]["rows_per_s"] and report["batched"]["rows_per_s"]:
+            report["speedup"] = round(report["batched"]["rows_per_s"] / report["per_row"]["rows_per_s"], 1)
+    finally:
+        DroneData.objects.filter(drone_id__startswith=prefix).delete()
+        connection.close()
+
+    return finish(report, args, [
+        ("per_row.errors", args.max_errors),
+        ("batched.errors", args.max_errors),
+    ])
+
+
+def measure_startup(settings_module, spool_dir):
+    """Время от запуска ingest.py до строки READY: снаружи и по часам процесса"""
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest.py'),
+        '--check', '--tcp-port', '0', '--udp-port', '0', '--settings', settings_module,
+    ]
+    env = dict(os.environ, TELEMETRY_SPOOL_DIR=spool_dir)
+    start = time.perf_counter()
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               text=True, env=env)
+    wall = internal = None
+    for line in process.stdout:
+        if line.startswith('READY '):
+            wall = time.perf_counter() - start
+            internal = float(line.split()[1]) / 1000
+            break
+    process.stdout.close()
+    process.wait()
+    return wall, internal
+
+
+def run_startup(args):
+    report = {"runs": args.runs}
+    with tempfile.TemporaryDirectory() as spool_dir:
+        for name, settings_module in (
+            ("lean", 'emergency_notification.settings_ingest'),
+            ("full", 'emergency_notification.settings'),
+        ):
+            walls, internals = [], []
+            for _ in range(args.runs):
+                wall, internal = measure_startup(settings_module, spool_dir)
+                if wall is not None:
+                    walls.append(wall)
+                    internals.append(internal)
+            report[name] = {
+                "settings": settings_module,
+                "failed_runs": args.runs - len(walls),
+                "until_ready": summarize_latency(walls),
+                "in_process": summarize_latency(internals),
+            }
+
+    return finish(report, args, [
+        ("lean.until_ready.p50_ms", args.max_startup_ms),
+    ])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def seed_node_database(template, path, ports):
+    """Копия мигрированной БД с реестром всех узлов (включая сам узел)"""
+    import shutil
+    import sqlite3
+
+    shutil.copyfile(template, path)
+    with sqlite3.connect(path) as db:
+        db.executemany(
+            "INSERT INTO api_server (ip_address, port, name, is_active, created_at) "
+            "VALUES ('127.0.0.1', ?, ?, 1, datetime('now'))",
+            [(port, f"bench-node-{index}") for index, port in enumerate(ports)]
+        )
+
+
+def start_node(index, directory, port):
+    """Процесс ingest.py узла федерации; возвращается после строки READY"""
+    env = dict(
+        os.environ,
+        DB_ENGINE='sqlite',
+        SQLITE_PATH=os.path.join(directory, f'node-{index}.sqlite3'),
+        TELEMETRY_SPOOL_DIR=os.path.join(directory, f'spool-{index}'),
+        NODE_ID=f'bench-node-{index}',
+        FEDERATION_ENABLED='1',
+    )
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ingest.py'),
+        '--host', '127.0.0.1', '--tcp-port', str(port), '--udp-port', '0', '--no-probes',
+    ]
+    log_file = open(os.path.join(directory, f'node-{index}.log'), 'a')
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log_file, text=True, env=env)
+    for line in process.stdout:
+        if line.startswith('READY '):
+            break
+    # Остальной вывод узла — в журнал, чтобы процесс не блокировался на записи
+    threading.Thread(target=lambda: log_file.writelines(process.stdout), daemon=True).start()
+    return process
+
+
+def stop_node(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def read_bench_events(path, run_id):
+    """События прогона в БД узла: описание → [(узел-источник, created_at), ...]"""
+    import sqlite3
+    from datetime import datetime, timezone
+
+    events = {}
+    with sqlite3.connect(path, timeout=10) as db:
+        rows = db.execute(
+            "SELECT description, origin_node, created_at FROM api_emergencyevent WHERE description LIKE ?",
+            (f"{BENCH_MARKER}:{run_id}:%",)
+        ).fetchall()
+    for description, origin_node, created_at in rows:
+        moment = datetime.fromisoformat(created_at).replace(tzinfo=timezone.utc).timestamp()
+        events.setdefault(description, []).append((origin_node, moment))
+    return events
+
+
+def run_federation(args):
+    run_id = uuid.uuid4().hex[:8]
+    base = os.path.dirname(os.path.abspath(__file__))
+    results = multiprocessing.Queue()
+    nodes = []
+    with tempfile.TemporaryDirectory() as directory:
+        template = os.path.join(directory, 'template.sqlite3')
+        subprocess.run(
+            [sys.executable, os.path.join(base, 'manage.py'), 'migrate', '--verbosity', '0'],
+            env=dict(os.environ, DB_ENGINE='sqlite', SQLITE_PATH=template), check=True
+        )
+        ports = [free_port() for _ in range(args.nodes)]
+        for index, port in enumerate(ports):
+            seed_node_database(template, os.path.join(directory, f'node-{index}.sqlite3'), ports)
+        try:
+            for index, port in enumerate(ports):
+                nodes.append(start_node(index, directory, port))
+            # Узлы, запущенные раньше соседей, переподключаются после паузы
+            time.sleep(args.warmup)
+
+            # Перезапускаемый узел не получает оповещений напрямую, только реплики
+            targets = ports[:-1] if args.bounce and args.nodes > 2 else ports
+            processes = [
+                multiprocessing.Process(
+                    target=agency_worker,
+                    args=(i, args.alert_rate, args.duration, '127.0.0.1', targets[i % len(targets)], run_id, results),
+                    daemon=True
+                )
+                for i in range(args.agencies)
+            ]
+            started = time.monotonic()
+            for process in processes:
+                process.start()
+            if args.bounce:
+                time.sleep(args.duration / 2)
+                stop_node(nodes[-1])
+                time.sleep(args.bounce)
+                nodes[-1] = start_node(args.nodes - 1, directory, ports[-1])
+            collected = collect(results, len(processes), timeout=args.duration + 30)
+            for process in processes:
+                process.join()
+            alerts_acked = sum(s["acked"] for s in collected["agencies"])
+
+            # Ждём, пока каждое оповещение появится на всех узлах
+            deadline = time.monotonic() + args.grace
+            while True:
+                snapshots = [
+                    read_bench_events(os.path.join(directory, f'node-{i}.sqlite3'), run_id)
+                    for i in range(args.nodes)
+                ]
+                descriptions = set().union(*snapshots)
+                complete = all(len(snapshot) == len(descriptions) for snapshot in snapshots)
+                if (complete and len(descriptions) >= alerts_acked) or time.monotonic() > deadline:
+                    break
+                time.sleep(0.2)
+            elapsed = time.monotonic() - started
+        finally:
+            for process in nodes:
+                stop_node(process)
+
+    lags, end_to_end, duplicates = [], [], 0
+    for snapshot in snapshots:
+        for description, copies in snapshot.items():
+            duplicates += len(copies) - 1
+            origin = next(
+                (moment for s in snapshots for node, moment in s.get(description, ()) if not node), None
+            )
+            sent_at = float(description.rsplit(':', 1)[1])
+            for node, moment in copies:
+                if node:
+                    end_to_end.append(max(moment - sent_at, 0.0))
+                    if origin is not None:
+                        lags.append(max(moment - origin, 0.0))
+
+    expected = len(descriptions) * (args.nodes - 1)
+    report = {
+        "run_id": run_id,
+        "nodes": args.nodes,
+        "bounce_s": args.bounce,
+        "duration_s": round(elapsed, 2),
+        "alerts": {
+            "agencies": args.agencies,
+            "sent": sum(s["sent"] for s in collected["agencies"]),
+            "acked": alerts_acked,
+            "errors": sum(s["errors"] for s in collected["agencies"]),
+            "ack_latency": summarize_latency([v for s in collected["agencies"] for v in s["ack_latencies"]]),
+        },
+        "replication": {
+            "expected": expected,
+            "replicated": len(lags) if lags else len(end_to_end),
+            "duplicates": duplicates,
+            "loss": round(1 - len(end_to_end) / expected, 4) if expected else None,
+            "lag": summarize_latency(lags),
+            "send_to_replica": summarize_latency(end_to_end),
+        },
+    }
+    return finish(report, args, [
+        ("replication.lag.p99_ms", args.max_lag_p99_ms),
+        ("replication.loss", args.max_loss),
+        ("replication.duplicates", args.max_duplicates),
+    ])
+
+
+def start_server(directory, http_port, tcp_port, udp_port):
+    """Процесс daphne с серверами приёма в том же процессе (как при runserver)"""
+    base = os.path.dirname(os.path.abspath(__file__))
+    env = dict(
+        os.environ,
+        DB_ENGINE='sqlite',
+        SQLITE_PATH=os.path.join(directory, 'server.sqlite3'),
+        TELEMETRY_SPOOL_DIR=os.path.join(directory, 'spool'),
+        TCP_SERVER_PORT=str(tcp_port),
+        UDP_SERVER_PORT=str(udp_port),
+    )
+    subprocess.run(
+        [sys.executable, os.path.join(base, 'manage.py'), 'migrate', '--verbosity', '0'],
+        env=env, check=True
+    )
+    log_path = os.path.join(directory, 'server.log')
+    log_file = open(log_path, 'a')
+    # RUN_MAIN: серверы приёма запускает api.apps, как при runserver
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'daphne', '-b', '127.0.0.1', '-p', str(http_port),
+         'emergency_notification.asgi:application'],
+        cwd=base, stdout=log_file, stderr=subprocess.STDOUT, env=dict(env, RUN_MAIN='true')
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            break
+        try:
+            socket.create_connection(('127.0.0.1', tcp_port), timeout=1).close()
+            urllib.request.urlopen(f'http://127.0.0.1:{http_port}/api/metrics/', timeout=2).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    stop_node(process)
+    with open(log_path, encoding='utf-8', errors='replace') as f:
+        tail = f.read()[-2000:]
+    raise RuntimeError(f"сервер не запустился:\n{tail}")
+
+
+def create_swarm_event(host, port):
+    """Событие, над которым летит рой; возвращает его id"""
+    with socket.create_connection((host, port), timeout=10) as client:
+        client.recv(4096)
+        alert = make_emergency_alert(title="Рой дронов", description="swarm", location="Бенчмарк рой")
+        client.send(json.dumps(alert).encode('utf-8'))
+        return json.loads(client.recv(4096).decode('utf-8'))["event_id"]
+
+
+def run_priority_phase(args, run_id, http_url):
+    results = multiprocessing.Queue()
+    metrics_before = scrape_metrics(http_url)
+    subscriber_stats, processes = asyncio.run(run_load_async(args, run_id, results))
+    if subscriber_stats is None:
+        return None
+    collected = collect(results, len(processes))
+    for process in processes:
+        process.join()
+    metrics_after = scrape_metrics(http_url)
+
+    alerts_acked = sum(s["acked"] for s in collected["agencies"])
+    expected = alerts_acked * len(subscriber_stats)
+    delivered = sum(s["received"] for s in subscriber_stats)
+    return {
+        "telemetry": {
+            "drones": args.drones,
+            "sent": sum(s["sent"] for s in collected["drones"]),
+            "persisted": metric_delta(metrics_before, metrics_after, 'udp_packets_total{stage="persisted"}'),
+            "coalesced": metric_delta(metrics_before, metrics_after, 'broadcast_telemetry_total{result="coalesced"}'),
+            "dropped": metric_delta(metrics_before, metrics_after, 'broadcast_telemetry_total{result="dropped"}'),
+            "delivered": sum(s.get("telemetry", 0) for s in subscriber_stats),
+        },
+        "alerts": {
+            "acked": alerts_acked,
+            "errors": sum(s["errors"] for s in collected["agencies"]),
+            "ack_latency": summarize_latency([v for s in collected["agencies"] for v in s["ack_latencies"]]),
+            # Где оповещение ждёт после подтверждения: очередь отправки и group_send
+            "queue_mean_ms": metric_mean_ms(metrics_before, metrics_after, 'broadcast_queue_seconds', '{lane="alert"}'),
+            "send_mean_ms": metric_mean_ms(
+                metrics_before, metrics_after, 'channel_layer_send_seconds', '{group="emergency_broadcasts"}'
+            ),
+        },
+        "delivery": {
+            "subscriber_errors": [s["error"] for s in subscriber_stats if "error" in s],
+            "expected": expected,
+            "delivered": delivered,
+            "loss": round(1 - delivered / expected, 4) if expected else None,
+            "latency": summarize_latency([v for s in subscriber_stats for v in s["latencies"]]),
+        },
+    }
+
+
+def run_priority(args):
+    run_id = uuid.uuid4().hex[:8]
+    http_port, tcp_port, udp_port = free_port(), free_port(), free_port()
+    http_url = f'http://127.0.0.1:{http_port}'
+    with tempfile.TemporaryDirectory() as directory:
+        server = start_server(directory, http_port, tcp_port, udp_port)
+        sampler = ProcessSampler(server.pid)
+        phases = {}
+        try:
+            common = dict(
+                vars(args),
+                tcp_host='127.0.0.1', tcp_port=tcp_port, udp_host='127.0.0.1', udp_port=udp_port,
+                ws_url=f'ws://127.0.0.1:{http_port}/ws/emergency/',
+                event_id=create_swarm_event('127.0.0.1', tcp_port),
+            )
+            sampler.start()
+            # Сначала оповещения без роя, затем те же оповещения при насыщающем рое
+            for name, drones in (('baseline', 0), ('saturated', args.drones)):
+                phase = run_priority_phase(
+                    argparse.Namespace(**dict(common, drones=drones)), f"{run_id}-{name}", http_url
+                )
+                if phase is None:
+                    return 2
+                phases[name] = phase
+        finally:
+            sampler.stop()
+            stop_node(server)
+
+    baseline_p99 = lookup(phases, "baseline.delivery.latency.p99_ms")
+    saturated_p99 = lookup(phases, "saturated.delivery.latency.p99_ms")
+    report = {
+        "run_id": run_id,
+        "hz": args.hz,
+        "phases": phases,
+        "alert_p99_slowdown": round(saturated_p99 / baseline_p99, 2) if baseline_p99 and saturated_p99 else None,
+        "server": sampler.report(),
+    }
+    return finish(report, args, [
+        ("phases.saturated.delivery.latency.p99_ms", args.max_alert_p99_ms),
+        ("phases.saturated.delivery.loss", args.max_loss),
+    ])
+
+
+def lookup(report, path):
+    value = report
+    for key in path.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def finish(report, args, thresholds):
+    """Напечатать отчёт, сохранить JSON и проверить пороги регрессии"""
+    failures = []
+    for path, limit in thresholds:
+        value = lookup(report, path)
+        if limit is not None and value is not None and value > limit:
+            failures.append(f"{path} = {value} > {limit}")
+    report["failures"] = failures
+
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    for failure in failures:
+        print(f"РЕГРЕССИЯ: {failure}")
+    return 1 if failures else 0
+
+
+def add_common_arguments(parser):
+    parser.add_argument('--json', help='Сохранить отчёт в JSON-файл')
+    parser.add_argument('--server-pid', type=int, help='PID процесса сервера для замера CPU/RSS')
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование системы оповещений')
+    subparsers = parser.add_subparsers(dest='scenario', required=True)
+
+    load = subparsers.add_parser('load', help='Рой дронов, поток оповещений и подписчики WebSocket')
+    add_common_arguments(load)
+    load.add_argument('--drones', type=int, default=100, help='Количество дронов')
+    load.add_argument('--hz', type=float, default=1.0, help='Частота телеметрии каждого дрона')
+    load.add_argument('--drone-procs', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                      help='Количество процессов роя')
+    load.add_argument('--agencies', type=int, default=2, help='Количество клиентов МЧС')
+    load.add_argument('--alert-rate', type=float, default=5.0,
+                      help='Оповещений в секунду от каждого клиента (0 — без паузы)')
+    load.add_argument('--subscribers', type=int, default=5, help='Количество подписчиков WebSocket')
+    load.add_argument('--duration', type=float, default=10.0, help='Длительность нагрузки, с')
+    load.add_argument('--grace', type=float, default=2.0, help='Ожидание доставки после нагрузки, с')
+    load.add_argument('--udp-host', default=DEFAULT_UDP_HOST)
+    load.add_argument('--udp-port', type=int, default=DEFAULT_UDP_PORT)
+    load.add_argument('--tcp-host', default=DEFAULT_TCP_HOST)
+    load.add_argument('--tcp-port', type=int, default=DEFAULT_TCP_PORT)
+    load.add_argument('--http-url', default=DEFAULT_HTTP_URL)
+    load.add_argument('--ws-url', default=DEFAULT_WS_URL)
+    load.add_argument('--max-alert-p99-ms', type=float, help='Порог p99 задержки доставки оповещений')
+    load.add_argument('--max-ack-p99-ms', type=float, help='Порог p99 подтверждения оповещений')
+    load.add_argument('--max-loss', type=float, help='Допустимая доля потерь (0..1)')
+    load.set_defaults(handler=run_load)
+
+    db = subparsers.add_parser('db', help='Запись телеметрии в БД: построчно против пачек')
+    add_common_arguments(db)
+    db.add_argument('--rows', type=int, default=20000, help='Строк для пакетной записи')
+    db.add_argument('--per-row-rows', type=int, default=2000, help='Строк для построчной записи')
+    db.add_argument('--threads', type=int, default=4, help='Параллельных потоков записи')
+    db.add_argument('--batch-size', type=int, default=500, help='Размер пачки')
+    db.add_argument('--max-errors', type=int, help='Допустимое число ошибок блокировки БД')
+    db.set_defaults(handler=run_db)
+
+    federation = subparsers.add_parser('federation', help='Репликация оповещений между узлами на localhost')
+    federation.add_argument('--json', help='Сохранить отчёт в JSON-файл')
+    federation.add_argument('--nodes', type=int, default=3, help='Количество узлов')
+    federation.add_argument('--agencies', type=int, default=3, help='Количество клиентов МЧС')
+    federation.add_argument('--alert-rate', type=float, default=20.0,
+                            help='Оповещений в секунду от каждого клиента (0 — без паузы)')
+    federation.add_argument('--duration', type=float, default=10.0, help='Длительность нагрузки, с')
+    federation.add_argument('--grace', type=float, default=15.0, help='Ожидание репликации после нагрузки, с')
+    federation.add_argument('--warmup', type=float, default=2.0,
+                            help='Пауза после запуска узлов для установления соединений, с')
+    federation.add_argument('--bounce', type=float, default=0,
+                            help='Остановить последний узел посреди прогона на столько секунд')
+    federation.add_argument('--max-lag-p99-ms', type=float, help='Порог p99 задержки репликации')
+    federation.add_argument('--max-loss', type=float, help='Допустимая доля непереданных реплик (0..1)')
+    federation.add_argument('--max-duplicates', type=int, help='Допустимое число дубликатов')
+    federation.set_defaults(handler=run_federation)
+
+    priority = subparsers.add_parser('priority', help='Задержка оповещений при насыщающем рое дронов')
+    priority.add_argument('--json', help='Сохранить отчёт в JSON-файл')
+    priority.add_argument('--drones', type=int, default=2000, help='Количество дронов в рое')
+    priority.add_argument('--hz', type=float, default=10.0, help='Частота телеметрии каждого дрона')
+    priority.add_argument('--drone-procs', type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                          help='Процессов, отправляющих телеметрию')
+    priority.add_argument('--agencies', type=int, default=2, help='Количество клиентов МЧС')
+    priority.add_argument('--alert-rate', type=float, default=5.0,
+                          help='Оповещений в секунду от каждого клиента')
+    priority.add_argument('--subscribers', type=int, default=5,
+                          help='Подписчиков WebSocket (подписаны на телеметрию роя)')
+    priority.add_argument('--duration', type=float, default=10.0, help='Длительность каждой фазы, с')
+    priority.add_argument('--grace', type=float, default=3.0, help='Ожидание доставки после фазы, с')
+    priority.add_argument('--max-alert-p99-ms', type=float,
+                          help='Порог p99 задержки доставки оповещений при рое')
+    priority.add_argument('--max-loss', type=float, help='Допустимая доля недоставленных оповещений (0..1)')
+    priority.set_defaults(handler=run_priority)
+
+    startup = subparsers.add_parser('startup', help='Время старта процесса приёма ingest.py')
+    startup.add_argument('--json', help='Сохранить отчёт в JSON-файл')
+    startup.add_argument('--runs', type=int, default=5, help='Количество запусков')
+    startup.add_argument('--max-startup-ms', type=float, help='Порог медианы времени старта (лёгкий режим)')
+    startup.set_defaults(handler=run_startup)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
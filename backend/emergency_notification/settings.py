@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -79,11 +80,41 @@ WSGI_APPLICATION = 'emergency_notification.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql переключает на PostgreSQL (параметры в POSTGRES_*)
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'emergency_notification'),
+            'USER': os.environ.get('POSTGRES_USER', 'postgres'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', '127.0.0.1'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': 60,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': 60,
+            'OPTIONS': {
+                # Сколько секунд ждать освобождения блокировки записи
+                'timeout': 20,
+            },
+        }
     }
+
+# Прагмы SQLite, применяемые к каждому новому соединению
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -141,8 +172,102 @@ CHANNEL_LAYERS = {
 
 # Настройки для UDP сервера
 UDP_SERVER_HOST = '127.0.0.1'
-UDP_SERVER_PORT = 5005
+UDP_SERVER_PORT = int(os.environ.get('UDP_SERVER_PORT', 5005))
 
 # Настройки для TCP сервера
 TCP_SERVER_HOST = '127.0.0.1'
-TCP_SERVER_PORT = 5006
+TCP_SERVER_PORT = int(os.environ.get('TCP_SERVER_PORT', 5006))
+
+# Идентификатор узла для репликации оповещений (по умолчанию имя хоста и порт TCP)
+NODE_ID = os.environ.get('NODE_ID', '')
+
+# Репликация оповещений на узлы из реестра серверов: размер пачки, ожидание
+# добора пачки и повторов (секунды), число пачек без подтверждения, длина очереди
+FEDERATION_ENABLED = os.environ.get('FEDERATION_ENABLED', '') in ('1', 'true', 'yes')
+FEDERATION_BATCH_SIZE = 100
+FEDERATION_LINGER = 0.005
+FEDERATION_PIPELINE_DEPTH = 4
+FEDERATION_QUEUE_SIZE = 10000
+FEDERATION_CONNECT_TIMEOUT = 3
+FEDERATION_ACK_TIMEOUT = 10
+FEDERATION_RETRY_INTERVAL = 0.5
+FEDERATION_MAX_BACKOFF = 30
+FEDERATION_RELOAD_INTERVAL = 10
+
+# Окно корреляции оповещений МЧС (секунды): повторы с тем же типом и местом
+# объединяются с уже созданным событием
+ALERT_CORRELATION_WINDOW = 120
+
+# Состояние дронов: без пакетов дольше DRONE_STALE_AFTER секунд дрон
+# считается stale, дольше DRONE_LOST_AFTER — lost, дольше DRONE_FORGET_AFTER
+# удаляется из таблицы состояний; пороги заряда в процентах
+DRONE_STALE_AFTER = 10
+DRONE_LOST_AFTER = 60
+DRONE_FORGET_AFTER = 24 * 60 * 60
+DRONE_BATTERY_THRESHOLDS = {'low': 20, 'critical': 10}
+DRONE_BATTERY_HYSTERESIS = 2
+
+# Очереди отправки в channel layer: предел ожидающей телеметрии (сообщений),
+# размер пачки сообщений одной группы, таймаут отправки (секунды) и число
+# повторов неотправленных оповещений и изменений состояния
+BROADCAST_TELEMETRY_LIMIT = 10000
+BROADCAST_BATCH_SIZE = 100
+BROADCAST_SEND_TIMEOUT = 5
+BROADCAST_RETRY_LIMIT = 3
+
+# Бинарный поток телеметрии для карты: кадров в секунду и предел размера
+# словаря идентификаторов дронов
+TELEMETRY_FRAME_RATE = 5
+TELEMETRY_MAX_DRONES = 100000
+
+# Геозоны событий: размер ячейки сетки (градусы), период обновления индекса
+# из БД (секунды) и предел ячеек на зону, сверх которого она проверяется всегда
+GEOFENCE_CELL_DEGREES = 0.01
+GEOFENCE_REFRESH_INTERVAL = 5
+GEOFENCE_MAX_CELLS = 4096
+
+# Проверка доступности серверов (модель Server): интервал, таймаут подключения
+# и предельная задержка после неудач в секундах, разброс интервала (доля),
+# число одновременных подключений и период перечитывания списка серверов
+SERVER_PROBE_INTERVAL = 15
+SERVER_PROBE_TIMEOUT = 3
+SERVER_PROBE_MAX_BACKOFF = 300
+SERVER_PROBE_JITTER = 0.2
+SERVER_PROBE_CONCURRENCY = 100
+SERVER_PROBE_RELOAD_INTERVAL = 30
+
+# Допуск упрощения траектории дрона по умолчанию (метры)
+TRACK_DEFAULT_TOLERANCE = 5.0
+
+# Сколько последних точек за период загружать для трека; более ранние
+# отбрасываются, а ответ помечается "truncated" — период стоит сузить
+TRACK_MAX_POINTS = 200000
+
+# Скользящее окно для перцентилей задержки доставки: длительность (секунды),
+# число интервалов, на которые оно делится, и предел хранимых выборок
+# на этап (при большей частоте сообщений выборка прореживается)
+LATENCY_WINDOW_SECONDS = 300
+LATENCY_WINDOW_SLOTS = 30
+LATENCY_WINDOW_MAX_SAMPLES = 10000
+
+# Пакетная запись телеметрии дронов
+TELEMETRY_BATCH_SIZE = 500
+TELEMETRY_FLUSH_INTERVAL = 0.05  # секунды
+
+# Спул телеметрии на диске на время задержек и недоступности БД
+TELEMETRY_SPOOL_DIR = os.environ.get('TELEMETRY_SPOOL_DIR', BASE_DIR / 'spool')
+TELEMETRY_SPOOL_SEGMENT_SIZE = 16 * 1024 * 1024  # байты
+TELEMETRY_SPOOL_MAX_SEGMENTS = 64
+
+# Журнал серверов приёма: очередь с фоновым выводом и выборка по категориям
+INGEST_LOGGING = {
+    'format': os.environ.get('INGEST_LOG_FORMAT', 'text'),  # 'text' или 'json'
+    'level': 'INFO',
+    'queue_size': 10000,
+    'sampling': {
+        # Одна запись на 100 пакетов каждого дрона
+        'ingest.udp.packet': {'every': 100, 'key': 'drone_id'},
+        # Не более 50 записей в секунду о сообщениях TCP-клиентов
+        'ingest.tcp.message': {'per_second': 50},
+    },
+}
@@ -0,0 +1,16 @@
+"""
+Настройки для отдельного процесса приёма (ingest.py).
+
+Наследуют основные настройки, но подключают только приложение api:
+admin, DRF, сессии, шаблоны и ASGI-приложение процессу приёма не нужны.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    'api',
+]
+
+MIDDLEWARE = []
+
+TEMPLATES = []
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Лёгкая точка входа для процесса приёма: TCP-оповещения МЧС и UDP-телеметрия.
+
+В отличие от manage.py runservers загружает только модели и настройки,
+нужные серверам приёма (emergency_notification.settings_ingest), поэтому
+быстро стартует при перезапуске воркеров во время развёртывания.
+
+Использование:
+    python ingest.py                     # TCP и UDP серверы
+    python ingest.py --no-tcp            # только UDP
+    python ingest.py --no-probes         # без проверки доступности серверов
+    python ingest.py --udp-port 0 --check  # запуститься, сообщить время старта и выйти
+"""
+
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+
+STARTED = time.perf_counter()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Серверы приёма оповещений и телеметрии')
+    parser.add_argument('--settings', default='emergency_notification.settings_ingest',
+                        help='Модуль настроек Django')
+    parser.add_argument('--no-tcp', action='store_true', help='Не запускать TCP сервер')
+    parser.add_argument('--no-udp', action='store_true', help='Не запускать UDP сервер')
+    parser.add_argument('--no-probes', action='store_true',
+                        help='Не проверять доступность зарегистрированных серверов')
+    parser.add_argument('--host', help='Адрес для TCP и UDP серверов')
+    parser.add_argument('--tcp-port', type=int)
+    parser.add_argument('--udp-port', type=int)
+    parser.add_argument('--check', action='store_true',
+                        help='Остановиться сразу после готовности (замер времени старта)')
+    args = parser.parse_args(argv)
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = args.settings
+    import django
+    django.setup()
+    from django.conf import settings
+
+    servers = []
+    if not args.no_tcp:
+        from api.tcp_server import start_tcp_server
+        tcp_server = start_tcp_server(args.host, args.tcp_port)
+        servers.append(tcp_server)
+        if settings.FEDERATION_ENABLED:
+            from api.federation import start_federation
+            servers.append(start_federation(tcp_server))
+    if not args.no_udp:
+        from api.udp_server import start_udp_server
+        servers.append(start_udp_server(args.host, args.udp_port))
+    if not args.no_probes:
+        from api.probes import start_probe_scheduler
+        servers.append(start_probe_scheduler())
+
+    ports = ' '.join(
+        f"{type(server).__name__}={server.port}" for server in servers if hasattr(server, 'port')
+    )
+    if not args.no_tcp:
+        ports += f" node={tcp_server.node_id}"
+    print(f"READY {(time.perf_counter() - STARTED) * 1000:.1f} ms {ports}", flush=True)
+
+    stop = threading.Event()
+    if not args.check:
+        # SIGTERM при плавном развёртывании: останавливаемся так же, как по Ctrl+C
+        signal.signal(signal.SIGTERM, lambda *_: stop.set())
+        try:
+            while not stop.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+
+    for server in servers:
+        server.stop()
+    from api.log import stop_ingest_logging
+    stop_ingest_logging()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
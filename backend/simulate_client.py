@@ -4,6 +4,7 @@
 Использование:
     python simulate_client.py tcp  # Для симуляции отправки уведомления МЧС по TCP
     python simulate_client.py udp  # Для симуляции отправки данных с дрона по UDP
+    python simulate_client.py bench [параметры]  # Нагрузочный тест (см. benchmark.py)
 """
 
 import socket
@@ -19,6 +20,46 @@ DEFAULT_TCP_PORT = 5006
 DEFAULT_UDP_HOST = '127.0.0.1'
 DEFAULT_UDP_PORT = 5005
 
+EVENT_TYPES = ["Пожар", "Наводнение", "Землетрясение", "Химическая авария", "Ураган"]
+LOCATIONS = ["Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань"]
+DRONE_STATUSES = ["Патрулирование", "Возвращение", "Мониторинг"]
+
+# Базовые координаты (центр Москвы)
+BASE_LAT, BASE_LON = 55.7558, 37.6173
+
+def make_emergency_alert(title=None, description=None, severity=None, location=None, radius_m=None):
+    """Сформировать сообщение emergency_alert от МЧС (с геозоной, если задан radius_m)"""
+    alert = {
+        "type": "emergency_alert",
+        "data": {
+            "title": title or f"Тестовое ЧС {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+            "description": description or "Это тестовое оповещение, созданное симулятором клиента МЧС",
+            "event_type": random.choice(EVENT_TYPES),
+            "location": location or random.choice(LOCATIONS),
+            "severity": severity or random.randint(1, 4)
+        }
+    }
+    if radius_m:
+        alert["data"].update({
+            "latitude": BASE_LAT + random.uniform(-0.01, 0.01),
+            "longitude": BASE_LON + random.uniform(-0.01, 0.01),
+            "radius_m": radius_m
+        })
+    return alert
+
+def make_drone_packet(drone_id, lat=None, lon=None, event_id=None):
+    """Сформировать UDP-пакет телеметрии дрона"""
+    return {
+        "id": drone_id,
+        "lat": BASE_LAT + random.uniform(-0.01, 0.01) if lat is None else lat,
+        "lon": BASE_LON + random.uniform(-0.01, 0.01) if lon is None else lon,
+        "alt": random.uniform(100, 200),  # высота в метрах
+        "speed": random.uniform(20, 60),  # скорость в км/ч
+        "battery": random.uniform(20, 100),  # заряд батареи в процентах
+        "status": random.choice(DRONE_STATUSES),
+        "event_id": event_id
+    }
+
 def simulate_tcp_client():
     """Симуляция клиента МЧС, отправляющего оповещение по TCP"""
     
@@ -41,19 +82,7 @@ def simulate_tcp_client():
             print(f"Подключено успешно. ID сессии: {session_id}")
             
             # Создание тестового события ЧС
-            event_types = ["Пожар", "Наводнение", "Землетрясение", "Химическая авария", "Ураган"]
-            locations = ["Москва", "Санкт-Петербург", "Новосибирск", "Екатеринбург", "Казань"]
-            
-            emergency_alert = {
-                "type": "emergency_alert",
-                "data": {
-                    "title": f"Тестовое ЧС {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                    "description": "Это тестовое оповещение, созданное симулятором клиента МЧС",
-                    "event_type": random.choice(event_types),
-                    "location": random.choice(locations),
-                    "severity": random.randint(1, 4)
-                }
-            }
+            emergency_alert = make_emergency_alert(radius_m=random.choice([300, 500, 1000]))
             
             # Отправка события
             print("Отправка оповещения о ЧС:")
@@ -100,25 +129,11 @@ def simulate_udp_client():
         # Генерация случайных данных дрона
         drone_id = f"drone-{random.randint(1, 10)}"
         
-        # Базовые координаты (центр Москвы)
-        base_lat, base_lon = 55.7558, 37.6173
-        
         # Отправка 10 пакетов с небольшими изменениями
         for i in range(10):
-            # Добавляем небольшие случайные отклонения к координатам
-            lat = base_lat + random.uniform(-0.01, 0.01)
-            lon = base_lon + random.uniform(-0.01, 0.01)
-            
-            drone_data = {
-                "id": drone_id,
-                "lat": lat,
-                "lon": lon,
-                "alt": random.uniform(100, 200),  # высота в метрах
-                "speed": random.uniform(20, 60),  # скорость в км/ч
-                "battery": random.uniform(20, 100),  # заряд батареи в процентах
-                "status": random.choice(["Патрулирование", "Возвращение", "Мониторинг"]),
-                "event_id": None if random.random() > 0.3 else random.randint(1, 5)  # иногда связываем с событием
-            }
+            # Иногда связываем данные с событием
+            event_id = None if random.random() > 0.3 else random.randint(1, 5)
+            drone_data = make_drone_packet(drone_id, event_id=event_id)
             
             # Печать данных
             print(f"Отправка данных дрона {i+1}/10:")
@@ -143,6 +158,7 @@ if __name__ == "__main__":
         print("Использование:")
         print("    python simulate_client.py tcp  # Для симуляции отправки уведомления МЧС по TCP")
         print("    python simulate_client.py udp  # Для симуляции отправки данных с дрона по UDP")
+        print("    python simulate_client.py bench [параметры]  # Нагрузочный тест")
         sys.exit(1)
         
     mode = sys.argv[1].lower()
@@ -151,7 +167,10 @@ if __name__ == "__main__":
         simulate_tcp_client()
     elif mode == "udp":
         simulate_udp_client()
+    elif mode == "bench":
+        from benchmark import main as run_benchmark
+        sys.exit(run_benchmark(sys.argv[2:]))
     else:
         print(f"Неизвестный режим: {mode}")
-        print("Используйте 'tcp' или 'udp'.")
+        print("Используйте 'tcp', 'udp' или 'bench'.")
         sys.exit(1) 
\ No newline at end of file
@@ -36,7 +36,15 @@ const createApiClient = (serverIp, serverPort) => {
       const response = await client.get('/drone-data/latest/');
       return response.data;
     },
-    
+
+    // Получение упрощённой траектории дрона за период
+    getDroneTrack: async (droneId, { from, to, tolerance } = {}) => {
+      const response = await client.get(`/drone-data/${encodeURIComponent(droneId)}/track/`, {
+        params: { from, to, tolerance }
+      });
+      return response.data;
+    },
+
     // Получение статистики
     getStatistics: async () => {
       const response = await client.get('/statistics/');
@@ -153,7 +153,7 @@ const Dashboard = () => {
             
             // Обновляем список последних событий
             setRecentEvents(prev => {
-              const updated = [newEvent, ...prev].slice(0, 5);
+              const updated = [newEvent, ...prev.filter(e => e.id !== newEvent.id)].slice(0, 5);
               return updated;
             });
           }
@@ -46,7 +46,7 @@ const EventsList = () => {
       if (Math.random() < 0.3) {
         const newEvent = generateRandomEvent();
         setEvents(prevEvents => {
-          const updatedEvents = [newEvent, ...prevEvents].slice(0, 20); // Ограничиваем 20 событиями
+          const updatedEvents = [newEvent, ...prevEvents.filter(e => e.id !== newEvent.id)].slice(0, 20); // Ограничиваем 20 событиями
           saveEvents(updatedEvents);
           return updatedEvents;
         });
@@ -71,7 +71,7 @@ const EventsList = () => {
           } else if (data.type === 'emergency_event') {
             const newEvent = data.event;
             setEvents(prevEvents => {
-              const updatedEvents = [newEvent, ...prevEvents].slice(0, 20);
+              const updatedEvents = [newEvent, ...prevEvents.filter(e => e.id !== newEvent.id)].slice(0, 20);
               saveEvents(updatedEvents);
               return updatedEvents;
             });
@@ -0,0 +1,77 @@
+/**
+ * Разбор бинарного потока телеметрии дронов (ws/telemetry/)
+ *
+ * Формат кадра описан в backend/api/telemetry.py: заголовок 24 байта и
+ * колонки little-endian. Колонки читаются типизированными массивами
+ * без копирования и без JSON.
+ */
+
+const HEADER_SIZE = 24;
+const FRAME_POSITIONS = 1;
+const FORMAT_VERSION = 1;
+
+/**
+ * Разбирает бинарный кадр положений дронов
+ * @param {ArrayBuffer} buffer - Кадр из WebSocket (binaryType = 'arraybuffer')
+ * @returns {Object|null} Заголовок и колонки кадра или null для неизвестного формата
+ */
+export const decodeTelemetryFrame = (buffer) => {
+  const view = new DataView(buffer);
+  if (view.getUint8(0) !== FRAME_POSITIONS || view.getUint8(1) !== FORMAT_VERSION) {
+    return null;
+  }
+  const count = view.getUint32(12, true);
+  let offset = HEADER_SIZE;
+  const column = (ArrayType) => {
+    const values = new ArrayType(buffer, offset, count);
+    offset += count * ArrayType.BYTES_PER_ELEMENT;
+    return values;
+  };
+  // Порядок колонок совпадает с COLUMNS на сервере
+  return {
+    epoch: view.getUint32(4, true),
+    dictionarySize: view.getUint32(8, true),
+    timestamp: view.getFloat64(16, true),
+    count,
+    latitude: column(Float64Array),
+    longitude: column(Float64Array),
+    index: column(Uint32Array),
+    altitude: column(Float32Array),
+    speed: column(Float32Array),
+    battery: column(Float32Array),
+  };
+};
+
+/**
+ * Подключение к потоку телеметрии
+ * @param {string} url - Адрес вида ws://host/ws/telemetry/
+ * @param {Function} onFrame - Вызывается с разобранным кадром и словарём идентификаторов дронов
+ * @returns {WebSocket} Открытое соединение
+ */
+export const connectTelemetry = (url, onFrame) => {
+  const socket = new WebSocket(url);
+  socket.binaryType = 'arraybuffer';
+  let epoch = null;
+  let droneIds = [];
+
+  socket.onmessage = (message) => {
+    if (typeof message.data === 'string') {
+      const data = JSON.parse(message.data);
+      if (data.type !== 'drone_dictionary') return;
+      // Смещение 0 — полный словарь, иначе дополнение
+      if (data.offset === 0 || data.epoch !== epoch) {
+        droneIds = [];
+      }
+      epoch = data.epoch;
+      data.drone_ids.forEach((droneId, i) => {
+        droneIds[data.offset + i] = droneId;
+      });
+      return;
+    }
+    const frame = decodeTelemetryFrame(message.data);
+    if (frame && frame.epoch === epoch && frame.dictionarySize <= droneIds.length) {
+      onFrame(frame, droneIds);
+    }
+  };
+  return socket;
+};